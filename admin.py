@@ -13,6 +13,26 @@
 #    Multiple Home Airports (mult_homes)
 #      Create a list of airport LED pin numbers, i.e. mult_homes=['170','172','173','176'] to highlight more than 1 home airport
 #      Leave blank if only one airport is to be used as a home airport and fill this in the web interface. i.e. mult_homes=[] 
+#    Weather Cache Directory (wx_cache_dir)
+#      Directory where wxfetch.py stores the FAA data so metar-v4.py, metar-display-v4.py, wipes-v4.py and webapp.py can share it.
+#    Weather Fetch Workers (wx_fetch_workers)
+#      Number of airport chunks requested from the FAA at the same time. Set to 1 to request them one after another.
+#    Weather Bulk File Airports (wx_bulk_airports)
+#      Maps with at least this many airports download the FAA's gzip'd file of every METAR and TAF in one request,
+#      and keep just the airports needed, rather than asking for the airports 50 at a time. 0 = never use the bulk file.
+#    Weather Servers (wx_endpoints)
+#      List of servers for the FAA weather API, primary first, i.e. wx_endpoints=['https://aviationweather.gov','https://aviationweather-cprk.ncep.noaa.gov']
+#      Backup servers are only asked when the one before it is slow or fails. They must serve the same API as aviationweather.gov.
+#      To test without the FAA, run the wxreplay.py stand-in server and set wx_endpoints=['http://localhost:8080']
+#    Weather Hedge Delay (wx_hedge_delay)
+#      Seconds to wait on a weather server before also asking the next one in wx_endpoints. 0 = only use the first server.
+#    Weather Refresh Schedule (wx_schedule)
+#      1 = learn when the airports publish their hourly METARs and time the updates to land just after. 0 = every update_interval minutes.
+#    Weather Response Format (wx_format)
+#      Format to ask the FAA API for; 'xml', 'json', 'csv' or 'raw'. TAF's are only available as 'xml' or 'json'.
+#      'raw' is the plain METAR text, decoded on the Pi, for METARs only. TAF's and station info use 'xml' with it.
+#      'auto' uses the fastest format found on this Pi by running 'python3 /NeoSectional/benchmark.py formats', or 'xml' until it's run.
+#      'auto' never picks 'raw', it has no airport locations.
 
 version='v4.600'
 map_name='LiveSectional'
@@ -22,4 +42,10 @@ use_scan_network=0
 use_reboot=0
 time_reboot='01:00'
 mult_homes=[]
-
+wx_cache_dir='/NeoSectional/wxcache'
+wx_fetch_workers=4
+wx_bulk_airports=0
+wx_endpoints=['https://aviationweather.gov']
+wx_hedge_delay=5
+wx_schedule=1
+wx_format='auto'
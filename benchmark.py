@@ -0,0 +1,744 @@
+#benchmark.py - by Mark Harris. Micro-benchmarks for the weather decoding used by metar-v4.py and metar-display-v4.py
+#    Each benchmark times the current code against the way it used to be done, on the same data, and checks both give
+#    the same answers. Runs without the LED's or OLED's attached, so it can be run on any Pi to see what helps there.
+#
+#    python3 /NeoSectional/benchmark.py decode                  - wxdecode.py flat records vs find() calls, 1,000 airports
+#    python3 /NeoSectional/benchmark.py decode --fixture /NeoSectional/wxreplay/metar.xml
+#                                                               - Use METARs recorded by wxreplay.py instead
+#    python3 /NeoSectional/benchmark.py parse                   - Streaming the FAA chunks into records vs building,
+#                                                                 merging and re-parsing the XML trees. Time and peak memory
+#    python3 /NeoSectional/benchmark.py formats                 - Download our airports' METARs and TAFs as XML, JSON and CSV
+#                                                                 and keep the fastest to download and parse for wx_format='auto'
+#    python3 /NeoSectional/benchmark.py formats --offline       - Size and parse time of each format for the made up data
+#    python3 /NeoSectional/benchmark.py raw                     - Decoding METARs from their raw text vs parsing the XML,
+#                                                                 both then decoded for the map as metar-v4.py does
+#    python3 /NeoSectional/benchmark.py classify                - wxdecode.classify() vs the old if/elif chains for the flight
+#                                                                 category, 100, 1,000 and 10,000 airports, with and without numpy
+#    python3 /NeoSectional/benchmark.py mos                     - wxmos.py reading the GFSMAV columns vs the old line splitting
+#                                                                 decoder, for 10 airports up to every one in it. Each value
+#                                                                 wxmos.py reads is checked against the bulletin's own text
+#                                                                 and the MOS saved for a restart is loaded vs read again
+#    python3 /NeoSectional/benchmark.py mos --gfsmav /NeoSectional/wxreplay/GFSMAV
+#    By default the data is made up, the same every run, so results can be compared between Pi's.
+
+#Import needed libraries
+import argparse
+import collections
+import gzip
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+import logzero
+import wxdecode
+import wxfetch
+import wxmos
+import wxreplay
+
+#Misc settings
+stations = 1000                                 #Airports in the made up data
+repeats = 5                                     #Times each decoder runs. The fastest run is reported
+seed = 1                                        #Same made up data every run
+taf_zulu = '2020-03-24T18:00:00Z'               #Time the TAF's are decoded for
+gfsmav = '/NeoSectional/GFSMAV'                 #MOS bulletin for the mos benchmark
+mos_sample = 100                                #Airports in a typical map, for the mos and classify benchmarks
+
+
+#Made up FAA response for 'count' airports, in the same form as the API. About 1 in 10 METARs have no flight
+#category, so the sky condition decode gets timed too. Half of those still give a visibility, unless 'bare_visibility'
+#is False, so the decode is seen to leave it out of the category like the old one did. The other METARs have the
+#category their sky and visibility give. Each METAR's raw_text matches it, for the raw text decoder.
+#TAF's have a few forecast periods each.
+def make_fixture(count, tag, bare_visibility=True):
+    rnd = random.Random(seed)
+    covers = ["SKC", "FEW", "SCT", "BKN", "OVC"]
+    wx = ["-RA", "BR", "TSRA", "-SN", "FG", "HZ"]
+    visibilities = {'10+': '10SM', '6': '6SM', '4': '4SM', '2.5': '2 1/2SM', '0.75': '3/4SM'}
+    root = ET.Element('response')
+    data = ET.SubElement(root, 'data', num_results=str(count))
+
+    #Adds the weather to 'element' and returns it as raw METAR groups.
+    def add_weather(element, no_base=False, visibility=True):
+        wind_dir = rnd.choice(['VRB', str(rnd.randrange(0, 360, 10))])
+        ET.SubElement(element, 'wind_dir_degrees').text = wind_dir
+        ET.SubElement(element, 'wind_speed_kt').text = str(rnd.randint(0, 35))
+        wind = ('VRB' if wind_dir == 'VRB' else '%03d' % int(wind_dir)) + '%02d' % int(element.findtext('wind_speed_kt'))
+        if rnd.random() < 0.2:
+            ET.SubElement(element, 'wind_gust_kt').text = str(rnd.randint(15, 45))
+            wind += 'G' + element.findtext('wind_gust_kt')
+        groups = [wind + 'KT']
+        if visibility:
+            ET.SubElement(element, 'visibility_statute_mi').text = rnd.choice(list(visibilities))
+            groups.append(visibilities[element.findtext('visibility_statute_mi')])
+        if rnd.random() < 0.3:
+            ET.SubElement(element, 'wx_string').text = rnd.choice(wx)
+            groups.append(element.findtext('wx_string'))
+        base = rnd.randint(2, 60) * 100
+        for n in range(rnd.randint(1, 3)):
+            cover = rnd.choice(covers)
+            if no_base and cover == "OVC" and n == 0:
+                ET.SubElement(element, 'sky_condition', sky_cover="OVX")
+                ET.SubElement(element, 'vert_vis_ft').text = str(base)
+                groups.append('VV%03d' % (base // 100))
+            else:
+                ET.SubElement(element, 'sky_condition', sky_cover=cover, cloud_base_ft_agl=str(base))
+                groups.append(cover if cover == "SKC" else cover + '%03d' % (base // 100))
+            base += rnd.randint(10, 50) * 100
+        return groups
+
+    for n in range(count):
+        stationId = 'K%03d' % n
+        element = ET.SubElement(data, tag)
+        raw_text = ET.SubElement(element, 'raw_text')
+        raw_text.text = stationId + ' 241853Z AUTO'
+        ET.SubElement(element, 'station_id').text = stationId
+        if tag == 'METAR':
+            ET.SubElement(element, 'observation_time').text = '2020-03-24T18:53:00Z'
+            ET.SubElement(element, 'latitude').text = '35.0'
+            ET.SubElement(element, 'longitude').text = '-111.0'
+            ET.SubElement(element, 'temp_c').text = '12.0'
+            ET.SubElement(element, 'dewpoint_c').text = '2.0'
+            reported = rnd.random() < 0.9
+            visibility = reported or (bare_visibility and rnd.random() < 0.5)
+            raw_text.text += ' ' + ' '.join(add_weather(element, visibility=visibility)) + ' 12/02 A2992'
+            ET.SubElement(element, 'altim_in_hg').text = '29.92'
+            if reported:                        #What the FAA works out
+                flightcategory = wxdecode.category(*wxdecode.record_limits(wxdecode.flatten(element)))
+                ET.SubElement(element, 'flight_category').text = flightcategory
+            ET.SubElement(element, 'metar_type').text = 'METAR'
+            ET.SubElement(element, 'elevation_m').text = '100'
+        else:
+            ET.SubElement(element, 'issue_time').text = '2020-03-24T17:30:00Z'
+            for hour in range(12, 36, 6):
+                forecast = ET.SubElement(element, 'forecast')
+                start = '2020-03-%02dT%02d:00:00Z' % (24 + hour // 24, hour % 24)
+                end = '2020-03-%02dT%02d:00:00Z' % (24 + (hour + 6) // 24, (hour + 6) % 24)
+                ET.SubElement(forecast, 'fcst_time_from').text = start
+                ET.SubElement(forecast, 'fcst_time_to').text = end
+                if hour > 12:
+                    ET.SubElement(forecast, 'change_indicator').text = 'FM'
+                add_weather(forecast, no_base=True)
+    return ET.tostring(root)
+
+
+#The METAR decode from metar-v4.py before wxdecode.py, less the logging. Calls find() for each field.
+def old_metars(root):
+    decoded = {}
+    for metar in root.findall('.//METAR'):
+        stationId = metar.find('station_id').text
+        if metar.find('flight_category') is None or metar.find('flight_category').text is None or metar.find('flight_category').text == 'NONE':
+            flightcategory = "VFR"
+            sky_cvr = "SKC"
+            if metar.find('forecast') is None or metar.find('forecast') == 'NONE':
+                for sky_condition in metar.findall('./sky_condition'):
+                    sky_cvr = sky_condition.attrib['sky_cover']
+                    if sky_cvr in ("OVC","BKN","OVX"):
+                        break
+            else:
+                for sky_condition in metar.findall('./forecast/sky_condition'):
+                    sky_cvr = sky_condition.attrib['sky_cover']
+                    if sky_cvr in ("OVC","BKN","OVX"):
+                        break
+            if sky_cvr in ("OVC","BKN","OVX"):
+                cld_base_ft_agl = int(sky_condition.attrib['cloud_base_ft_agl'])
+                if cld_base_ft_agl < 500:
+                    flightcategory = "LIFR"
+                elif 500 <= cld_base_ft_agl < 1000:
+                    flightcategory = "IFR"
+                elif 1000 <= cld_base_ft_agl <= 3000:
+                    flightcategory = "MVFR"
+                elif cld_base_ft_agl > 3000:
+                    flightcategory = "VFR"
+            if flightcategory != "LIFR":
+                if metar.find('./forecast/visibility_statute_mi') is not None:
+                    visibility_statute_mi = float(metar.find('./forecast/visibility_statute_mi').text.strip('+'))
+                    if visibility_statute_mi < 1.0:
+                        flightcategory = "LIFR"
+                    elif 1.0 <= visibility_statute_mi < 3.0:
+                        flightcategory = "IFR"
+                    elif 3.0 <= visibility_statute_mi <= 5.0 and flightcategory != "IFR":
+                        flightcategory = "MVFR"
+        else:
+            flightcategory = metar.find('flight_category').text
+
+        if metar.find('wind_speed_kt') is None:
+            windspeedkt = 0
+        else:
+            windspeedkt = metar.find('wind_speed_kt').text
+
+        if metar.find('wx_string') is None:
+            wxstring = "NONE"
+        else:
+            wxstring = metar.find('wx_string').text
+        decoded.setdefault(stationId, (flightcategory, windspeedkt, wxstring))
+    return decoded
+
+#The METAR decode in metar-v4.py now.
+def new_metars(records):
+    decoded = {}
+    for metar in records:
+        decoded.setdefault(metar['station_id'], (wxdecode.metar_category(metar), metar.get('wind_speed_kt', 0),
+                                                 metar.get('wx_string', "NONE")))
+    return decoded
+
+#The TAF decode from metar-v4.py before wxdecode.py, less the logging.
+def old_tafs(root, current_zulu):
+    decoded = {}
+    for taf in root.findall('.//TAF'):
+        stationId = taf.find('station_id').text
+        flightcategory, windspeedkt, wxstring = "NONE", 0, "NONE"
+        taf_wx_string = ""
+        taf_wind_speed_kt = ""
+        for forecast in taf.findall('forecast'):
+            flightcategory = "VFR"
+            taf_time_from = forecast.find('fcst_time_from').text
+            taf_time_to = forecast.find('fcst_time_to').text
+            if forecast.find('wx_string') is not None:
+                taf_wx_string = forecast.find('wx_string').text
+            if forecast.find('change_indicator') is not None:
+                taf_change_indicator = forecast.find('change_indicator').text
+            if forecast.find('wind_dir_degrees') is not None:
+                taf_wind_dir_degrees = forecast.find('wind_dir_degrees').text
+            if forecast.find('wind_speed_kt') is not None:
+                taf_wind_speed_kt = forecast.find('wind_speed_kt').text
+            if forecast.find('wind_gust_kt') is not None:
+                taf_wind_gust_kt = forecast.find('wind_gust_kt').text
+            if taf_time_from <= current_zulu <= taf_time_to:
+                for sky_condition in forecast.findall('sky_condition'):
+                    sky_cvr = sky_condition.attrib['sky_cover']
+                    if sky_cvr in ("OVC","BKN","OVX"):
+                        try:
+                            cld_base_ft_agl = sky_condition.attrib['cloud_base_ft_agl']
+                        except:
+                            cld_base_ft_agl = forecast.find('vert_vis_ft').text
+                        cld_base_ft_agl = int(cld_base_ft_agl)
+                        if cld_base_ft_agl < 500:
+                            flightcategory = "LIFR"
+                            break
+                        elif 500 <= cld_base_ft_agl < 1000:
+                            flightcategory = "IFR"
+                            break
+                        elif 1000 <= cld_base_ft_agl <= 3000:
+                            flightcategory = "MVFR"
+                            break
+                        elif cld_base_ft_agl > 3000:
+                            flightcategory = "VFR"
+                            break
+                if flightcategory != "LIFR":
+                    if forecast.find('visibility_statute_mi') is not None:
+                        visibility_statute_mi = float(forecast.find('visibility_statute_mi').text.strip('+'))
+                        if visibility_statute_mi < 1.0:
+                            flightcategory = "LIFR"
+                        elif 1.0 <= visibility_statute_mi < 3.0:
+                            flightcategory = "IFR"
+                        elif 3.0 <= visibility_statute_mi <= 5.0 and flightcategory != "IFR":
+                            flightcategory = "MVFR"
+                windspeedkt = taf_wind_speed_kt
+                wxstring = taf_wx_string
+        decoded.setdefault(stationId, (flightcategory, windspeedkt, wxstring))
+    return decoded
+
+#The TAF decode in metar-v4.py with wxdecode.py records, before the hourly TAF timeline fixed which period counts.
+#Kept to the same rules as old_tafs so the two decode the same.
+def new_tafs(records, current_zulu):
+    decoded = {}
+    for taf in records:
+        flightcategory, windspeedkt, wxstring = "NONE", 0, "NONE"
+        taf_wx_string = ""
+        taf_wind_speed_kt = ""
+        for forecast in taf.get('forecast', []):
+            flightcategory = "VFR"
+            taf_wx_string = forecast.get('wx_string', taf_wx_string)
+            taf_wind_speed_kt = forecast.get('wind_speed_kt', taf_wind_speed_kt)
+            if forecast['fcst_time_from'] <= current_zulu <= forecast['fcst_time_to']:
+                flightcategory = wxdecode.forecast_category(forecast)
+                windspeedkt = taf_wind_speed_kt
+                wxstring = taf_wx_string
+        decoded.setdefault(taf['station_id'], (flightcategory, windspeedkt, wxstring))
+    return decoded
+
+
+#Made up ceilings in feet and visibilities in miles for 'count' airports, not_reported where there isn't one, as
+#the decoders hand them to wxdecode.classify().
+def make_limits(count):
+    rnd = random.Random(seed)
+    missing = wxdecode.not_reported
+    ceilings = [rnd.choice([missing, missing, rnd.randrange(1, 120) * 100]) for n in range(count)]
+    visibilities = [rnd.choice([missing, 0.25, 0.5, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 10.0, 10.0, 10.0]) for n in range(count)]
+    return ceilings, visibilities
+
+#The flight category if/elif chains from metar-v4.py before wxdecode.classify(), one airport at a time.
+def old_categories(ceilings, visibilities):
+    categories = []
+    for cld_base_ft_agl, visibility_statute_mi in zip(ceilings, visibilities):
+        flightcategory = "VFR"
+        if cld_base_ft_agl == cld_base_ft_agl:  #Not NaN, there's a ceiling
+            if cld_base_ft_agl < 500:
+                flightcategory = "LIFR"
+            elif 500 <= cld_base_ft_agl < 1000:
+                flightcategory = "IFR"
+            elif 1000 <= cld_base_ft_agl <= 3000:
+                flightcategory = "MVFR"
+        if flightcategory != "LIFR" and visibility_statute_mi == visibility_statute_mi:
+            if visibility_statute_mi < 1.0:
+                flightcategory = "LIFR"
+            elif 1.0 <= visibility_statute_mi < 3.0:
+                flightcategory = "IFR"
+            elif 3.0 <= visibility_statute_mi <= 5.0 and flightcategory != "IFR":
+                flightcategory = "MVFR"
+        categories.append(flightcategory)
+    return categories
+
+#wxdecode.classify() as it runs without numpy.
+def python_categories(ceilings, visibilities):
+    return [wxdecode.category(ceiling, visibility) for ceiling, visibility in zip(ceilings, visibilities)]
+
+
+#Fastest of 'repeats' runs of 'decoder', in milliseconds, and what it decoded.
+def best_time(decoder, *args):
+    best = None
+    for n in range(repeats):
+        start = time.perf_counter()
+        decoded = decoder(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, decoded
+
+def report(label, old, new, count):
+    old_ms, old_decoded = old
+    new_ms, new_decoded = new
+    print('%-22s %6d airports  old %8.1f ms  new %8.1f ms  speedup %5.2fx  %s' %
+          (label, count, old_ms, new_ms, old_ms / new_ms, 'same results' if old_decoded == new_decoded else 'RESULTS DIFFER'))
+    return old_decoded == new_decoded
+
+#The FAA responses to benchmark, as (tag, content) for each product.
+def fixtures(args):
+    if args.fixture:
+        with open(args.fixture, 'rb') as f:
+            content = f.read()
+        return [('TAF' if b'<TAF>' in content else 'METAR', content)]
+    return [(tag, make_fixture(args.stations, tag)) for tag in ('METAR', 'TAF')]
+
+#Both decoders are given the same parsed tree, so the new one's time includes walking each element into its record.
+#How the records are parsed from the FAA responses is timed by the parse benchmark.
+def tree_metars(root):
+    return new_metars([wxdecode.flatten(element) for element in root.iter('METAR')])
+
+def tree_tafs(root, current_zulu):
+    return new_tafs([wxdecode.flatten(element) for element in root.iter('TAF')], current_zulu)
+
+def bench_decode(args):
+    same = True
+    for tag, content in fixtures(args):
+        root = ET.fromstring(content)
+        count = len(root.findall('.//' + tag))
+        if tag == 'METAR':
+            same &= report('METAR decode', best_time(old_metars, root), best_time(tree_metars, root), count)
+        else:
+            same &= report('TAF decode', best_time(old_tafs, root, args.zulu), best_time(tree_tafs, root, args.zulu), count)
+    return same
+
+
+#Split a response into chunks of 'size' airports, each a response of its own like the FAA sends.
+def split_response(content, tag, size):
+    elements = ET.fromstring(content).findall('.//' + tag)
+    chunks = []
+    for start in range(0, len(elements), size):
+        root = ET.Element('response')
+        ET.SubElement(root, 'data_source', name=tag.lower() + 's')
+        data = ET.SubElement(root, 'data', num_results=str(len(elements[start:start + size])))
+        data.extend(elements[start:start + size])
+        chunks.append(b'<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root))
+    return chunks
+
+#The way wxfetch.py used to handle the chunks. Each was parsed into a tree, its airports moved into one consolidated
+#tree and that written out as the product. The script then parsed the product again to decode it.
+def old_parse(chunks, tag):
+    root = ET.Element('response')
+    data_elem = ET.SubElement(root, 'data')
+    for result in chunks:
+        data_elem.extend(ET.fromstring(result).findall('.//' + tag))
+    content = ET.tostring(root)
+    return ET.fromstring(content)
+
+#The way wxfetch.py does it now. Each chunk is streamed into records as it arrives and the XML joined as it was sent.
+def new_parse(chunks, tag):
+    records = []
+    for result in chunks:
+        records.extend(wxdecode.parse_records(result, tag))
+    content = wxdecode.RecordStream.join(chunks, len(records))
+    return records
+
+#Peak memory in KB used by 'parser'.
+def peak_memory(parser, *args):
+    tracemalloc.start()
+    result = parser(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak / 1024
+
+def bench_parse(args):
+    same = True
+    print('Using ' + ('lxml' if wxdecode.lxml_etree is not None else 'ElementTree') + ' for the streaming parse')
+    for tag, content in fixtures(args):
+        chunks = split_response(content, tag, args.chunk)
+        old, new = best_time(old_parse, chunks, tag), best_time(new_parse, chunks, tag)
+        if tag == 'METAR':
+            old, new = (old[0], old_metars(old[1])), (new[0], new_metars(new[1]))
+        else:
+            old, new = (old[0], old_tafs(old[1], args.zulu)), (new[0], new_tafs(new[1], args.zulu))
+        same &= report(tag + ' parse', old, new, len(old[1]))
+        print('%-22s %6d chunks    old %8d KB  new %8d KB  peak memory' %
+              ('', len(chunks), peak_memory(old_parse, chunks, tag), peak_memory(new_parse, chunks, tag)))
+    return same
+
+
+#Our airports' responses in each format the API has for the product, as {format: (chunks, seconds to download)}.
+#Downloaded straight from the server, bypassing the weather cache, so every format is timed the same way.
+def download_formats(name, stations, server):
+    downloads = {}
+    for fmt in wxfetch.products[name]['formats']:
+        url = wxfetch.product_url(name, fmt)
+        chunks = []
+        start = time.perf_counter()
+        for chunk in wxfetch.split_stations(url, stations, wxfetch.chunk_sizes().get(name, wxfetch.chunk_size)):
+            response = wxfetch.session.get(server + url + ','.join(chunk), timeout=wxfetch.timeout)
+            response.raise_for_status()
+            chunks.append(response.content)
+        downloads[fmt] = (chunks, time.perf_counter() - start)
+    return downloads
+
+#The made up data in each format, converted the way wxreplay.py serves it. Nothing is downloaded.
+def convert_formats(name, content):
+    tag = wxfetch.products[name]['tag']
+    records = [wxdecode.flatten(element) for element in ET.fromstring(content).iter(tag)]
+    downloads = {'xml': ([content], 0.0),
+                 'json': ([json.dumps([wxreplay.api_item(record, tag) for record in records]).encode()], 0.0)}
+    if 'csv' in wxfetch.products[name]['formats']:
+        downloads['csv'] = ([wxreplay.csv_response(records)], 0.0)
+    if 'raw' in wxfetch.products[name]['formats']:
+        downloads['raw'] = ([''.join(record['raw_text'] + '\n' for record in records).encode()], 0.0)
+    return downloads
+
+#Every field the scripts read from a record, by station. Formats have to give all of them to be picked for 'auto'.
+#Numbers are compared as numbers, JSON gives 35.0 as 35.
+read_fields = ('raw_text', 'observation_time', 'issue_time', 'latitude', 'longitude', 'flight_category', 'wind_dir_degrees',
+               'wind_speed_kt', 'wind_gust_kt', 'visibility_statute_mi', 'vert_vis_ft', 'wx_string', 'sky_condition')
+
+def field_value(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+def record_fields(records):
+    fields = {}
+    for record in records:
+        fields.setdefault(record['station_id'], tuple(field_value(record.get(field)) for field in read_fields))
+    return fields
+
+def parse_chunks(chunks, tag, fmt):
+    records = []
+    for chunk in chunks:
+        records.extend(wxdecode.parse_records(chunk, tag, fmt))
+    return records
+
+#Time each format of the METARs and TAFs and check they all decode the same as XML, and give the same fields. The one
+#fastest to download and parse is saved in formats.json in the weather cache directory, where wx_format='auto' picks
+#it up. Formats in wxfetch.partial_formats are timed but left out, they don't give every field.
+def bench_formats(args):
+    same = True
+    fastest = {}
+    for name in ('metar', 'taf'):
+        tag = wxfetch.products[name]['tag']
+        if args.offline:
+            downloads = convert_formats(name, make_fixture(args.stations, tag, bare_visibility=False)) #See bench_raw()
+        else:
+            downloads = download_formats(name, wxfetch.station_list(wxfetch.read_airports(args.airports)), args.server)
+
+        decoded = {}
+        fields = {}
+        totals = {}
+        for fmt, (chunks, seconds) in downloads.items():
+            parse_ms, records = best_time(parse_chunks, chunks, tag, fmt)
+            decoded[fmt] = new_metars(records) if tag == 'METAR' else new_tafs(records, args.zulu)
+            fields[fmt] = record_fields(records)
+            size = sum(len(chunk) for chunk in chunks)
+            zipped = sum(len(gzip.compress(chunk)) for chunk in chunks)
+            if decoded[fmt] != decoded['xml']:
+                result = 'RESULTS DIFFER'
+            elif fmt in wxfetch.partial_formats:
+                result = 'same results, missing fields, not for auto'
+            elif fields[fmt] != fields['xml']:
+                result = 'FIELDS DIFFER'
+            else:
+                result = 'same results'
+            print('%-5s %-4s %6d airports  %8d KB  %6d KB gzip  download %8.1f ms  parse %8.1f ms  %s' %
+                  (tag, fmt, len(records), size / 1024, zipped / 1024, seconds * 1000, parse_ms, result))
+            same &= decoded[fmt] == decoded['xml']
+            if fmt not in wxfetch.partial_formats:
+                same &= fields[fmt] == fields['xml']
+                totals[fmt] = seconds * 1000 + parse_ms
+        fastest[name] = min(totals, key=totals.get)
+        print('%-10s fastest %s' % (tag, fastest[name]))
+
+    if not args.offline and same:
+        wxfetch.update_json('formats.json', lambda formats: formats.update(fastest))
+        print('Saved in ' + wxfetch.cache_dir + "/formats.json, used when wx_format='auto' in admin.py")
+    return same
+
+def bench_classify(args):
+    same = True
+    for count in (mos_sample, args.stations, args.stations * 10):
+        ceilings, visibilities = make_limits(count)
+        old = best_time(old_categories, ceilings, visibilities)
+        if wxdecode.numpy is not None:
+            same &= report('classify', old, best_time(wxdecode.classify, ceilings, visibilities), count)
+        else:
+            print('classify               numpy not installed, sudo pip3 install numpy')
+        same &= report('classify no numpy', old, best_time(python_categories, ceilings, visibilities), count)
+    return same
+
+#METARs from their raw text, decoded for the map. What metar-v4.py does with wx_format='raw'.
+def raw_metars(lines):
+    return new_metars(wxdecode.raw_metars(lines))
+
+#METARs parsed from the XML, decoded for the map.
+def xml_metars(content):
+    return new_metars(wxdecode.parse_records(content, 'METAR'))
+
+#The raw text decoder works out a category from the visibility too, as the FAA does, so the fixture's METARs without
+#a category don't give one here.
+def bench_raw(args):
+    content = make_fixture(args.stations, 'METAR', bare_visibility=False) if not args.fixture else fixtures(args)[0][1]
+    lines = [record['raw_text'] for record in wxdecode.parse_records(content, 'METAR')]
+    return report('raw METAR decode', best_time(xml_metars, content), best_time(raw_metars, lines), len(lines))
+
+
+#The MOS decoder from metar-v4.py before wxmos.py, with set_data() and its globals moved inside. Returns mos_dict,
+#airport -> hour -> values for 'categories' after HR, as strings, for the first 8 hours of the bulletin.
+def old_mos(lines, airports):
+    categories = ['HR', 'CLD', 'WDR', 'WSP', 'P06', 'T06', 'POZ', 'POS', 'TYP', 'CIG','VIS','OBV']
+    mos_dict = collections.OrderedDict()
+    state = {'hour_dict': collections.OrderedDict()}
+
+    def set_data(temp):
+        #Clean up line of MOS data.
+        temp1 = []
+        tmp_sw = 0
+        for val in temp:
+            val = val.lstrip()
+            val = val.rstrip('/')
+            if len(val) == 6:
+                temp1.append('0')
+                temp1.append(val)
+                tmp_sw = 1
+            elif len(val) > 2 and tmp_sw == 0:
+                pos = val.find('100')
+                tmp = val[0:pos]
+                temp1.append(tmp)
+                for j in range(pos, len(val), 3):
+                    temp1.append(val[j:j+3])
+            else:
+                temp1.append(val)
+        temp = temp1
+
+        for j, dat in enumerate(state['dats']):
+            dat.append([x.strip() for x in temp[j].split('/')][0])
+        hour_dict = state['hour_dict']
+        for j, key in enumerate(state['keys']):
+            hour_dict[key] = state['dats'][j]
+        mos_dict[state['apid']] = hour_dict
+
+    ap_flag = 0
+    for line in lines:
+        line = str(line)
+        if line.startswith('     '):
+            ap_flag = 0
+            continue
+        if 'DT /' in line:
+            continue
+        if 'MOS' in line:
+            unused, state['apid'], mos_date = line.split(" ",2)
+            if state['apid'] in airports:
+                ap_flag = 1
+                cat_counter = 0
+                state['dats'] = [[] for i in range(8)]
+            continue
+        if ap_flag:
+            xtra, cat, value = line.split(" ",2)
+            if cat in categories:
+                cat_counter += 1
+                if cat == 'HR':
+                    temp = (re.findall(r'\s?(\s*\S+)', value.rstrip()))
+                    for j in range(8):
+                        state['hour_dict'][temp[j].strip()] = ''
+                    state['keys'] = list(state['hour_dict'].keys())
+                else:
+                    if (cat_counter == 5 and cat != 'P06')\
+                            or (cat_counter == 6 and cat != 'T06')\
+                            or (cat_counter == 7 and cat != 'POZ')\
+                            or (cat_counter == 8 and cat != 'POS')\
+                            or (cat_counter == 9 and cat != 'TYP'):
+                        a = categories.index(last_cat)+1
+                        b = categories.index(cat)+1
+                        c = b - a - 1
+                        for j in range(c):
+                            set_data(['9'] * 19)
+                            cat_counter += 1
+                        cat_counter += 1
+                        state['hour_dict'] = collections.OrderedDict()
+                    last_cat = cat
+                    set_data(re.findall(r'\s?(\s*\S+)', value.rstrip()))
+                    state['hour_dict'] = collections.OrderedDict()
+    return mos_dict
+
+#The old decoder as metar-v4.py ran it, reading the file into lines first.
+def old_mos_file(data, airports):
+    return old_mos(data.decode('ascii').splitlines(True), airports)
+
+#The line of the bulletin wxmos.py's values for 'element' would print as, with leading zeros left off both.
+def render(report, element, values):
+    line = bytearray(b' %-4s' % element.encode() + b' ' * (len(values) * 3))
+    for n, value in enumerate(values):
+        column = wxmos.first_column + n * wxmos.column_width
+        if isinstance(value, tuple):
+            line[column - 3:column + 3] = b'%3d/%2d' % value
+        elif value is not None:
+            line[column:column + 3] = b'%3s' % str(value).encode()
+    return bytes(line).rstrip()
+
+def unpadded(line):
+    return re.sub(rb'(?<=[ /])0(?=\d)', b' ', line.rstrip())
+
+#Every value wxmos.py read, checked by printing it back into its column and comparing with the bulletin's line.
+#Returns the number of lines that don't match.
+def check_columns(data, reports):
+    lines = {}
+    station = None
+    for line in data.split(b'\n'):
+        fields = line.split()
+        if b'GUIDANCE' in fields:
+            station = fields[0].decode()
+        elif fields and station and line[1:4] not in (b'HR ', b'DT '):
+            lines.setdefault((station, line[1:4].decode().strip()), unpadded(line))
+    bad = 0
+    for station, report in reports.items():
+        for element, values in report.elements.items():
+            if unpadded(render(report, element, values)) != lines[(station, element)]:
+                bad += 1
+    return bad
+
+#wxmos.py's values the way the old decoder kept them, to compare the two. Elements the old decoder found missing
+#were '9'. P06 and T06 are left out, see mos_shifted().
+def as_old(reports):
+    dense = ['CLD', 'WDR', 'WSP', 'POZ', 'POS', 'TYP', 'CIG', 'VIS', 'OBV']
+    kept = {}
+    for station, report in reports.items():
+        for n, hour in enumerate(report.hours[:8]):
+            values = []
+            for element in dense:
+                value = report.value(element, n)
+                values.append('9' if value is None else value if isinstance(value, str) else '%02d' % value
+                              if element in ('WDR', 'WSP') else str(value))
+            kept[(station, '%02d' % hour)] = values
+    return kept
+
+def old_as_old(mos_dict):
+    dense = [0, 1, 2, 5, 6, 7, 8, 9, 10]        #CLD, WDR, WSP, POZ, POS, TYP, CIG, VIS, OBV
+    return {(station, hour): [values[j] for j in dense] for station, hours in mos_dict.items() for hour, values in hours.items()}
+
+#Airports the old decoder couldn't line up, where an element other than P06 to TYP is missing, i.e. WDR. It kept fewer
+#than 11 values for them, the rest shifted into the wrong element, and the scripts stopped with an IndexError.
+def old_misread(mos_dict):
+    return {station for station, hours in mos_dict.items() if any(len(values) != 11 for values in hours.values())}
+
+#Hours the old decoder used a P06 from another 6 hour period for, out of all it decoded. It took the first 8 values
+#on the line whatever their column, but P06 is only forecast every 6 hours.
+def mos_shifted(mos_dict, reports):
+    shifted = total = 0
+    for station, hours in mos_dict.items():
+        report = reports[station]
+        for n, (hour, values) in enumerate(hours.items()):
+            total += 1
+            shifted += str(report.window('P06', n)) != values[3]
+    return shifted, total
+
+#wxmos.read_cached() as the first call after a restart. 'saved' leaves the MOS saved by the last run, otherwise it's
+#removed so the bulletin has to be mapped, indexed and read again.
+def restart_mos(path, airports, saved):
+    wxmos.bulletins.clear()
+    wxmos.decoded.clear()
+    if not saved:
+        for filename in os.listdir(wxmos.cache_dir):
+            os.remove(os.path.join(wxmos.cache_dir, filename))
+    return wxmos.read_cached(path, airports)
+
+def bench_mos(args):
+    with open(args.gfsmav, 'rb') as f:
+        data = f.read()
+    reports = wxmos.parse(data)
+    bad = check_columns(data, reports)
+    print('wxmos.py read %d airports, %d lines that don\'t match the bulletin' % (len(reports), bad))
+
+    #The scripts read the bulletin through wxmos.open_bulletin(), mapped and indexed once each time the file changes,
+    #then only the airports on the map are read.
+    start = time.perf_counter()
+    wxmos.bulletins.clear()
+    wxmos.open_bulletin(args.gfsmav)
+    print('Mapped and indexed the bulletin in %.1f ms, once each time it changes' % ((time.perf_counter() - start) * 1000))
+
+    same = bad == 0
+    everyone = list(reports)
+    for count in (10, mos_sample, 1000, len(everyone)):
+        airports = everyone[::max(1, len(everyone) // count)][:count]
+        old = best_time(old_mos_file, data, airports)
+        new = best_time(wxmos.read_file, args.gfsmav, airports)
+        misread = old_misread(old[1])
+        for station in misread:
+            del old[1][station], new[1][station]
+        same &= report('MOS decode', (old[0], old_as_old(old[1])), (new[0], as_old(new[1])), len(airports))
+
+    #After a restart the scripts load the MOS saved by wxmos.read_cached() instead of reading the bulletin. Saved to a
+    #temp directory so the real cache isn't touched.
+    wxmos.cache_dir = tempfile.mkdtemp()
+    try:
+        airports = everyone[::max(1, len(everyone) // mos_sample)][:mos_sample]
+        read = best_time(restart_mos, args.gfsmav, airports, False)
+        loaded = best_time(restart_mos, args.gfsmav, airports, True)
+        same &= report('MOS after restart', (read[0], as_old(read[1])), (loaded[0], as_old(loaded[1])), len(airports))
+    finally:
+        shutil.rmtree(wxmos.cache_dir)
+
+    mos_dict = old_mos_file(data, everyone)
+    misread = old_misread(mos_dict)
+    shifted, total = mos_shifted({station: hours for station, hours in mos_dict.items() if station not in misread}, reports)
+    print('Old decoder misread %d airports with missing elements: %s' % (len(misread), ' '.join(sorted(misread))))
+    print('Old decoder used the P06 of another 6 hours for %d of %d hours, T06 the same way' % (shifted, total))
+    return same
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the weather decoding against the way it used to be done')
+    parser.add_argument('benchmark', choices=['decode', 'parse', 'formats', 'classify', 'raw', 'mos'])
+    parser.add_argument('--stations', type=int, default=stations, help='airports in the made up data')
+    parser.add_argument('--fixture', help='FAA XML file to use instead of made up data, i.e. one recorded by wxreplay.py')
+    parser.add_argument('--zulu', default=taf_zulu, help='time to decode TAFs for, i.e. 2020-03-24T18:00:00Z')
+    parser.add_argument('--chunk', type=int, default=wxfetch.chunk_size, help='airports per FAA response for parse')
+    parser.add_argument('--airports', default=wxfetch.airports_file, help='airports to download for formats')
+    parser.add_argument('--server', default=wxfetch.endpoints[0], help='weather server for formats, i.e. http://localhost:8080')
+    parser.add_argument('--offline', action='store_true', help='formats on the made up data, without downloading')
+    parser.add_argument('--gfsmav', default=gfsmav, help='MOS bulletin for mos')
+    args = parser.parse_args()
+
+    logzero.loglevel(logging.WARNING)            #Logging each airport would swamp the timing
+    benchmarks = {'decode': bench_decode, 'parse': bench_parse, 'formats': bench_formats, 'classify': bench_classify, 'raw': bench_raw,
+                  'mos': bench_mos}
+    if not benchmarks[args.benchmark](args):
+        raise SystemExit(1)
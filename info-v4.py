@@ -10,6 +10,7 @@ from datetime import datetime
 import logging
 import logzero
 from logzero import logger
+import wxmos #Reads the GFSMAV MOS bulletin
 
 # Setup rotating logfile with 3 rotations, each with a maximum filesize of 1MB:
 version = admin.version          #Software version
@@ -29,33 +30,21 @@ mos_filepath = '/NeoSectional/GFSMAV'      #location of the downloaded local MOS
 
 #Functions
 def get_mos_date():
-    #Read current MOS text file
+    #Read the first airport's header from the current MOS text file, the rest of the file isn't read. See wxmos.py
     try:
-        file = open(mos_filepath, 'r')
-        lines = file.readlines()
+        header = wxmos.first_header(mos_filepath)
     except IOError as error:
         logger.error('MOS data file could not be loaded.')
         logger.error(error)
+        header = None
+
+    if header is None:
         mos_date = ' No MOS Date Reported\n'
         return mos_date
 
-    for line in lines:      #read the MOS data file line by line0
-        line = str(line)
-
-        #Ignore blank lines of MOS airport
-        if line.startswith('     '):
-            ap_flag = 0
-            continue
-
-        #Check for and grab date of MOS
-        if 'DT /' in line:
-            unused, dt_cat, month, unused, unused, day, unused = line.split(" ",6)
-            continue
-
-        #Check for and grab the Airport ID of the current MOS
-        if 'MOS' in line:
-            unused, apid, mos_date = line.split(" ",2)
-            return mos_date
+    #Grab the date of the MOS, after the Airport ID
+    unused, apid, mos_date = header.split(" ",2)
+    return mos_date + '\n'
 
 
 #Executed code
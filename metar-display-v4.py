@@ -19,6 +19,10 @@
 #     Added ability to specifiy an exclusive subset of airports to display.
 #     Added ability to display text rotated 180 degrees, and/or reverse order of display of multiple OLED's if wired backwards
 #     Added fix to Sleep Timer. Thank You to Matthew G for your code to make this work.
+#     FAA data is now retrieved through wxfetch.py which shares it with metar-v4.py, so the OLED's and LED's stay in sync.
+#     Displays 'Stale' with the time of the last good data when the FAA isn't available.
+#     METARs and TAF's are read through wxdecode.py, which walks each report once rather than searching it for every field.
+#     Only METARs that are new since the last update are decoded, see metar_decoder.
 
 #Displays airport ID, wind speed in kts and wind direction on an LCD or OLED display.
 #Wind direction uses an arrow to display general wind direction from the 8 cardinal points on a compass.
@@ -74,8 +78,6 @@
 
 #Import needed libraries
 #Misc libraries
-import urllib.request, urllib.error, urllib.parse
-import xml.etree.ElementTree as ET
 import time
 import sys
 import os
@@ -86,7 +88,6 @@ from datetime import time as time_ #part of timer fix
 import operator
 import RPi.GPIO as GPIO
 import socket
-import collections
 import re
 import random
 import logging
@@ -94,6 +95,10 @@ import logzero
 from logzero import logger
 import config                                   #User settings stored in file config.py, used by other scripts
 import admin
+import wxfetch                                  #Shared FAA weather fetcher, so all scripts use the same data
+import wxdecode                                 #Walks each METAR and TAF once into a flat record and works out flight categories
+import wxtable                                  #The weather metar-v4.py is showing on the LED's, already decoded
+import wxmos                                    #Reads the GFSMAV MOS bulletin by column
 
 #LCD Libraries - Only needed if an LCD Display is to be used. Comment out if you would like.
 #Visit; http://www.circuitbasics.com/raspberry-pi-lcd-set-up-and-programming-in-python/ and follow info for 4-bit mode.
@@ -287,13 +292,11 @@ temp_lights_on = 0                      #Set flag for next round if sleep timer
 
 #MOS related settings
 mos_filepath = '/NeoSectional/GFSMAV'           #location of the downloaded local MOS file.
-categories = ['HR', 'CLD', 'WDR', 'WSP', 'P06', 'T06', 'POZ', 'POS', 'TYP', 'CIG','VIS','OBV'] #see legend below
 obv_wx = {'N': 'None', 'HZ': 'HZ','BR': 'RA','FG': 'FG','BL': 'HZ'} #Decode from MOS to TAF/METAR
 typ_wx = {'S': 'SN','Z': 'FZRA','R': 'RA'}      #Decode from MOS to TAF/METAR
-mos_dict = collections.OrderedDict()            #Outer Dictionary, keyed by airport ID
-hour_dict = collections.OrderedDict()           #Middle Dictionary, keyed by hour of forcast. Will contain a list of data for categories.
-ap_flag = 0                                     #Used to determine that an airport from our airports file is currently being read.
 hmdata_dict = {}                                #Used for top 10 list for heat map
+last_product_key = None                         #Name and hash of the last METARs decoded. Used to skip decoding when unchanged
+wx_table = wxtable.TableReader()                #Reads the weather metar-v4.py publishes, see wxtable.py
 startnum = 0                                    #Used for cycling through the number of displays used.
 stopnum = numofdisplays                         #Same
 stepnum = 1                                     #Same
@@ -466,86 +469,31 @@ def comp_time(taf_time):
     diff_hours = int(diff_minutes/60)
     return diff.seconds, diff_minutes, diff_hours, diff.days
 
-#Used by MOS decode routine. This routine builds mos_dict nested with hours_dict
-def set_data():
-    global hour_dict
-    global mos_dict
-    global dat0, dat1, dat2, dat3, dat4, dat5, dat6, dat7
-    global apid
-    global temp
-    global keys
-
-    #Clean up line of MOS data.
-    if len(temp) >= 0:                          #this check is unneeded. Put here to vary length of list to clean up.
-        temp1 = []
-        tmp_sw = 0
-
-        for val in temp:                        #Check each item in the list
-            val = val.lstrip()                  #remove leading white space
-            val = val.rstrip('/')               #remove trailing /
-
-            if len(val) == 6:                   #this is for T06 to build appropriate length list
-                temp1.append('0')               #add a '0' to the front of the list. T06 doesn't report data in first 3 hours.
-                temp1.append(val)               #add back the original value taken from T06
-                tmp_sw = 1                      #Turn on switch so we don't go through it again.
-
-            elif len(val) > 2 and tmp_sw == 0:  #if item is 1 or 2 chars long, then bypass. Otherwise fix.
-                pos = val.find('100')           #locate first 100
-                tmp = val[0:pos]                #capture the first value which is not a 100
-                temp1.append(tmp)               #and store it in temp list.
+#METAR decode routine. Grab the airport category, wind speed and various weather from the results given from FAA.
+#Only called for an airport's METAR when it's new since the last update, see metar_decoder below.
+def decode_metar(metar):
+    #grab flight category from returned FAA data
+    flightcategory = metar.get('flight_category', "NONE") #if category is blank, then bypass
 
-                k = 0
-                for j in range(pos, len(val), 3): #now iterate through remainder
-                    temp1.append(val[j:j+3])    #and capture all the 100's
-                    k += 1
-            else:
-                temp1.append(val)               #Store the normal values too.
-
-        temp = temp1
-
-    #load data into appropriate lists by hours designated by current MOS file
-    #clean up data by removing '/' and spaces
-    temp0 = ([x.strip() for x in temp[0].split('/')])
-    temp1 = ([x.strip() for x in temp[1].split('/')])
-    temp2 = ([x.strip() for x in temp[2].split('/')])
-    temp3 = ([x.strip() for x in temp[3].split('/')])
-    temp4 = ([x.strip() for x in temp[4].split('/')])
-    temp5 = ([x.strip() for x in temp[5].split('/')])
-    temp6 = ([x.strip() for x in temp[6].split('/')])
-    temp7 = ([x.strip() for x in temp[7].split('/')])
-
-    #build a list for each data group. grab 1st element [0] in list to store.
-    dat0.append(temp0[0])
-    dat1.append(temp1[0])
-    dat2.append(temp2[0])
-    dat3.append(temp3[0])
-    dat4.append(temp4[0])
-    dat5.append(temp5[0])
-    dat6.append(temp6[0])
-    dat7.append(temp7[0])
-
-    j = 0
-    for key in keys:                            #add cat data to the hour_dict by hour
-
-        if j == 0:
-            hour_dict[key] = dat0
-        elif j == 1:
-            hour_dict[key] = dat1
-        elif j == 2:
-            hour_dict[key] = dat2
-        elif j == 3:
-            hour_dict[key] = dat3
-        elif j == 4:
-            hour_dict[key] = dat4
-        elif j == 5:
-            hour_dict[key] = dat5
-        elif j == 6:
-            hour_dict[key] = dat6
-        elif j == 7:
-            hour_dict[key] = dat7
-        j += 1
-
-        mos_dict[apid] = hour_dict              #marry the hour_dict to the proper key in mos_dict
+    #grab wind speeds from returned FAA data
+    windspeedkt = int(metar.get('wind_speed_kt', 0)) #if wind speed is blank, then bypass
+
+    #grab wind gust from returned FAA data - Lance Blank
+    windgustkt = int(metar.get('wind_gust_kt', 0)) #if wind speed is blank, then bypass
+
+    #grab wind direction from returned FAA data
+    winddirdegree = metar.get('wind_dir_degrees', 0) #if wind speed is blank, then bypass
+    if winddirdegree == 'VRB':
+        winddirdegree = 0
+    else:
+        winddirdegree = int(winddirdegree)
+
+    #grab Weather info from returned FAA data
+    wxstring = metar.get('wx_string', "NONE") #if weather string is blank, then bypass
+
+    return flightcategory, windspeedkt, winddirdegree, wxstring, windgustkt
+
+metar_decoder = wxdecode.IncrementalDecoder(decode_metar) #Keeps each airport's last METAR and what it decoded to
 
 ##########################
 # Start of executed code #
@@ -567,13 +515,6 @@ while True:
     now = datetime.now()
     dt_string = now.strftime("%I:%M%p")         #12:00PM format
 
-    #Dictionary definitions. Need to reset whenever new weather is received
-    stationiddict = {}                          #hold the airport identifiers
-    windsdict = {}                              #holds the wind speeds by identifier
-    wnddirdict = {}                             #holds the wind direction by identifier
-    wxstringdict = {}                           #holds the weather conditions by identifier
-    wndgustdict = {}                            #hold wind gust by identifier - Mez
-
     #read airports file - read each time weather is updated in case a change to "airports" file was made while script was running.
     try:
         with open("/NeoSectional/airports") as f:
@@ -606,17 +547,15 @@ while True:
     hmdata_sorted.insert(0, 'Top AP\nLandings')
     print(hmdata_sorted)
 
-    #depending on what data is to be displayed, either use an URL for METARs and TAFs or read file from drive (pass).
+    #depending on what data is to be displayed, either get METARs and TAFs from wxfetch.py or read file from drive (pass).
     if metar_taf_mos == 1: #Check to see if the script should display TAF data (0) or METAR data (1)
-        #Define URL to get weather METARS. If no METAR reported withing the last 2.5 hours, Airport LED will be white (nowx).
-        #url = "https://aviationweather-cprk.ncep.noaa.gov/adds/dataserver_current/httpparam?dataSource=metars&requestType=retrieve&format=xml&mostRecentForEachStation=constraint&hoursBeforeNow="+str(metar_age)+"&stationString="
-        url = "https://aviationweather.gov/api/data/metar?format=xml&hours=" +str(metar_age)+ "&ids="
+        #METARs are retrieved through wxfetch.py. If no METAR reported withing the last 2.5 hours, Airport LED will be white (nowx).
+        product_name = 'metar'
         logger.info("METAR Data Loading")
 
     elif metar_taf_mos == 0: #TAF data
-        #Define URL to get weather URL for TAF. If no TAF reported for an airport, the Airport LED will be white (nowx).
-        #url = "https://aviationweather-cprk.ncep.noaa.gov/adds/dataserver_current/httpparam?dataSource=tafs&requestType=retrieve&format=xml&mostRecentForEachStation=constraint&hoursBeforeNow="+str(metar_age)+"&stationString="
-        url = "https://aviationweather.gov/api/data/taf?format=xml&hours=" +str(metar_age)+ "&ids="
+        #TAFs are retrieved through wxfetch.py. If no TAF reported for an airport, the Airport LED will be white (nowx).
+        product_name = 'taf'
         logger.info("TAF Data Loading")
 
     elif metar_taf_mos == 2:                    #MOS data. This is not accessible in the same way as METARs and TAF's.
@@ -627,394 +566,162 @@ while True:
         pass                                    #This elif is not strictly needed and is only here for clarity
         logger.info("Heat Map Data Loading")
 
-    #Build URL to submit to FAA with the proper airports from the airports file
-    if metar_taf_mos != 2 and metar_taf_mos != 3:
-        for airportcode in airports:
-            if airportcode == "NULL" or airportcode == "LGND":
-                continue
-            url = url + airportcode + ","
-        url = url[:-1]                          #strip trailing comma from string
-        logger.debug(url)
-
-        while True:                             #check internet availability and retry if necessary. Power outage, map may boot quicker than router.
-            try:
-                content = urllib.request.urlopen(url)
-                logger.info('Internet Available')
-                logger.info(url)
-                break
-            except:
-                logger.warning('FAA Data is Not Available')
-                logger.info(url)
-                time.sleep(delay_time)
-                pass
-
-        root = ET.fromstring(content.read())    #Process XML data returned from FAA
+    #If metar-v4.py is showing the same thing on the LED's, use the weather it decoded so the OLED's agree with the map.
+    #Otherwise, i.e. metar-v4.py isn't running or its rotary switch is set differently, get and decode it here.
+    shared = None
+    if metar_taf_mos != 3:
+        shared = wx_table.current(metar_taf_mos, hour_to_display, update_interval * 60 * 2)
+
+    wx_stale = False                            #True if the FAA couldn't be reached and the last good data is displayed
+    #Get the FAA data for the airports in the airports file. wxfetch.py shares it with metar-v4.py so both show the same weather.
+    product_key = None
+    if shared is not None:
+        product_key = ('table', shared.generation) #A new generation is new weather
+        dt_string = datetime.fromtimestamp(shared.published).strftime("%I:%M%p")
+        logger.info('Using the Weather Published by metar-v4.py')
+
+    elif metar_taf_mos != 2 and metar_taf_mos != 3:
+        product = wxfetch.get_product(product_name, airports)
+        product_key = (product_name, product.hash)
+
+        if product.stale:                       #FAA not available, showing last good data. Display the time it was retrieved
+            dt_string = datetime.fromtimestamp(product.fetched).strftime("%I:%M%p")
+            wx_stale = True
+
+    #If these are the same METARs decoded last time, skip parsing and decoding. The dictionaries are still good.
+    #TAFs are always decoded since the time period to display moves along with the clock, unless metar-v4.py decoded them.
+    wx_unchanged = (metar_taf_mos == 1 or shared is not None) and product_key == last_product_key
+    if wx_unchanged:
+        logger.info('METAR Data Unchanged Since Last Update, Skipping Decode')
+    else:
+        #Dictionary definitions. Need to reset whenever new weather is received
+        stationiddict = {}                      #hold the airport identifiers
+        windsdict = {}                          #holds the wind speeds by identifier
+        wnddirdict = {}                         #holds the wind direction by identifier
+        wxstringdict = {}                       #holds the weather conditions by identifier
+        wndgustdict = {}                        #hold wind gust by identifier - Mez
+
+        if shared is not None:                  #Already decoded by metar-v4.py, one row per LED pin
+            for wx in shared.rows:
+                if wx.reported and wx.station not in stationiddict:
+                    stationiddict[wx.station] = wx.category.name #build category dictionary
+                    windsdict[wx.station] = wx.wind #build windspeed dictionary
+                    wnddirdict[wx.station] = wx.wind_dir #build wind direction dictionary
+                    wxstringdict[wx.station] = wx.weather #build weather dictionary
+                    wndgustdict[wx.station] = wx.gust #build windgust dictionary
+
+        elif product_key is not None:
+            records = product.records           #FAA data returned, parsed into records by wxfetch.py
 
     #MOS decode routine
     #MOS data is downloaded daily from; https://www.weather.gov/mdl/mos_gfsmos_mav to the local drive by crontab scheduling.
-    #Then this routine reads through the entire file looking for those airports that are in the airports file. If airport is
-    #found, the data needed to display the weather for the next 24 hours is captured into mos_dict, which is nested with
-    #hour_dict, which holds the airport's MOS data by 3 hour chunks. See; https://www.weather.gov/mdl/mos_gfsmos_mavcard for
-    #a breakdown of what the MOS data looks like and what each line represents.
-    if metar_taf_mos == 2:
-        #Read current MOS text file
+    #Then wxmos.py reads the MOS of each airport in the airports file from it, every value from its own column, by
+    #forecast hour. See; https://www.weather.gov/mdl/mos_gfsmos_mavcard for a breakdown of what the MOS data looks like
+    #and what each line represents.
+    if metar_taf_mos == 2 and shared is None:
+        #Read current MOS text file, or the MOS saved from it if it hasn't changed since
         try:
-            file = open(mos_filepath, 'r')
-            lines = file.readlines()
+            mos_reports = wxmos.read_cached(mos_filepath, airports)
         except IOError as error:
             logger.error('MOS data file could not be loaded.')
             logger.error(error)
             break
 
-        for line in lines:                      #read the MOS data file line by line0
-            line = str(line)
+        for report in mos_reports.values():     #Grab the MOS report's update timestamp
+            dt_string = report.time
+            break
 
-            #Ignore blank lines of MOS airport
-            if line.startswith('     '):
-                ap_flag = 0
+        #Now grab the data needed to display on map, from the 3 hour forecast that covers the time to display.
+        #   See; https://www.weather.gov/mdl/mos_gfsmos_mavcard for description of available data.
+        mos_limits = {}                     #(ceiling, visibility) by airport, categorized all at once after the loop
+        for airport in airports:
+            report = mos_reports.get(airport)
+            if report is None:
                 continue
+            logger.debug('\n' + airport)
 
-            #Check for and grab date of MOS
-            if 'DT /' in line:
-                unused, dt_cat, month, unused, unused, day, unused = line.split(" ",6)
-                continue
+            mos_time = int(current_hr_zulu) + hour_to_display
+            if mos_time >= 24:                  #check for reset at 00z
+                mos_time = mos_time - 24
 
-            #Check for and grab the Airport ID of the current MOS
-            if 'MOS' in line:
-                unused, apid, v1, v2, v3, v4, v5, v6, v7, v8, v9, v10, updt1, updt2, v13 = line.split(" ", 14)
-                mos_updt_time = updt1 + ' ' + updt2 #Grab the MOS report's update timestamp
-                dt_string = mos_updt_time
-
-                #If this Airport ID is in the airports file then grab all the info needed from this MOS
-                if apid in airports:
-                    ap_flag = 1
-                    cat_counter = 0             #used to determine if a category is being reported in MOS or not. If not, need to inject i$
-                    dat0, dat1, dat2, dat3, dat4, dat5, dat6, dat7 = ([] for i in range(8)) #Clear lists
+            hr = report.period(mos_time)
+            if hr is None:
+                logger.info(airport + " MOS doesn't cover the time to display")
                 continue
 
-            #If we just found an airport that is in our airports file, then grab the appropriate weather data from it's MOS
-            if ap_flag:
-                xtra, cat, value = line.split(" ",2) #capture the category the line read represents
-                #Check if the needed categories are being read and if so, grab its data
-                if cat in categories:
-                    cat_counter += 1            #used to check if a category is not in mos report for airport
-                    if cat == 'HR':             #hour designation
-                        temp = (re.findall(r'\s?(\s*\S+)', value.rstrip()))     #grab all the hours from line read
-                        for j in range(8):
-                            tmp = temp[j].strip()
-                            hour_dict[tmp] = '' #create hour dictionary based on mos data
-                        keys = list(hour_dict.keys()) #Get the hours which are the keys in this dict, so they can be prope$
+            cld = report.value('CLD', hr)
+            wdr = report.value('WDR', hr)       #in tens of degrees
+            wsp = report.value('WSP', hr)
+            p06 = report.window('P06', hr)      #6 hour values are for the 6 hours this forecast hour is in
+            t06 = report.window('T06', hr)      #(thunderstorm, severe thunderstorm) percents
+            poz = report.value('POZ', hr)
+            pos = report.value('POS', hr)
+            typ = report.value('TYP', hr)
+            cig = report.value('CIG', hr)
+            vis = report.value('VIS', hr)
+            obv = report.value('OBV', hr)
+
+            logger.debug(str([report.hours[hr], cld, wdr, wsp, p06, t06, poz, pos, typ, cig, vis, obv])) #debug
+
+            #Ceiling and visibility for the flight category, worked out for every airport at once below
+            limits = wxdecode.mos_limits(cld, cig, vis)
+            logger.debug('Ceiling = ' + str(limits[0]) + ' | Visibility = ' + str(limits[1]) + ' |'),
+            logger.debug('Windspeed = ' + str(wsp) + ' | Wind dir = ' + str(wdr) + ' |'),
+
+            #decode reported weather using probabilities provided.
+            if typ not in typ_wx:               #check to see if rain, freezing rain or snow is reported. If not use obv weather
+                wx = obv_wx.get(obv, 'NONE')    #Get proper representation for obv designator
+            else:
+                wx = typ_wx[typ]                #Get proper representation for typ designator
 
+                if wx == 'RA' and (p06 or 0) < prob:
+                    if obv != 'N':
+                        wx = obv_wx.get(obv, 'NONE')
                     else:
-                        #Checking for missing lines of data and x out if necessary.
-                        if (cat_counter == 5 and cat != 'P06')\
-                                or (cat_counter == 6 and cat != 'T06')\
-                                or (cat_counter == 7 and cat != 'POZ')\
-                                or (cat_counter == 8 and cat != 'POS')\
-                                or (cat_counter == 9 and cat != 'TYP'):
-
-                            #calculate the number of consecutive missing cats and inject 9's into those positions
-                            a = categories.index(last_cat)+1
-                            b = categories.index(cat)+1
-                            c = b - a - 1
-                            logger.debug(apid,last_cat,cat,a,b,c)
-
-                            for j in range(c):
-                                temp = ['9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9']
-                                set_data()
-                                cat_counter += 1
-
-                            #Now write the orignal cat data read from the line in the mos file
-                            cat_counter += 1
-                            hour_dict = collections.OrderedDict() #clear out hour_dict for next airport
-                            last_cat = cat
-                            temp = (re.findall(r'\s?(\s*\S+)', value.rstrip())) #add the actual line of data read
-                            set_data()
-                            hour_dict = collections.OrderedDict() #clear out hour_dict for next airport
-
-                        else:
-                            #continue to decode the next category data that was read.
-                            last_cat = cat      #store what the last read cat was.
-                            temp = (re.findall(r'\s?(\s*\S+)', value.rstrip()))
-                            set_data()
-                            hour_dict = collections.OrderedDict() #clear out hour_dict for next airport
-
-        #Now grab the data needed to display on map. Key: [airport][hr][j] - using nested dictionaries
-        #   airport = from airport file, 4 character ID. hr = 1 of 8 three-hour periods of time, 00 03 06 09 12 15 18 21
-        #   j = index to weather categories, in this order; 'CLD','WDR','WSP','P06', 'T06', 'POZ', 'POS', 'TYP','CIG','VIS','OBV'.
-        #   See; https://www.weather.gov/mdl/mos_gfsmos_mavcard for description of available data.
-        for airport in airports:
-            if airport in mos_dict:
-                logger.debug('\n' + airport)
-                logger.debug(categories)
-
-                mos_time = int(current_hr_zulu) + hour_to_display
-                if mos_time >= 24:              #check for reset at 00z
-                    mos_time = mos_time - 24
-
-                logger.debug(keys)
-                for hr in keys:
-                    logger.debug(hr + ", " +  str(mos_time) + ", " + str(int(hr)+2.99))
-
-                    if int(hr) <= mos_time <= int(hr)+2.99:
-
-                        cld = (mos_dict[airport][hr][0])
-                        wdr = (mos_dict[airport][hr][1]) +'0' #make wind direction end in zero
-                        wsp = (mos_dict[airport][hr][2])
-                        p06 = (mos_dict[airport][hr][3])
-                        t06 = (mos_dict[airport][hr][4])
-                        poz = (mos_dict[airport][hr][5])
-                        pos = (mos_dict[airport][hr][6])
-                        typ = (mos_dict[airport][hr][7])
-                        cig = (mos_dict[airport][hr][8])
-                        vis = (mos_dict[airport][hr][9])
-                        obv = (mos_dict[airport][hr][10])
-
-                        logger.debug(hr+", "+cld+", "+wdr+", "+wsp+", "+p06+", "+t06+", "+poz+", "+pos+", "+typ+", "+cig+", "+vis+", "+obv) #debug
-
-                        #decode the weather for each airport to display on the livesectional map
-                        flightcategory = "VFR"  #start with VFR as the assumption
-                        if cld in ("OV","BK"):  #If the layer is OVC, BKN, set Flight category based on height of layer
-
-                            if cig <= '2':      #AGL is less than 500:
-                                flightcategory = "LIFR"
+                        wx = 'NONE'
 
-                            elif cig == '3':    #AGL is between 500 and 1000
-                                flightcategory = "IFR"
-                            elif '4' <= cig <= '5': #AGL is between 1000 and 3000:
-                                flightcategory = "MVFR"
+                if wx == 'SN' and (pos or 0) < prob:
+                    wx = 'NONE'
 
-                            elif cig >= '6':    #AGL is above 3000
-                                flightcategory = "VFR"
+                if wx == 'FZRA' and (poz or 0) < prob:
+                    wx = 'NONE'
 
-                        #Check visability too.
-                        if flightcategory != "LIFR": #if it's LIFR due to cloud layer, no reason to check any other things$
+                if t06 is None:                 #No thunderstorms forecast
+                    t06 = (0, 0)
 
-                            if vis <= '2':      #vis < 1.0 mile:
-                                flightcategory = "LIFR"
-
-                            elif '3' <= vis < '4': #1.0 <= vis < 3.0 miles:
-                                flightcategory = "IFR"
-
-                            elif vis == '5' and flightcategory != "IFR":  #3.0 <= vis <= 5.0 miles
-                                flightcategory = "MVFR"
-
-                        logger.debug(flightcategory + " |"),
-                        logger.debug('Windspeed = ' + wsp + ' | Wind dir = ' + wdr + ' |'),
-
-                        #decode reported weather using probabilities provided.
-                        if typ == '9':          #check to see if rain, freezing rain or snow is reported. If not use obv weather
-                            wx = obv_wx[obv]    #Get proper representation for obv designator
-                        else:
-                            wx = typ_wx[typ]    #Get proper representation for typ designator
-
-                            if wx == 'RA' and int(p06) < prob:
-                                if obv != 'N':
-                                    wx = obv_wx[obv]
-                                else:
-                                    wx = 'NONE'
-
-                            if wx == 'SN' and int(pos) < prob:
-                                wx = 'NONE'
-
-                            if wx == 'FZRA' and int(poz) < prob:
-                                wx = 'NONE'
-
-                            if t06 == '' or t06 is None:
-                                t06 = '0'
-
-                            if int(t06) > prob: #check for thunderstorms
-                                wx = 'TSRA'
-                            else:
-                                wx = 'NONE'
-
-                        logger.debug('Reported Weather = ' + wx)
-
-                #Connect the information from MOS to the board
-                stationId = airport
-
-                #grab wind speeds from returned MOS data
-                if wsp == None:                 #if wind speed is blank, then bypass
-                    windspeedkt = 0
-                elif wsp == '99':               #Check to see if the MOS data didn't report a windspeed for this airport
-                    windspeedkt = 0
+                if t06[0] > prob:               #check for thunderstorms
+                    wx = 'TSRA'
                 else:
-                    windspeedkt = int(wsp)
+                    wx = 'NONE'
 
-                #grab wind direction from returned FAA data
-                if wdr == None:                 #if wind direction is blank, then bypass
-                    winddirdegree = 0
-                else:
-                    winddirdegree = int(wdr)
-
-                #grab Weather info from returned FAA data
-                if wx is None:                  #if weather string is blank, then bypass
-                    wxstring = "NONE"
-                else:
-                    wxstring = wx
-
-                logger.debug(stationId+ ", " + str(windspeedkt) + ", " + wxstring)
-
-                #Check for duplicate airport identifier and skip if found, otherwise store in dictionary. covers for dups in "airp$
-                if stationId in stationiddict:
-                    logger.info(stationId + " Duplicate, only saved first metar category")
-                else:
-                    stationiddict[stationId] = flightcategory #build category dictionary
-
-                if stationId in windsdict:
-                    logger.info(stationId + " Duplicate, only saved first metar category")
-                else:
-                    windsdict[stationId] = windspeedkt #build windspeed dictionary
-
-                if stationId in wnddirdict:
-                    logger.info(stationId + " Duplicate, only saved first metar category")
-                else:
-                    wnddirdict[stationId] = winddirdegree #build wind direction dictionary
-
-                if stationId in wxstringdict:
-                    logger.info(stationId + " Duplicate, only saved first metar category")
-                else:
-                    wxstringdict[stationId] = wxstring #build weather dictionary
-        logger.info("Decoded MOS Data for Display")
+            logger.debug('Reported Weather = ' + wx)
 
-    #TAF decode routine. This routine will decode the TAF, pick the appropriate time frame to display.
-    if metar_taf_mos == 0:                      #0 equals display TAF.
-        #start of TAF decoding routine
-        for data in root.iter('data'):
-            num_results = data.attrib['num_results'] #get number of airports reporting TAFs to be used for diagnosis only
-            logger.debug("\nNum of Airport TAFs = " + num_results)
+            #Connect the information from MOS to the board
+            stationId = airport
 
-        for taf in root.iter('TAF'):            #iterate through each airport's TAF
-            stationId = taf.find('station_id').text
-            logger.debug(stationId)
-            logger.debug('Current+Offset Zulu - ' + current_zulu)
-            taf_wx_string = ""
-            taf_change_indicator = ""
-            taf_wind_dir_degrees = ""
-            taf_wind_speed_kt = ""
-            taf_wind_gust_kt = ""
-
-            for forecast in taf.findall('forecast'): #Now look at the forecasts for the airport
-
-                # Routine inspired by Nick Cirincione.
-                flightcategory = "VFR"          #intialize flight category
-                taf_time_from = forecast.find('fcst_time_from').text #get taf's from time
-                taf_time_to = forecast.find('fcst_time_to').text #get taf's to time
-
-                if forecast.find('wx_string') is not None:
-                    taf_wx_string = forecast.find('wx_string').text #get weather conditions
-
-                if forecast.find('change_indicator') is not None:
-                    taf_change_indicator = forecast.find('change_indicator').text #get change indicator
-
-                if forecast.find('wind_dir_degrees') is not None:
-                    taf_wind_dir_degrees = forecast.find('wind_dir_degrees').text #get wind direction
-
-                if forecast.find('wind_speed_kt') is not None:
-                    taf_wind_speed_kt = forecast.find('wind_speed_kt').text #get wind speed
-
-                if forecast.find('wind_gust_kt') is not None:
-                    taf_wind_gust_kt = forecast.find('wind_gust_kt').text #get wind gust speed
-
-                if taf_time_from <= current_zulu <= taf_time_to: #test if current time plus offset falls within taf's timeframe
-                    logger.debug('TAF FROM - ' + taf_time_from)
-                    logger.debug(comp_time(taf_time_from))
-                    logger.debug('TAF TO - ' + taf_time_to)
-                    logger.debug(comp_time(taf_time_to))
-
-                    #There can be multiple layers of clouds in each taf, but they are always listed lowest AGL first.
-                    #Check the lowest (first) layer and see if it's overcast, broken, or obscured. If it is, then compare to cloud bas$
-                    #This algorithm basically sets the flight category based on the lowest OVC, BKN or OVX layer.
-                    for sky_condition in forecast.findall('sky_condition'): #for each sky_condition from the XML
-                        sky_cvr = sky_condition.attrib['sky_cover'] #get the sky cover (BKN, OVC, SCT, etc)
-                        logger.debug(sky_cvr)
-
-                        if sky_cvr in ("OVC","BKN","OVX"): #If the layer is OVC, BKN or OVX, set Flight category based on height A$
-
-                            try:
-                                cld_base_ft_agl = sky_condition.attrib['cloud_base_ft_agl'] #get cloud base AGL from XML
-                                logger.debug(cld_base_ft_agl) #debug
-                            except:
-                                cld_base_ft_agl = forecast.find('vert_vis_ft').text #get cloud base AGL from XML
-
-#                            cld_base_ft_agl = sky_condition.attrib['cloud_base_ft_agl'] #get cloud base AGL from XML
-#                            logger.debug(cld_base_ft_agl)
-
-                            cld_base_ft_agl = int(cld_base_ft_agl)
-                            if cld_base_ft_agl < 500:
-                                flightcategory = "LIFR"
-                                break
-
-                            elif 500 <= cld_base_ft_agl < 1000:
-                                flightcategory = "IFR"
-                                break
-
-                            elif 1000 <= cld_base_ft_agl <= 3000:
-                                flightcategory = "MVFR"
-                                break
-
-                            elif cld_base_ft_agl > 3000:
-                                flightcategory = "VFR"
-                                break
-
-                    #visibilty can also set flight category. If the clouds haven't set the fltcat to LIFR. See if visibility will
-                    if flightcategory != "LIFR": #if it's LIFR due to cloud layer, no reason to check any other things that can set fl$
-                        if forecast.find('visibility_statute_mi') is not None: #check XML if visibility value exists
-                            visibility_statute_mi = forecast.find('visibility_statute_mi').text   #get visibility number
-                            visibility_statute_mi = float(visibility_statute_mi.strip('+'))
-                            print (visibility_statute_mi)
-
-                            if visibility_statute_mi < 1.0:
-                                flightcategory = "LIFR"
-
-                            elif 1.0 <= visibility_statute_mi < 3.0:
-                                flightcategory = "IFR"
-
-                            elif 3.0 <= visibility_statute_mi <= 5.0 and flightcategory != "IFR":  #if Flight Category was already
-                                flightcategory = "MVFR"
-
-                    #Print out TAF data to screen for debugging only
-                    logger.debug('Airport - ' + stationId)
-                    logger.debug('Flight Category - ' + flightcategory)
-                    logger.debug('Wind Speed - ' + taf_wind_speed_kt)
-                    logger.debug('WX String - ' + taf_wx_string)
-                    logger.debug('Change Indicator - ' + taf_change_indicator)
-                    logger.debug('Wind Director Degrees - ' + taf_wind_dir_degrees)
-                    logger.debug('Wind Gust - ' + taf_wind_gust_kt)
-
-                    #grab flightcategory from returned FAA data
-                    if flightcategory is None:  #if wind speed is blank, then bypass
-                        flightcategory = None
-
-                    #grab wind speeds from returned FAA data
-                    if taf_wind_speed_kt is None: #if wind speed is blank, then bypass
-                        windspeedkt = 0
-                    else:
-                        windspeedkt = int(taf_wind_speed_kt)
+            #grab wind speeds from returned MOS data
+            if wsp is None:                     #if wind speed is blank, then bypass
+                windspeedkt = 0
+            elif wsp == 99:                     #Check to see if the MOS data didn't report a windspeed for this airport
+                windspeedkt = 0
+            else:
+                windspeedkt = wsp
 
-                    #grab wind gust from returned FAA data - Lance Blank
-                    if taf_wind_gust_kt is None or taf_wind_gust_kt == '': #if wind speed is blank, then bypass
-                        windgustkt = 0
-                    else:
-                        windgustkt = int(taf_wind_gust_kt)
+            #grab wind direction from returned MOS data
+            if wdr is None:                     #if wind direction is blank, then bypass
+                winddirdegree = 0
+            else:
+                winddirdegree = wdr * 10        #make wind direction end in zero
 
-                    #grab wind direction from returned FAA data
-                    if taf_wind_dir_degrees is None: #if wind direction is blank, then bypass
-                        winddirdegree = 0
-                    else:
-                        winddirdegree = int(taf_wind_dir_degrees)
+            wxstring = wx
 
-                    #grab Weather info from returned FAA data
-                    if taf_wx_string is None:   #if weather string is blank, then bypass
-                        wxstring = "NONE"
-                    else:
-                        wxstring = taf_wx_string
+            logger.debug(stationId+ ", " + str(windspeedkt) + ", " + wxstring)
 
-            #Check for duplicate airport identifier and skip if found, otherwise store in dictionary. covers for dups in "airports" file
-            if stationId in stationiddict:
+            #Check for duplicate airport identifier and skip if found, otherwise store in dictionary. covers for dups in "airp$
+            if stationId in mos_limits:
                 logger.info(stationId + " Duplicate, only saved first metar category")
             else:
-                stationiddict[stationId] = flightcategory #build category dictionary
+                mos_limits[stationId] = limits #categorized with the rest below
 
             if stationId in windsdict:
                 logger.info(stationId + " Duplicate, only saved first metar category")
@@ -1031,57 +738,69 @@ while True:
             else:
                 wxstringdict[stationId] = wxstring #build weather dictionary
 
-            if stationId in wndgustdict:        #Lance Blank
-                logger.info(stationId + "Duplicate, only saved the first winds")
-            else:
-                wndgustdict[stationId] = windgustkt #build windgust dictionary
-
-        logger.info("Decoded TAF Data for Display")
-
-
-    elif metar_taf_mos == 1:                    #Decode METARs to display
-        #grab the airport category, wind speed and various weather from the results given from FAA.
-        #start of METAR decode routine if 'metar_taf' equals 1. Script will default to this routine without a rotary switch installed.
-        for metar in root.iter('METAR'):
-            stationId = metar.find('station_id').text
-
-            #grab flight category from returned FAA data
-            if metar.find('flight_category') is None: #if category is blank, then bypass
-                flightcategory = "NONE"
-            else:
-                flightcategory = metar.find('flight_category').text
+        #Flight category of every airport in one pass. See wxdecode.py
+        stationiddict.update(wxdecode.classify_stations(mos_limits)) #build category dictionary
+        logger.info("Decoded MOS Data for Display")
 
-            #grab wind speeds from returned FAA data
-            if metar.find('wind_speed_kt') is None: #if wind speed is blank, then bypass
-                windspeedkt = 0
-            else:
-                windspeedkt = int(metar.find('wind_speed_kt').text)
+    #TAF decode routine. This routine will decode the TAF, pick the appropriate time frame to display.
+    if metar_taf_mos == 0 and shared is None:   #0 equals display TAF.
+        #start of TAF decoding routine
+        logger.debug("\nNum of Airport TAFs = " + str(len(records))) #number of airports reporting TAFs, for diagnosis only
 
-            #grab wind gust from returned FAA data - Lance Blank
-            if metar.find('wind_gust_kt') is None: #if wind speed is blank, then bypass
-                windgustkt = 0
-            else:
-                windgustkt = int(metar.find('wind_gust_kt').text)
+        taf_limits = {}                         #(ceiling, visibility) by airport, categorized all at once after the loop
+        for taf in records:                     #iterate through each airport's TAF
+            stationId = taf['station_id']
+            logger.debug(stationId)
+            logger.debug('Current+Offset Zulu - ' + current_zulu)
+            flightcategory = "NONE"             #Used if the TAF doesn't cover the time to display
+            windspeedkt = 0
+            windgustkt = 0
+            winddirdegree = 0
+            wxstring = "NONE"
+
+            #The forecast in force at the time to display, with FM, BECMG, TEMPO and PROB groups applied. See wxdecode.py
+            forecast = wxdecode.taf_forecasts(taf, [current_zulu])[0]
+            if forecast is not None:
+                logger.debug('TAF FROM - ' + forecast['fcst_time_from'])
+                logger.debug(comp_time(forecast['fcst_time_from']))
+                logger.debug('TAF TO - ' + forecast['fcst_time_to'])
+                logger.debug(comp_time(forecast['fcst_time_to']))
+
+                #Ceiling from the lowest OVC, BKN or OVX layer and the visibility, categorized with the rest below. See wxdecode.py
+                limits = wxdecode.record_limits(forecast)
+
+                #Print out TAF data to screen for debugging only
+                logger.debug('Airport - ' + stationId)
+                logger.debug('Ceiling - ' + str(limits[0]) + ', Visibility - ' + str(limits[1]))
+                logger.debug('Wind Speed - ' + str(forecast.get('wind_speed_kt')))
+                logger.debug('WX String - ' + str(forecast.get('wx_string')))
+                logger.debug('Change Indicator - ' + str(forecast.get('change_indicator')))
+                logger.debug('Wind Director Degrees - ' + str(forecast.get('wind_dir_degrees')))
+                logger.debug('Wind Gust - ' + str(forecast.get('wind_gust_kt')))
+
+                #grab wind speeds from returned FAA data, if wind speed is blank, then bypass
+                windspeedkt = int(forecast.get('wind_speed_kt', 0))
+
+                #grab wind gust from returned FAA data - Lance Blank
+                windgustkt = int(forecast.get('wind_gust_kt', 0))
 
-            #grab wind direction from returned FAA data
-            if metar.find('wind_dir_degrees') is None: #if wind speed is blank, then bypass
-                winddirdegree = 0
-            elif metar.find('wind_dir_degrees').text == 'VRB':
-                winddirdegree = 0
-            else:
-                winddirdegree = int(metar.find('wind_dir_degrees').text)
+                #grab wind direction from returned FAA data
+                winddirdegree = forecast.get('wind_dir_degrees', 0)
+                if winddirdegree == 'VRB':
+                    winddirdegree = 0
+                else:
+                    winddirdegree = int(winddirdegree)
 
-            #grab Weather info from returned FAA data
-            if metar.find('wx_string') is None: #if weather string is blank, then bypass
-                wxstring = "NONE"
-            else:
-                wxstring = metar.find('wx_string').text
+                #grab Weather info from returned FAA data, if weather string is blank, then bypass
+                wxstring = forecast.get('wx_string', "NONE")
 
             #Check for duplicate airport identifier and skip if found, otherwise store in dictionary. covers for dups in "airports" file
             if stationId in stationiddict:
                 logger.info(stationId + " Duplicate, only saved first metar category")
             else:
-                stationiddict[stationId] = flightcategory #build category dictionary
+                stationiddict[stationId] = flightcategory #build category dictionary, "NONE" until categorized below
+                if forecast is not None:
+                    taf_limits[stationId] = limits
 
             if stationId in windsdict:
                 logger.info(stationId + " Duplicate, only saved first metar category")
@@ -1098,14 +817,35 @@ while True:
             else:
                 wxstringdict[stationId] = wxstring #build weather dictionary
 
-            if stationId in wndgustdict:        #Lance - Thanks
-                print ("Duplicate, only saved the first winds")
+            if stationId in wndgustdict:        #Lance Blank
+                logger.info(stationId + "Duplicate, only saved the first winds")
             else:
                 wndgustdict[stationId] = windgustkt #build windgust dictionary
 
-        logger.info("Decoded METAR Data for Display")
+        #Flight category of every airport the TAF's cover, in one pass. See wxdecode.py
+        stationiddict.update(wxdecode.classify_stations(taf_limits))
+        logger.info("Decoded TAF Data for Display")
 
 
+    elif metar_taf_mos == 1 and shared is None and not wx_unchanged: #Decode METARs to display
+        #grab the airport category, wind speed and various weather from the results given from FAA.
+        #start of METAR decode routine if 'metar_taf' equals 1. Script will default to this routine without a rotary switch installed.
+        #Only METARs that are new since the last update are decoded, the rest keep what they decoded to then.
+        #Check for duplicate airport identifier and skip if found. covers for dups in "airports" file
+        decoded = metar_decoder.decode_all(records, lambda stationId: logger.info(stationId + " Duplicate, only saved first metar category"))
+        for stationId, (flightcategory, windspeedkt, winddirdegree, wxstring, windgustkt) in decoded.items():
+            stationiddict[stationId] = flightcategory #build category dictionary
+            windsdict[stationId] = windspeedkt #build windspeed dictionary
+            wnddirdict[stationId] = winddirdegree #build wind direction dictionary
+            wxstringdict[stationId] = wxstring #build weather dictionary
+            wndgustdict[stationId] = windgustkt #build windgust dictionary - Lance Blank
+
+        logger.info("Decoded METAR Data for Display, " + str(len(metar_decoder.changed)) + " of " + str(len(decoded)) +
+                    " Airports Changed, " + str(len(metar_decoder.removed)) + " Removed")
+
+
+    last_product_key = product_key if metar_taf_mos == 1 or shared is not None else None #Remember what was decoded to compare at the next update
+
     #Grab the top X number of highwinds and put them in a sorted list from highest to lowest to display
     if exclusive_flag == 1:
         num2display = config.LED_COUNT          #Reset num2display to all the airports if we are using exclusive_list
@@ -1258,7 +998,10 @@ while True:
             0b00000
         )
 
-        long_string = "Winds Updated " + dt_string + "--"
+        if wx_stale:
+            long_string = "Winds Stale From " + dt_string + "--"
+        else:
+            long_string = "Winds Updated " + dt_string + "--"
 
         #Build the instance of LCD. Be sure to include "compat_mode = True" to eliminate extraneous characters on the display.
         lcd = CharLCD(numbering_mode=GPIO.BCM, cols=16, rows=2, pin_rs=26, pin_e=19, pins_data=[13, 6, 5 ,11], compat_mode = True)
@@ -1342,7 +1085,10 @@ while True:
         toggle = 0                              #Used to toggle invert between groups of airports. Leave set at 0
 
         #Add update message to beginning of list
-        sortwindslist.insert(0,("Updated", dt_string))
+        if wx_stale:                            #FAA data not available, mark the old data as Stale
+            sortwindslist.insert(0,("Stale", dt_string))
+        else:
+            sortwindslist.insert(0,("Updated", dt_string))
 
         #Add type of data being displayed, METAR, TAF, MOS etc
         if metar_taf_mos == 1:                  #Displaying METAR data
@@ -27,6 +27,12 @@
 #    Fixed bug that missed lowest sky_condition altitude on METARs not reporting flight categories.
 #    Thank you Daniel from pilotmap.co for the change the routine that handles maps with more than 300 airports.
 #    Added timeout feature to urlib call - Thanks Eric B
+#    FAA data is now retrieved through wxfetch.py which shares it with metar-display-v4.py, wipes-v4.py and webapp.py
+#    FAA updates are timed by wxsched.py to land just after our airports publish their hourly METARs.
+#    METARs and TAF's are downloaded and decoded in a background thread so the LED's never freeze or go dark during an update.
+#    METARs and TAF's are read through wxdecode.py, which walks each report once rather than searching it for every field.
+#    Decoded weather is kept in wxstate.py's compact per airport states, lined up by LED pin once per refresh.
+#    TAF's are decoded once into the weather for every hour out to +30 hours, so turning the rotary switch is instant.
 
 #This version retains the features included in metar-v3.py, including hi-wind blinking and lightning when thunderstorms are reported.
 #However, this version adds representations for snow, rain, freezing rain, dust sand ash, and fog when reported in the metar.
@@ -77,9 +83,7 @@
 ###########################
 
 #Import needed libraries
-import urllib.request, urllib.error, urllib.parse
 import socket
-import xml.etree.ElementTree as ET
 import time
 from datetime import datetime
 from datetime import timedelta
@@ -87,15 +91,20 @@ from datetime import time as time_
 from rpi_ws281x import * #works with python 3.7. sudo pip3 install rpi_ws281x
 import sys
 import os
+import threading
 from os.path import getmtime
 import RPi.GPIO as GPIO
-import collections
-import re
 import logging
 import logzero #had to manually install logzero. https://logzero.readthedocs.io/en/latest/
 from logzero import logger
 import config #Config.py holds user settings used by the various scripts
 import admin
+import wxfetch #Shared FAA weather fetcher, so all scripts use the same data
+import wxsched #Times the FAA updates to land just after the hourly METAR burst
+import wxdecode #Walks each METAR and TAF once into a flat record and works out flight categories
+import wxstate #Compact weather state for each airport, read by LED pin in the display loop
+import wxtable #Shares the weather on the LED's with metar-display-v4.py and webapp.py
+import wxmos #Reads the GFSMAV MOS bulletin by column
 
 # Setup rotating logfile with 3 rotations, each with a maximum filesize of 1MB:
 version = admin.version                 #Software version
@@ -257,7 +266,8 @@ cycle4_wait = .08       #Lightning effect uses the short intervals at cycle 2 an
 cycle5_wait = .5
 
 #List of METAR weather categories to designate weather in area. Many Metars will report multiple conditions, i.e. '-RA BR'.
-#The code pulls the first/main weather reported to compare against the lists below. In this example it uses the '-RA' and ignores the 'BR'.
+#Every condition reported is compared against the lists below, and if more than one matches, the most significant is shown.
+#In this example the '-RA' is shown over the 'BR', and the 'BR' is shown if rainshow is off. See wx_priority in wxstate.py.
 #See https://aviationweather-cprk.ncep.noaa.gov/metar/symbol for descriptions. Add or subtract codes as desired.
 #Thunderstorm and lightning
 wx_lghtn_ck = ["TS", "TSRA", "TSGR", "+TSRA", "TSRG", "FC", "SQ", "VCTS", "VCTSRA", "VCTSDZ", "LTG"]
@@ -272,6 +282,14 @@ wx_dustsandash_ck = ["DU", "SA", "HZ", "FU", "VA", "BLDU", "BLSA", "PO", "VCSS",
 #Fog
 wx_fog_ck = ["BR", "MIFG", "VCFG", "BCFG", "PRFG", "FG", "FZFG"]
 
+#Weather codes above by the bit wxstate.py uses for each, for the weather effects turned on. An effect that's off
+#doesn't hide another weather reported with it. Flight category colors in the order of wxstate.Category.
+wx_codes = wxstate.wx_lookup((bit, wx_ck) for bit, wx_ck, show in (
+    (wxstate.LGHTN, wx_lghtn_ck, lghtnflash), (wxstate.SNOW, wx_snow_ck, snowshow), (wxstate.RAIN, wx_rain_ck, rainshow),
+    (wxstate.FRRAIN, wx_frrain_ck, frrainshow), (wxstate.DUSTSANDASH, wx_dustsandash_ck, dustsandashshow),
+    (wxstate.FOG, wx_fog_ck, fogshow)) if show)
+category_colors = (color_nowx, color_vfr, color_mvfr, color_ifr, color_lifr)
+
 #list definitions
 cycle_wait = [cycle0_wait, cycle1_wait, cycle2_wait, cycle3_wait, cycle4_wait, cycle5_wait] #Used to create weather designation effects.
 cycles = [0,1,2,3,4,5] #Used as a index for the cycle loop.
@@ -325,12 +343,8 @@ temp_lights_on = 0                      #Set flag for next round if sleep timer
 
 #MOS Data Settings
 mos_filepath = '/NeoSectional/GFSMAV'      #location of the downloaded local MOS file.
-categories = ['HR', 'CLD', 'WDR', 'WSP', 'P06', 'T06', 'POZ', 'POS', 'TYP', 'CIG','VIS','OBV']
 obv_wx = {'N': 'None', 'HZ': 'HZ','BR': 'RA','FG': 'FG','BL': 'HZ'} #Decode from MOS to TAF/METAR
 typ_wx = {'S': 'SN','Z': 'FZRA','R': 'RA'}      #Decode from MOS to TAF/METAR
-mos_dict = collections.OrderedDict()    #Outer Dictionary, keyed by airport ID
-hour_dict = collections.OrderedDict()   #Middle Dictionary, keyed by hour of forcast. Will contain a list of data for categories.
-ap_flag = 0                             #Used to determine that an airport from our airports file is currently being read.
 
 #Used by Heat Map. Do not change - assumed by routines below.
 low_visits = (0, 0, 255)                #Start with Blue - Do Not Change
@@ -413,87 +427,6 @@ def time_in_range(start, end, x):
     else:
         return start <= x or x <= end
 
-#Used by MOS decode routine. This routine builds mos_dict nested with hours_dict
-def set_data():
-    global hour_dict
-    global mos_dict
-    global dat0, dat1, dat2, dat3, dat4, dat5, dat6, dat7
-    global apid
-    global temp
-    global keys
-
-    #Clean up line of MOS data.
-    if len(temp) >= 0: #this check is unneeded. Put here to vary length of list to clean up.
-        temp1 = []
-        tmp_sw = 0
-
-        for val in temp: #Check each item in the list
-            val = val.lstrip() #remove leading white space
-            val = val.rstrip('/') #remove trailing /
-
-            if len(val) == 6: #this is for T06 to build appropriate length list
-                temp1.append('0') #add a '0' to the front of the list. T06 doesn't report data in first 3 hours.
-                temp1.append(val) #add back the original value taken from T06
-                tmp_sw = 1 #Turn on switch so we don't go through it again.
-
-            elif len(val) > 2 and tmp_sw == 0: # and tmp_sw == 0: #if item is 1 or 2 chars long, then bypass. Otherwise fix.
-                pos = val.find('100') #locate first 100
-                tmp = val[0:pos] #capture the first value which is not a 100
-                temp1.append(tmp) #and store it in temp list.
-
-                k = 0
-                for j in range(pos, len(val), 3): #now iterate through remainder
-                    temp1.append(val[j:j+3]) #and capture all the 100's
-                    k += 1
-            else:
-                temp1.append(val) #Store the normal values too.
-
-        temp = temp1
-
-    #load data into appropriate lists by hours designated by current MOS file
-    #clean up data by removing '/' and spaces
-    temp0 = ([x.strip() for x in temp[0].split('/')])
-    temp1 = ([x.strip() for x in temp[1].split('/')])
-    temp2 = ([x.strip() for x in temp[2].split('/')])
-    temp3 = ([x.strip() for x in temp[3].split('/')])
-    temp4 = ([x.strip() for x in temp[4].split('/')])
-    temp5 = ([x.strip() for x in temp[5].split('/')])
-    temp6 = ([x.strip() for x in temp[6].split('/')])
-    temp7 = ([x.strip() for x in temp[7].split('/')])
-
-    #build a list for each data group. grab 1st element [0] in list to store.
-    dat0.append(temp0[0])
-    dat1.append(temp1[0])
-    dat2.append(temp2[0])
-    dat3.append(temp3[0])
-    dat4.append(temp4[0])
-    dat5.append(temp5[0])
-    dat6.append(temp6[0])
-    dat7.append(temp7[0])
-
-    j = 0
-    for key in keys: #add cat data to the hour_dict by hour
-
-        if j == 0:
-            hour_dict[key] = dat0
-        elif j == 1:
-            hour_dict[key] = dat1
-        elif j == 2:
-            hour_dict[key] = dat2
-        elif j == 3:
-            hour_dict[key] = dat3
-        elif j == 4:
-            hour_dict[key] = dat4
-        elif j == 5:
-            hour_dict[key] = dat5
-        elif j == 6:
-            hour_dict[key] = dat6
-        elif j == 7:
-            hour_dict[key] = dat7
-        j += 1
-
-        mos_dict[apid] = hour_dict #marry the hour_dict to the proper key in mos_dict
-
 #For Heat Map. Based on visits, assign color. Using a 0 to 100 scale where 0 is never visted and 100 is home airport.
 #Can choose to display binary colors with homeap.
 def assign_color(visits):
@@ -533,10 +466,191 @@ def assign_color(visits):
 
     return color
 
+#Save an airport's weather in 'states' as a wxstate.StationState. Check for duplicate airport identifier and skip
+#if found, covers for dups in "airports" file.
+def save_state(states, stationId, flightcategory, windspeedkt, windgustkt, wxstring, winddirdegree=0):
+    if stationId in states:
+        logger.info(stationId + " Duplicate, only saved the first weather")
+    else:
+        states[stationId] = wxstate.StationState(flightcategory, windspeedkt, windgustkt, wxstring, wx_codes, winddirdegree)
+
+#Log which airports in the airports file have weather data and which don't. 'label' is put in front, i.e. 'TAF - '
+def log_coverage(label, states, airports):
+    airports_with_data = set(states.keys())
+    airports_from_file = set(airports)
+    airports_from_file.discard("NULL")  # Remove NULL entries
+    airports_from_file.discard("")      # Remove empty entries
+
+    missing_data = airports_from_file - airports_with_data
+    extra_data = airports_with_data - airports_from_file
+
+    logger.info(f"{label}Airports in config file: {len(airports_from_file)}")
+    logger.info(f"{label}Airports with weather data: {len(airports_with_data)}")
+    logger.info(f"{label}Airports missing weather data ({len(missing_data)}): {sorted(list(missing_data))}")
+    if extra_data:
+        logger.info(f"{label}Extra weather data not in config ({len(extra_data)}): {sorted(list(extra_data))}")
+
+    # Show sample of airports that do have data
+    if airports_with_data:
+        sample_airports = list(airports_with_data)[:10]
+        logger.info(f"{label}Sample airports with data: {sample_airports}")
+
+#TAF decode routine. Each airport's TAF is decoded once into its weather for every hour from now through +30 hours,
+#so any hour the rotary switch picks is a lookup. 'records' are the TAF's from wxfetch.py, see wxdecode.py.
+#Returns a wxstate.Timeline. An hour the TAF doesn't cover shows no weather for that airport.
+def decode_tafs(records, airports):
+    timeline = wxstate.Timeline()
+    zulu_times = timeline.zulu_times()
+
+    logging.info("Starting TAF Data Display")
+    #start of TAF decoding routine
+    logger.debug("\nNum of Airport TAFs = " + str(len(records))) #debug
+
+    forecasts = []                              #Each different forecast once, the hours with the same forecast share it
+    for taf in records:                         #iterate through each airport's TAF
+        stationId = taf['station_id']
+        logger.debug(stationId) #debug
+
+        #Check for duplicate airport identifier and skip if found. covers for dups in "airports" file
+        if stationId in timeline.by_station:
+            logger.info(stationId + " Duplicate, only saved the first weather")
+            continue
+
+        #The forecast in force each hour, with FM, BECMG, TEMPO and PROB groups applied. See wxdecode.py
+        #Each hour is kept as its forecast's place in 'forecasts' for now, None if the TAF doesn't reach that hour.
+        index = {}
+        hours = []
+        for forecast in wxdecode.taf_forecasts(taf, zulu_times):
+            if forecast is not None and id(forecast) not in index:
+                index[id(forecast)] = len(forecasts)
+                forecasts.append(forecast)
+            hours.append(None if forecast is None else index[id(forecast)])
+        timeline.by_station[stationId] = hours
+
+    #Flight category of every forecast at once, from the lowest OVC, BKN or OVX layer and the visibility. See wxdecode.py
+    states = []
+    for forecast, flightcategory in zip(forecasts, wxdecode.forecast_categories(forecasts)):
+        logger.debug('From ' + forecast['fcst_time_from'] + ' To ' + forecast['fcst_time_to'])
+        logger.debug('Flight Category - ' + flightcategory)
+        logger.debug('Wind Speed - ' + str(forecast.get('wind_speed_kt')))
+        logger.debug('WX String - ' + str(forecast.get('wx_string')))
+        logger.debug('Wind Gust - ' + str(forecast.get('wind_gust_kt')))
+
+        #grab wind speeds and Weather info from returned FAA data, if blank then bypass
+        states.append(wxstate.StationState(flightcategory, forecast.get('wind_speed_kt', 0),
+                                           forecast.get('wind_gust_kt', 0), forecast.get('wx_string', "NONE"), wx_codes,
+                                           forecast.get('wind_dir_degrees', 0)))
+    for stationId, hours in timeline.by_station.items():
+        timeline.by_station[stationId] = [wxstate.no_weather if n is None else states[n] for n in hours]
+
+    logger.info("Decoded TAF Data for Display")
+    log_coverage('TAF - ', timeline.by_station, airports)
+    return timeline
+
+#METAR decode routine. Grab the airport category, wind speed and various weather from the results given from FAA.
+#Only called for an airport's METAR when it's new since the last update, see metar_decoder below.
+def decode_metar(metar):
+    #FAA's flight category, or one worked out from cloud cover and/or visibility when it isn't reported. See wxdecode.py
+    flightcategory = wxdecode.metar_category(metar)
+
+    #grab wind speeds from returned FAA data
+    windspeedkt = metar.get('wind_speed_kt', 0) #if wind speed is blank, then bypass
+    windgustkt = metar.get('wind_gust_kt', 0)
+
+    #grab wind direction and when it was observed, shared with metar-display-v4.py through wxtable.py
+    winddirdegree = metar.get('wind_dir_degrees', 0) #'VRB' is 0, as is a blank one
+    obs_time = wxstate.to_epoch(metar.get('observation_time'))
+
+    #grab Weather info from returned FAA data
+    wxstring = metar.get('wx_string', "NONE") #if weather string is blank, then bypass
+
+    return wxstate.StationState(flightcategory, windspeedkt, windgustkt, wxstring, wx_codes, winddirdegree, obs_time)
+
+metar_decoder = wxdecode.IncrementalDecoder(decode_metar) #Keeps each airport's last METAR and what it decoded to
+metar_key = None                #Name and hash of the METARs metar_decoder last decoded
+
+#Decode the METARs. 'records' are the METARs from wxfetch.py, see wxdecode.py. Returns the weather by airport.
+#Airports that haven't issued a new METAR since the last update keep the state they decoded to then.
+def decode_metars(records, airports):
+    logger.info("Starting METAR Data Display")
+    #start of METAR decode routine if 'metar_taf_mos' equals 1. Script will default to this routine without a rotary switch installed.
+    #Check for duplicate airport identifier and skip if found. covers for dups in "airports" file
+    states = metar_decoder.decode_all(records, lambda stationId: logger.info(stationId + " Duplicate, only saved the first weather"))
+    logger.info("Decoded METAR Data for Display, " + str(len(metar_decoder.changed)) + " of " + str(len(states)) +
+                " Airports Changed, " + str(len(metar_decoder.removed)) + " Removed")
+    log_coverage('', states, airports)
+    return states
+
+#Background thread that gets METARs or TAF's through wxfetch.py and decodes them, so the LED's keep animating while
+#the FAA is slow. The finished weather states are handed to the display loop through 'wx_next', which swaps them in
+#between display cycles. Nothing is handed over if the METARs are the same ones already on display ('last_key').
+#If the METARs on display are the last ones decoded and none of the airports has a new one, only the new key is handed
+#over, with None for the states, so the display loop doesn't repaint the same weather.
+def update_wx(mode, airports, last_key):
+    global wx_next, metar_key
+    try:
+        product_name = 'metar' if mode == 1 else 'taf'
+        product = wxfetch.get_product(product_name, airports, max_age=wxsched.max_age(mode == 1))
+        if product is None: #FAA not available and nothing in the cache to fall back on
+            logger.warning(product_name.upper() + ' Data Not Available, Keeping Current Data')
+            return
+        product_key = (product_name, product.hash)
+        if product.stale: #FAA not available. The last good data keeps being displayed until it comes back.
+            logger.warning('Displaying Stale ' + product_name.upper() + ' Data')
+        wxsched.learn(product) #Learn when our airports report their METARs
+
+        #If these are the same METARs on display, skip parsing and decoding. The states are still good.
+        #TAFs are always decoded, into a timeline that covers every hour the rotary switch can pick.
+        if mode == 1 and product_key == last_key:
+            logger.info('METAR Data Unchanged Since Last Update, Skipping Decode')
+            return
+
+        logger.info(f'Total {product_name.upper()}s collected: {len(product)}')
+        if mode == 1:
+            wx_states = decode_metars(product.records, airports)
+            if last_key is not None and last_key == metar_key and not metar_decoder.changed and not metar_decoder.removed:
+                logger.info('No New METARs Since Last Update, Keeping Current Data')
+                wx_states = None
+            metar_key = product_key
+        else:
+            wx_states = decode_tafs(product.records, airports)
+
+        with wx_lock:
+            wx_next = (mode, product_key, wx_states)
+    except Exception as e:
+        logger.error('Weather Update Failed, Keeping Current Data')
+        logger.error(e)
+
+#Start update_wx() in the background for 'mode', unless the last update is still running. Returns False if it is.
+def start_update(mode, airports):
+    global wx_thread, wx_thread_mode
+    if wx_thread is not None and wx_thread.is_alive():
+        return False
+    wx_thread = threading.Thread(target=update_wx, name='update_wx', daemon=True, args=(mode, airports, last_product_key))
+    wx_thread_mode = mode
+    wx_thread.start()
+    return True
+
+#What the weather in 'station_states' is for, to tell when the rotary switch has moved on from it. The hour only
+#matters for TAF's and MOS, METARs are the same whatever hour the switch is set to.
+def states_key(mode, hour):
+    return (mode, hour if mode in (0, 2) else 0)
+
 ##########################
 # Start of executed code #
 ##########################
 toggle = 0                      #used for homeport display
+last_product_key = None         #Name and hash of the METARs on display. Used to skip decoding when the FAA data hasn't changed
+wx_thread = None                #Background thread getting and decoding METARs or TAF's, see update_wx()
+wx_thread_mode = None           #The 'metar_taf_mos' that thread was started for
+wx_next = None                  #Weather decoded by the background thread, waiting to be swapped in by the display loop
+taf_timeline = None             #Last TAF's decoded, for every hour. See wxstate.Timeline
+wx_lock = threading.Lock()      #Hands 'wx_next' between the threads
+wx_shown = False                #Set once there's weather on the map, after that the map never waits on the FAA
+wx_table = wxtable.TableWriter() #Publishes the weather on the LED's each time it changes, see wxtable.py
+station_states = {}             #Weather on display, by airport. See wxstate.py
+states_for = None               #What 'station_states' is for, see states_key(). None while there's nothing for the switch position
+led_states = []                 #The same weather lined up by LED pin, rebuilt once per refresh for the display loop
 outerloop = 1                   #Set to TRUE for infinite outerloop
 display_num = 0
 while (outerloop):
@@ -548,16 +662,6 @@ while (outerloop):
     current_zulu = zulu.strftime('%Y-%m-%dT%H:%M:%SZ')              #Format time to match whats reported in TAF. ie. 2020-03-24T18:21:54Z
     current_hr_zulu = zulu.strftime('%H')                           #Zulu time formated for just the hour, to compare to MOS data
 
-    #Dictionary definitions. Need to reset whenever new weather is received
-    stationiddict = {}
-    windsdict = {"":""}
-    wxstringdict = {"":""}
-
-    #Call script and execute desired wipe(s) while data is being updated.
-    if usewipes ==  1 and toggle_sw != -1:
-        exec(compile(open("/NeoSectional/wipes-v4.py", "rb").read(), "/NeoSectional/wipes-v4.py", 'exec')) #Get latest ip's to display in editors
-        logger.info("Calling wipes script")
-
     #read airports file - read each time weather is updated in case a change to "airports" file was made while script was running.
     try:
         with open('/NeoSectional/airports') as f:
@@ -570,19 +674,13 @@ while (outerloop):
     airports = [x.strip() for x in airports]
     logger.info('Airports File Loaded')
 
-    # depending on what data is to be displayed, either use an URL for METARs and TAFs or read file from drive (pass).
+    # depending on what data is to be displayed, either get METARs and TAFs from wxfetch.py or read file from drive (pass).
     if metar_taf_mos == 1: #Check to see if the script should display TAF data (0), METAR data (1) or MOS data (2)
-        # Define URL to get weather METARS. If no METAR reported withing the last 2.5 hours, Airport LED will be white (nowx).
-        # first 'url' is commented out but can be used as a backup to the new FAA API if an issue 
-        # url = "https://aviationweather-cprk.ncep.noaa.gov/adds/dataserver_current/httpparam?dataSource=metars&requestType=retrieve&format=xml&mostRecentForEachStation=constraint&hoursBeforeNow="+str(metar_age)+"&stationString="
-        # NEW FAA API URL
-        url = "https://aviationweather.gov/api/data/metar?format=xml&hours=" +str(metar_age)+ "&ids="
+        # METARs are retrieved through wxfetch.py. If no METAR reported withing the last 2.5 hours, Airport LED will be white (nowx).
         logger.info("METAR Data Loading")
 
     elif metar_taf_mos == 0:
-        #Define URL to get weather URL for TAF. If no TAF reported for an airport, the Airport LED will be white (nowx).
-        #url = "https://aviationweather-cprk.ncep.noaa.gov/adds/dataserver_current/httpparam?dataSource=tafs&requestType=retrieve&format=xml&mostRecentForEachStation=constraint&hoursBeforeNow="+str(metar_age)+"&stationString="
-        url = "https://aviationweather.gov/api/data/taf?format=xml&hours=" +str(metar_age)+ "&ids="
+        # TAFs are retrieved through wxfetch.py. If no TAF reported for an airport, the Airport LED will be white (nowx).
         logger.info("TAF Data Loading")
 
     elif metar_taf_mos == 2: #MOS data is not accessible in the same way as METARs and TAF's. A large file is downloaded by crontab everyday that gets read.
@@ -593,94 +691,50 @@ while (outerloop):
         pass
         logger.info("Heat Map Data Loading")
 
-    #Build URL to submit to FAA with the proper airports from the airports file for METARs and TAF's but not MOS data
-    # Thank you Daniel from pilotmap.co for the change to this routine that handles maps with more than 300 airports.
+    #Get METARs and TAF's for the airports in the airports file but not MOS data. wxfetch.py shares the FAA data with the
+    #other scripts, so the API is only called if no other script has retrieved it within the update interval.
+    #The download and decode run in a background thread, see update_wx(), so the LED's keep showing the current weather
+    #until the new weather is swapped in by the display loop below.
     if metar_taf_mos != 2 and metar_taf_mos != 3:
-        # Collect all METAR elements from all API chunks
-        all_metar_elements = []
-        chunk = 0
-        stationList = ''
-        
-        for airportcode in airports:
-          if airportcode == "NULL" or airportcode == "LGND":
-             continue
-          stationList += airportcode + ','
-          chunk += 1
-          #logger.info('Chunk size: ' + str(chunk))
-          if(chunk >= 50):
-             stationList = stationList[:-1] #strip trailing comma from string
-
-             while True: #check internet availability and retry if necessary. If house power outage, map may boot quicker than router.
-              s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-              s.connect(("8.8.8.8", 80))
-              ipadd = s.getsockname()[0] #get IP Address
-              logger.info('RPI IP Address = ' + ipadd) #log IP address when ever FAA weather update is retreived.
-              logger.info('API URL Chunk: ' + url + stationList)
-              result = ''
-              try:
-                result = urllib.request.urlopen(url + stationList, timeout=30).read() # Added timeout feature - Eric B
-                # Parse the complete XML response directly - no line manipulation needed
-                chunk_root = ET.fromstring(result.decode('UTF-8'))
-                # Extract METAR elements from this chunk and add to our collection
-                chunk_metars = chunk_root.findall('.//METAR')
-                all_metar_elements.extend(chunk_metars)
-                logger.info(f'Chunk processed: {len(chunk_metars)} METARs found')
-                logger.info('Internet Available')
-                break
-              except Exception as e:
-                print(str(e))
-                logger.warning('FAA Data is Not Available')
-                logger.warning(url + stationList)
-                logger.warning(result)
-                time.sleep(delay_time)
-                pass
-
-             stationList = ''
-             chunk = 0
-
-        # Process final chunk if there are remaining airports
-        if stationList:
-            stationList = stationList[:-1] #strip trailing comma from string
-            final_url = url + stationList
-            logger.debug(final_url) #debug
-
-            while True: #check internet availability and retry if necessary. If house power outage, map may boot quicker than router.
-                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                s.connect(("8.8.8.8", 80))
-                ipadd = s.getsockname()[0] #get IP Address
-                logger.info('RPI IP Address = ' + ipadd) #log IP address when ever FAA weather update is retreived.
-                logger.info('API URL Final chunk: ' + final_url)
-                try:
-                    result = urllib.request.urlopen(final_url, timeout=30).read() # Added timeout feature - Eric B
-                    # Parse the complete XML response directly - no line manipulation needed
-                    final_root = ET.fromstring(result.decode('UTF-8'))
-                    # Extract METAR elements from final chunk and add to our collection
-                    final_metars = final_root.findall('.//METAR')
-                    all_metar_elements.extend(final_metars)
-                    logger.info(f'Final chunk processed: {len(final_metars)} METARs found')
-                    logger.info('Internet Available')
-                    logger.info(final_url)
-                    break
-                except:
-                    logger.warning('FAA Data is Not Available')
-                    logger.warning(final_url)
-                    time.sleep(delay_time)
-                    pass
-
-        # Create a consolidated root element with all METARs
-        root = ET.Element('response')
-        data_elem = ET.SubElement(root, 'data')
-        data_elem.set('num_results', str(len(all_metar_elements)))
-        
-        # Add all collected METAR elements to the consolidated root
-        for metar_elem in all_metar_elements:
-            data_elem.append(metar_elem)
-            
-        logger.info(f'Total METARs collected from all chunks: {len(all_metar_elements)}')
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))
+        ipadd = s.getsockname()[0] #get IP Address
+        logger.info('RPI IP Address = ' + ipadd) #log IP address when ever FAA weather update is retreived.
+
+        #The TAF's already decoded cover every hour, so a new hour on the rotary switch shows straight away.
+        #They're still updated below, in case they're due.
+        if metar_taf_mos == 0 and taf_timeline is not None:
+            station_states = taf_timeline.states(hour_to_display)
+            states_for = states_key(0, hour_to_display)
+            last_product_key = None
+            logger.info('TAF +' + str(hour_to_display) + ' Hour Shown From Decoded TAF Timeline')
+
+        #The rotary switch moved away from the weather on display, i.e. from a TAF to METARs. Show no weather rather than
+        #the wrong kind until the weather for the new position is swapped in.
+        if states_for != states_key(metar_taf_mos, hour_to_display):
+            if station_states:
+                logger.info('Clearing Weather Shown For The Last Switch Position')
+            station_states = {}
+            states_for = None
+            last_product_key = None
+
+        if not start_update(metar_taf_mos, airports): #Started again for this position once it's done, see the display loop
+            logger.info('Weather Update Already Running')
+
+        if not wx_shown: #Nothing on the map yet, so wait for the first weather
+            wx_thread.join()
 
+    else:
+        #Need to reset whenever new weather is received
+        station_states = {}
+        states_for = states_key(metar_taf_mos, hour_to_display)
+        last_product_key = None
+        wx_shown = True
 
-    if turnoffrefresh == 0:
-        turnoff(strip) #turn off led before repainting them. If Rainbow stays on, it has hung up before this.
+    #Call script and execute desired wipe(s) while data is being updated.
+    if usewipes ==  1 and toggle_sw != -1:
+        exec(compile(open("/NeoSectional/wipes-v4.py", "rb").read(), "/NeoSectional/wipes-v4.py", 'exec')) #Get latest ip's to display in editors
+        logger.info("Calling wipes script")
 
     #Heat Map routine
     #This will allow the user to display which airports on the map have been landed at. There are 2 display modes;
@@ -690,6 +744,7 @@ while (outerloop):
     if metar_taf_mos == 3:
         #read hmdata file - read each time weather is updated in case a change to "airports" file was made while script was running.
         j = 0
+        heatmap_pins = {}               #Airport id and visits by pin
         logger.info("Starting Heat Map")
         with open('/NeoSectional/hmdata') as f:
             for line in f:
@@ -699,12 +754,12 @@ while (outerloop):
                 pin = str(j)
                 j += 1
                 if apid != 'NULL' and apid != 'LGND':
-                    stationiddict[pin] = (apid,visits)
+                    heatmap_pins[pin] = (apid,visits)
 
             #set all the airport their correct color.
-            for pin in stationiddict:
-                apid = stationiddict[pin][0]
-                visits = stationiddict[pin][1]
+            for pin in heatmap_pins:
+                apid = heatmap_pins[pin][0]
+                visits = heatmap_pins[pin][1]
                 if visits == '100':
                     fadehome = pin
                 color = assign_color(visits)
@@ -858,539 +913,160 @@ while (outerloop):
 
     #MOS decode routine
     #MOS data is downloaded daily from; https://www.weather.gov/mdl/mos_gfsmos_mav to the local drive by crontab scheduling.
-    #Then this routine reads through the entire file looking for those airports that are in the airports file. If airport is
-    #found, the data needed to display the weather for the next 24 hours is captured into mos_dict, which is nested with
-    #hour_dict, which holds the airport's MOS data by 3 hour chunks. See; https://www.weather.gov/mdl/mos_gfsmos_mavcard for
-    #a breakdown of what the MOS data looks like and what each line represents.
+    #Then wxmos.py reads the MOS of each airport in the airports file from it, every value from its own column, by
+    #forecast hour. See; https://www.weather.gov/mdl/mos_gfsmos_mavcard for a breakdown of what the MOS data looks like
+    #and what each line represents.
     if metar_taf_mos == 2:
         logger.info("Starting MOS Data Display")
-        #Read current MOS text file
+        #Read current MOS text file, or the MOS saved from it if it hasn't changed since
         try:
-            file = open(mos_filepath, 'r')
-            lines = file.readlines()
+            mos_reports = wxmos.read_cached(mos_filepath, airports)
         except IOError as error:
             logger.error('MOS data file could not be loaded.')
             logger.error(error)
             break
 
-        for line in lines:      #read the MOS data file line by line0
-            line = str(line)
-
-            #Ignore blank lines of MOS airport
-            if line.startswith('     '):
-                ap_flag = 0
-                continue
-
-            #Check for and grab date of MOS
-            if 'DT /' in line:
-                unused, dt_cat, month, unused, unused, day, unused = line.split(" ",6)
-                continue
-
-            #Check for and grab the Airport ID of the current MOS
-            if 'MOS' in line:
-                unused, apid, mos_date = line.split(" ",2)
-
-                #If this Airport ID is in the airports file then grab all the info needed from this MOS
-                if apid in airports:
-                    ap_flag = 1
-                    cat_counter = 0 #used to determine if a category is being reported in MOS or not. If not, need to inject it.
-                    dat0, dat1, dat2, dat3, dat4, dat5, dat6, dat7 = ([] for i in range(8)) #Clear lists
-                continue
-
-            #If we just found an airport that is in our airports file, then grab the appropriate weather data from it's MOS
-            if ap_flag:
-                xtra, cat, value = line.split(" ",2)    #capture the category the line read represents
-                #Check if the needed categories are being read and if so, grab its data
-                if cat in categories:
-                    cat_counter += 1 #used to check if a category is not in mos report for airport
-                    if cat == 'HR': #hour designation
-                        temp = (re.findall(r'\s?(\s*\S+)', value.rstrip()))     #grab all the hours from line read
-                        for j in range(8):
-                            tmp = temp[j].strip()
-                            hour_dict[tmp] = '' #create hour dictionary based on mos data
-                        keys = list(hour_dict.keys()) #Get the hours which are the keys in this dict, so they can be properly poplulated
-
-                    else:
-                        #Checking for missing lines of data and x out if necessary.
-                        if (cat_counter == 5 and cat != 'P06')\
-                                or (cat_counter == 6 and cat != 'T06')\
-                                or (cat_counter == 7 and cat != 'POZ')\
-                                or (cat_counter == 8 and cat != 'POS')\
-                                or (cat_counter == 9 and cat != 'TYP'):
-
-                            #calculate the number of consecutive missing cats and inject 9's into those positions
-                            a = categories.index(last_cat)+1
-                            b = categories.index(cat)+1
-                            c = b - a - 1
-                            logger.debug(apid,last_cat,cat,a,b,c)
-
-                            for j in range(c):
-                                temp = ['9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9', '9']
-                                set_data()
-                                cat_counter += 1
-
-                            #Now write the orignal cat data read from the line in the mos file
-                            cat_counter += 1
-                            hour_dict = collections.OrderedDict() #clear out hour_dict for next airport
-                            last_cat = cat
-                            temp = (re.findall(r'\s?(\s*\S+)', value.rstrip())) #add the actual line of data read
-                            set_data()
-                            hour_dict = collections.OrderedDict() #clear out hour_dict for next airport
-
-                        else:
-                            #continue to decode the next category data that was read.
-                            last_cat = cat #store what the last read cat was.
-                            temp = (re.findall(r'\s?(\s*\S+)', value.rstrip()))
-                            set_data()
-                            hour_dict = collections.OrderedDict() #clear out hour_dict for next airport
-
-        #Now grab the data needed to display on map. Key: [airport][hr][j] - using nested dictionaries
-        #   airport = from airport file, 4 character ID. hr = 1 of 8 three-hour periods of time, 00 03 06 09 12 15 18 21
-        #   j = index to weather categories, in this order; 'CLD','WDR','WSP','P06', 'T06', 'POZ', 'POS', 'TYP','CIG','VIS','OBV'.
+        #Now grab the data needed to display on map, from the 3 hour forecast that covers the time to display.
         #   See; https://www.weather.gov/mdl/mos_gfsmos_mavcard for description of available data.
+        mos_weather = {} #(ceiling and visibility, wind speed, weather, wind direction) by airport, categorized all at once after the loop
         for airport in airports:
-            if airport in mos_dict:
-                logger.debug('\n' + airport) #debug
-                logger.debug(categories) #debug
-
-                mos_time = int(current_hr_zulu) + hour_to_display
-                if mos_time >= 24: #check for reset at 00z
-                    mos_time = mos_time - 24
-
-                for hr in keys:
-                    if int(hr) <= mos_time <= int(hr)+2.99:
-
-                        cld = (mos_dict[airport][hr][0])
-                        wdr = (mos_dict[airport][hr][1]) +'0' #make wind direction end in zero
-                        wsp = (mos_dict[airport][hr][2])
-                        p06 = (mos_dict[airport][hr][3])
-                        t06 = (mos_dict[airport][hr][4])
-                        poz = (mos_dict[airport][hr][5])
-                        pos = (mos_dict[airport][hr][6])
-                        typ = (mos_dict[airport][hr][7])
-                        cig = (mos_dict[airport][hr][8])
-                        vis = (mos_dict[airport][hr][9])
-                        obv = (mos_dict[airport][hr][10])
-
-                        logger.debug(mos_date + hr + cld + wdr + wsp + p06 + t06 + poz + pos + typ + cig + vis + obv) #debug
-
-                        #decode the weather for each airport to display on the livesectional map
-                        flightcategory = "VFR" #start with VFR as the assumption
-                        if cld in ("OV","BK"): #If the layer is OVC, BKN, set Flight category based on height of layer
-
-                            if cig <= '2': #AGL is less than 500:
-                                flightcategory = "LIFR"
-
-                            elif cig == '3': #AGL is between 500 and 1000
-                                flightcategory = "IFR"
-                            elif '4' <= cig <= '5': #AGL is between 1000 and 3000:
-                                flightcategory = "MVFR"
-
-                            elif cig >= '6': #AGL is above 3000
-                                flightcategory = "VFR"
-
-                        #Check visability too.
-                        if flightcategory != "LIFR": #if it's LIFR due to cloud layer, no reason to check any other things that can set fl$
-
-                            if vis <= '2': #vis < 1.0 mile:
-                                flightcategory = "LIFR"
-
-                            elif '3' <= vis < '4': #1.0 <= vis < 3.0 miles:
-                                flightcategory = "IFR"
-
-                            elif vis == '5' and flightcategory != "IFR":  #3.0 <= vis <= 5.0 miles
-                                flightcategory = "MVFR"
-
-                        logger.debug(flightcategory + " |"),
-                        logger.debug('Windspeed = ' + wsp + ' | Wind dir = ' + wdr + ' |'),
-
-                        #decode reported weather using probabilities provided.
-                        if typ == '9': #check to see if rain, freezing rain or snow is reported. If not use obv weather
-                            wx = obv_wx[obv] #Get proper representation for obv designator
-                        else:
-                            wx = typ_wx[typ] #Get proper representation for typ designator
-
-                            if wx == 'RA' and int(p06) < prob:
-                                if obv != 'N':
-                                    wx = obv_wx[obv]
-                                else:
-                                    wx = 'NONE'
-
-                            if wx == 'SN' and int(pos) < prob:
-                                wx = 'NONE'
-
-                            if wx == 'FZRA' and int(poz) < prob:
-                                wx = 'NONE'
-
-#                            print (t06,apid) #debug
-                            if t06 == '' or t06 is None:
-                                t06 = '0'
-
-                            if int(t06) > prob: #check for thunderstorms
-                                wx = 'TSRA'
-                            else:
-                                wx = 'NONE'
-
-                        logger.debug('Reported Weather = ' + wx)
-
-                #Connect the information from MOS to the board
-                stationId = airport
-
-                #grab wind speeds from returned MOS data
-                if wsp == None: #if wind speed is blank, then bypass
-                    windspeedkt = 0
-                elif wsp == '99': #Check to see if MOS data is not reporting windspeed for this airport
-                    windspeedkt = 0
-                else:
-                    windspeedkt = int(wsp)
-
-                #grab Weather info from returned FAA data
-                if wx is None: #if weather string is blank, then bypass
-                    wxstring = "NONE"
-                else:
-                    wxstring = wx
-
-                logger.debug(stationId + ", " + str(windspeedkt) + ", " + wxstring) #debug
+            report = mos_reports.get(airport)
+            if report is None:
+                continue
+            logger.debug('\n' + airport) #debug
 
-                #Check for duplicate airport identifier and skip if found, otherwise store in dictionary. covers for dups in "airports" file
-                if stationId in stationiddict:
-                    logger.info(stationId + " Duplicate, only saved first metar category")
-                else:
-                    stationiddict[stationId] = flightcategory #build category dictionary
+            mos_time = int(current_hr_zulu) + hour_to_display
+            if mos_time >= 24: #check for reset at 00z
+                mos_time = mos_time - 24
 
-                if stationId in windsdict:
-                    logger.info(stationId + " Duplicate, only saved the first winds")
-                else:
-                    windsdict[stationId] = windspeedkt #build windspeed dictionary
+            hr = report.period(mos_time)
+            if hr is None:
+                logger.info(airport + " MOS doesn't cover the time to display")
+                continue
 
-                if stationId in wxstringdict:
-                    logger.info(stationId + " Duplicate, only saved the first weather")
-                else:
-                    wxstringdict[stationId] = wxstring #build weather dictionary
-        logger.info("Decoded MOS Data for Display")
-        
-        # Debug: Show which airports from config have weather data vs which don't
-        airports_with_data = set(stationiddict.keys())
-        airports_from_file = set(airports)
-        airports_from_file.discard("NULL")  # Remove NULL entries
-        airports_from_file.discard("")      # Remove empty entries
-        
-        missing_data = airports_from_file - airports_with_data
-        extra_data = airports_with_data - airports_from_file
-        
-        logger.info(f"MOS - Airports in config file: {len(airports_from_file)}")
-        logger.info(f"MOS - Airports with weather data: {len(airports_with_data)}")
-        logger.info(f"MOS - Airports missing weather data ({len(missing_data)}): {sorted(list(missing_data))}")
-        if extra_data:
-            logger.info(f"MOS - Extra weather data not in config ({len(extra_data)}): {sorted(list(extra_data))}")
-            
-        # Show sample of airports that do have data
-        if airports_with_data:
-            sample_airports = list(airports_with_data)[:10]
-            logger.info(f"MOS - Sample airports with data: {sample_airports}")
-
-
-    #TAF decode routine
-    if metar_taf_mos == 0: #0 equals display TAF. This routine will decode the TAF, pick the appropriate time frame to display.
-        logging.info("Starting TAF Data Display")
-        #start of TAF decoding routine
-        # Get number of results from data element (new API structure)
-        data_elem = root.find('data')
-        if data_elem is not None and 'num_results' in data_elem.attrib:
-            num_results = data_elem.attrib['num_results']
-            logger.debug("\nNum of Airport TAFs = " + num_results) #debug
-
-        for taf in root.findall('.//TAF'):                            #iterate through each airport's TAF
-            stationId = taf.find('station_id').text #debug
-            logger.debug(stationId) #debug
-            logger.debug('Current+Offset Zulu - ' + current_zulu) #debug
-            taf_wx_string = ""
-            taf_change_indicator = ""
-            taf_wind_dir_degrees = ""
-            taf_wind_speed_kt = ""
-            taf_wind_gust_kt = ""
-
-            for forecast in taf.findall('forecast'):        #Now look at the forecasts for the airport
-
-                # Routine inspired by Nick Cirincione.
-                flightcategory = "VFR"                  #intialize flight category
-                taf_time_from = forecast.find('fcst_time_from').text #get taf's from time
-                taf_time_to = forecast.find('fcst_time_to').text #get taf's to time
-
-                if forecast.find('wx_string') is not None:
-                    taf_wx_string = forecast.find('wx_string').text #get weather conditions
-
-                if forecast.find('change_indicator') is not None:
-                    taf_change_indicator = forecast.find('change_indicator').text #get change indicator
-
-                if forecast.find('wind_dir_degrees') is not None:
-                    taf_wind_dir_degrees = forecast.find('wind_dir_degrees').text #get wind direction
-
-                if forecast.find('wind_speed_kt') is not None:
-                    taf_wind_speed_kt = forecast.find('wind_speed_kt').text #get wind speed
-
-                if forecast.find('wind_gust_kt') is not None:
-                    taf_wind_gust_kt = forecast.find('wind_gust_kt').text #get wind gust speed
-
-                if taf_time_from <= current_zulu <= taf_time_to: #test if current time plus offset falls within taf's timeframe
-                    logger.debug('FROM - ' + taf_time_from)
-                    logger.debug(comp_time(taf_time_from))
-                    logger.debug('TO - ' + taf_time_to)
-                    logger.debug(comp_time(taf_time_to))
-
-                    #There can be multiple layers of clouds in each taf, but they are always listed lowest AGL first.
-                    #Check the lowest (first) layer and see if it's overcast, broken, or obscured. If it is, then compare to cloud base height to set $
-                    #This algorithm basically sets the flight category based on the lowest OVC, BKN or OVX layer.
-                    for sky_condition in forecast.findall('sky_condition'): #for each sky_condition from the XML
-                        sky_cvr = sky_condition.attrib['sky_cover']     #get the sky cover (BKN, OVC, SCT, etc)
-                        logger.debug(sky_cvr) #debug
-
-                        if sky_cvr in ("OVC","BKN","OVX"): #If the layer is OVC, BKN or OVX, set Flight category based on height AGL
-
-                            try:
-                                cld_base_ft_agl = sky_condition.attrib['cloud_base_ft_agl'] #get cloud base AGL from XML
-                                logger.debug(cld_base_ft_agl) #debug
-                            except:
-                                cld_base_ft_agl = forecast.find('vert_vis_ft').text #get cloud base AGL from XML
-
-
-#                            cld_base_ft_agl = sky_condition.attrib['cloud_base_ft_agl'] #get cloud base AGL from XML
-#                            logger.debug(cld_base_ft_agl) #debug
-
-                            cld_base_ft_agl = int(cld_base_ft_agl)
-                            if cld_base_ft_agl < 500:
-                                flightcategory = "LIFR"
-                                break
-
-                            elif 500 <= cld_base_ft_agl < 1000:
-                                flightcategory = "IFR"
-                                break
-
-                            elif 1000 <= cld_base_ft_agl <= 3000:
-                                flightcategory = "MVFR"
-                                break
-
-                            elif cld_base_ft_agl > 3000:
-                                flightcategory = "VFR"
-                                break
-
-                    #visibilty can also set flight category. If the clouds haven't set the fltcat to LIFR. See if visibility will
-                    if flightcategory != "LIFR": #if it's LIFR due to cloud layer, no reason to check any other things that can set flight category.
-                        if forecast.find('visibility_statute_mi') is not None: #check XML if visibility value exists
-                            visibility_statute_mi = forecast.find('visibility_statute_mi').text   #get visibility number
-                            visibility_statute_mi = float(visibility_statute_mi.strip('+'))
-                            logger.debug(visibility_statute_mi)
-
-                            if visibility_statute_mi < 1.0:
-                                flightcategory = "LIFR"
-
-                            elif 1.0 <= visibility_statute_mi < 3.0:
-                                flightcategory = "IFR"
-
-                            elif 3.0 <= visibility_statute_mi <= 5.0 and flightcategory != "IFR":  #if Flight Category was already set to IFR $
-                                flightcategory = "MVFR"
-
-                    #Print out TAF data to screen for diagnosis only
-                    logger.debug('Airport - ' + stationId)
-                    logger.debug('Flight Category - ' + flightcategory)
-                    logger.debug('Wind Speed - ' + taf_wind_speed_kt)
-                    logger.debug('WX String - ' + taf_wx_string)
-                    logger.debug('Change Indicator - ' + taf_change_indicator)
-                    logger.debug('Wind Director Degrees - ' + taf_wind_dir_degrees)
-                    logger.debug('Wind Gust - ' + taf_wind_gust_kt)
-
-                    #grab flightcategory from returned FAA data
-                    if flightcategory is None: #if wind speed is blank, then bypass
-                        flightcategory = None
-
-                    #grab wind speeds from returned FAA data
-                    if taf_wind_speed_kt is None: #if wind speed is blank, then bypass
-                        windspeedkt = 0
-                    else:
-                        windspeedkt = taf_wind_speed_kt
+            cld = report.value('CLD', hr)
+            wdr = report.value('WDR', hr) #in tens of degrees
+            wsp = report.value('WSP', hr)
+            p06 = report.window('P06', hr) #6 hour values are for the 6 hours this forecast hour is in
+            t06 = report.window('T06', hr) #(thunderstorm, severe thunderstorm) percents
+            poz = report.value('POZ', hr)
+            pos = report.value('POS', hr)
+            typ = report.value('TYP', hr)
+            cig = report.value('CIG', hr)
+            vis = report.value('VIS', hr)
+            obv = report.value('OBV', hr)
+
+            logger.debug(report.date + ' ' + report.time + ' ' + str([report.hours[hr], cld, wdr, wsp, p06, t06, poz, pos, typ, cig, vis, obv])) #debug
+
+            #Ceiling and visibility for the flight category, worked out for every airport at once below
+            limits = wxdecode.mos_limits(cld, cig, vis)
+            logger.debug('Ceiling = ' + str(limits[0]) + ' | Visibility = ' + str(limits[1]) + ' |'),
+            logger.debug('Windspeed = ' + str(wsp) + ' | Wind dir = ' + str(wdr) + ' |'),
+
+            #decode reported weather using probabilities provided.
+            if typ not in typ_wx: #check to see if rain, freezing rain or snow is reported. If not use obv weather
+                wx = obv_wx.get(obv, 'NONE') #Get proper representation for obv designator
+            else:
+                wx = typ_wx[typ] #Get proper representation for typ designator
 
-                    #grab Weather info from returned FAA data
-                    if taf_wx_string is None: #if weather string is blank, then bypass
-                        wxstring = "NONE"
+                if wx == 'RA' and (p06 or 0) < prob:
+                    if obv != 'N':
+                        wx = obv_wx.get(obv, 'NONE')
                     else:
-                        wxstring = taf_wx_string
+                        wx = 'NONE'
 
-            #Check for duplicate airport identifier and skip if found, otherwise store in dictionary. covers for dups in "airports" file
-            if stationId in stationiddict:
-                logger.info(stationId + " Duplicate, only saved first metar category")
-            else:
-                stationiddict[stationId] = flightcategory #build category dictionary
+                if wx == 'SN' and (pos or 0) < prob:
+                    wx = 'NONE'
 
-            if stationId in windsdict:
-                logger.info(stationId + " Duplicate, only saved the first winds")
-            else:
-                windsdict[stationId] = windspeedkt #build windspeed dictionary
+                if wx == 'FZRA' and (poz or 0) < prob:
+                    wx = 'NONE'
 
-            if stationId in wxstringdict:
-                logger.info(stationId + " Duplicate, only saved the first weather")
-            else:
-                wxstringdict[stationId] = wxstring #build weather dictionary
-        logger.info("Decoded TAF Data for Display")
-        
-        # Debug: Show which airports from config have weather data vs which don't
-        airports_with_data = set(stationiddict.keys())
-        airports_from_file = set(airports)
-        airports_from_file.discard("NULL")  # Remove NULL entries
-        airports_from_file.discard("")      # Remove empty entries
-        
-        missing_data = airports_from_file - airports_with_data
-        extra_data = airports_with_data - airports_from_file
-        
-        logger.info(f"TAF - Airports in config file: {len(airports_from_file)}")
-        logger.info(f"TAF - Airports with weather data: {len(airports_with_data)}")
-        logger.info(f"TAF - Airports missing weather data ({len(missing_data)}): {sorted(list(missing_data))}")
-        if extra_data:
-            logger.info(f"TAF - Extra weather data not in config ({len(extra_data)}): {sorted(list(extra_data))}")
-            
-        # Show sample of airports that do have data
-        if airports_with_data:
-            sample_airports = list(airports_with_data)[:10]
-            logger.info(f"TAF - Sample airports with data: {sample_airports}")
-
-
-    elif metar_taf_mos == 1:
-        logger.info("Starting METAR Data Display")
-        #start of METAR decode routine if 'metar_taf_mos' equals 1. Script will default to this routine without a rotary switch installed.
-        #grab the airport category, wind speed and various weather from the results given from FAA.
-        for metar in root.findall('.//METAR'):
-            stationId = metar.find('station_id').text
-
-
-        ### METAR Decode Routine to create flight category via cloud cover and/or visability when flight category is not reported.
-        # Routine contributed to project by Nick Cirincione. Thank you for your contribution.
-            if metar.find('flight_category').text is None or metar.find('flight_category').text == 'NONE': #if category is blank, then see if there's a sky condition or vis that would dictate flight category
-                flightcategory = "VFR" #intialize flight category
-                sky_cvr = "SKC" # Initialize to Sky Clear
-                logger.info(stationId + " Not Reporting Flight Category through the API.")
-
-                # There can be multiple layers of clouds in each METAR, but they are always listed lowest AGL first.
-                # Check the lowest (first) layer and see if it's overcast, broken, or obscured. If it is, then compare to cloud base height to set flight category.
-                # This algorithm basically sets the flight category based on the lowest OVC, BKN or OVX layer.
-                # First check to see if the FAA provided the forecast field, if not get the sky_condition.
-                if metar.find('forecast') is None or metar.find('forecast') == 'NONE':
-                    logger.info('FAA xml data is NOT providing the forecast field for this airport')
-                    for sky_condition in metar.findall('./sky_condition'):   #for each sky_condition from the XML
-                        sky_cvr = sky_condition.attrib['sky_cover']     #get the sky cover (BKN, OVC, SCT, etc)
-                        logger.debug('Sky Cover = ' + sky_cvr)
-
-                        if sky_cvr in ("OVC","BKN","OVX"): # Break out of for loop once we find one of these conditions
-                            break
+                if t06 is None: #No thunderstorms forecast
+                    t06 = (0, 0)
 
+                if t06[0] > prob: #check for thunderstorms
+                    wx = 'TSRA'
                 else:
-                    logger.info('FAA xml data IS providing the forecast field for this airport')
-                    for sky_condition in metar.findall('./forecast/sky_condition'):   #for each sky_condition from the XML
-                        sky_cvr = sky_condition.attrib['sky_cover']     #get the sky cover (BKN, OVC, SCT, etc)
-                        logger.debug('Sky Cover = ' + sky_cvr)
-                        logger.debug(metar.find('./forecast/fcst_time_from').text)
-
-                        if sky_cvr in ("OVC","BKN","OVX"): # Break out of for loop once we find one of these conditions
-                            break
-
-                if sky_cvr in ("OVC","BKN","OVX"): #If the layer is OVC, BKN or OVX, set Flight category based on height AGL
-                    try:
-                        cld_base_ft_agl = sky_condition.attrib['cloud_base_ft_agl'] #get cloud base AGL from XML
-                    except:
-                        cld_base_ft_agl = forecast.find('vert_vis_ft').text #get cloud base AGL from XML
-
-                    logger.debug('Cloud Base = ' + cld_base_ft_agl)
-                    cld_base_ft_agl = int(cld_base_ft_agl)
-
-                    if cld_base_ft_agl < 500:
-                        flightcategory = "LIFR"
-#                        break
-                    elif 500 <= cld_base_ft_agl < 1000:
-                        flightcategory = "IFR"
-#                        break
-                    elif 1000 <= cld_base_ft_agl <= 3000:
-                        flightcategory = "MVFR"
-#                        break
-                    elif cld_base_ft_agl > 3000:
-                        flightcategory = "VFR"
-#                        break
-
-                #visibilty can also set flight category. If the clouds haven't set the fltcat to LIFR. See if visibility will
-                if flightcategory != "LIFR": #if it's LIFR due to cloud layer, no reason to check any other things that can set flight category.
-                    if metar.find('./forecast/visibility_statute_mi') is not None: #check XML if visibility value exists
-                        visibility_statute_mi = metar.find('./forecast/visibility_statute_mi').text   #get visibility number
-                        visibility_statute_mi = float(visibility_statute_mi.strip('+'))
-
-                        if visibility_statute_mi < 1.0:
-                            flightcategory = "LIFR"
-
-                        elif 1.0 <= visibility_statute_mi < 3.0:
-                            flightcategory = "IFR"
-
-                        elif 3.0 <= visibility_statute_mi <= 5.0 and flightcategory != "IFR":  #if Flight Category was already set to IFR by clouds, it can't be reduced to MVFR
-                            flightcategory = "MVFR"
-
-                logger.debug(stationId + " flight category is Decode script-determined as " + flightcategory)
+                    wx = 'NONE'
 
-            else:
-                logger.debug(stationId + ': FAA is reporting '+metar.find('flight_category').text + ' through their API')
-                flightcategory = metar.find('flight_category').text  #pull flight category if it exists and save all the algoritm above
-            ### End of METAR Decode added routine to create flight category via cloud cover and/or visability when flight category is not reported.
+            logger.debug('Reported Weather = ' + wx)
 
+            #Connect the information from MOS to the board
+            stationId = airport
 
-            #grab wind speeds from returned FAA data
-            if metar.find('wind_speed_kt') is None: #if wind speed is blank, then bypass
+            #grab wind speeds from returned MOS data
+            if wsp is None: #if wind speed is blank, then bypass
+                windspeedkt = 0
+            elif wsp == 99: #Check to see if MOS data is not reporting windspeed for this airport
                 windspeedkt = 0
             else:
-                windspeedkt = metar.find('wind_speed_kt').text
+                windspeedkt = wsp
 
-            #grab Weather info from returned FAA data
-            if metar.find('wx_string') is None: #if weather string is blank, then bypass
-                wxstring = "NONE"
+            #grab wind direction from returned MOS data
+            if wdr is None: #if wind direction is blank, then bypass
+                winddirdegree = 0
             else:
-                wxstring = metar.find('wx_string').text
+                winddirdegree = wdr * 10 #make wind direction end in zero
 
-            #Check for duplicate airport identifier and skip if found, otherwise store in dictionary. covers for dups in "airports" file
-            if stationId in stationiddict:
-                logger.info(stationId + " Duplicate, only saved first metar category")
-            else:
-                stationiddict[stationId] = flightcategory #build category dictionary
+            wxstring = wx
 
-            if stationId in windsdict:
-                logger.info(stationId + " Duplicate, only saved the first winds")
-            else:
-                windsdict[stationId] = windspeedkt #build windspeed dictionary
+            logger.debug(stationId + ", " + str(windspeedkt) + ", " + wxstring) #debug
 
-            if stationId in wxstringdict:
+            if stationId in mos_weather:
                 logger.info(stationId + " Duplicate, only saved the first weather")
             else:
-                wxstringdict[stationId] = wxstring #build weather dictionary
-        logger.info("Decoded METAR Data for Display")
-        
-        # Debug: Show which airports from config have weather data vs which don't
-        airports_with_data = set(stationiddict.keys())
-        airports_from_file = set(airports)
-        airports_from_file.discard("NULL")  # Remove NULL entries
-        airports_from_file.discard("")      # Remove empty entries
-        
-        missing_data = airports_from_file - airports_with_data
-        extra_data = airports_with_data - airports_from_file
+                mos_weather[stationId] = (limits, windspeedkt, wxstring, winddirdegree)
+
+        #Flight category of every airport in one pass. See wxdecode.py
+        flightcategories = wxdecode.classify_stations({stationId: weather[0] for stationId, weather in mos_weather.items()})
+        for stationId, (limits, windspeedkt, wxstring, winddirdegree) in mos_weather.items():
+            save_state(station_states, stationId, flightcategories[stationId], windspeedkt, 0, wxstring, winddirdegree) #MOS has no gusts
+        logger.info("Decoded MOS Data for Display")
         
-        logger.info(f"Airports in config file: {len(airports_from_file)}")
-        logger.info(f"Airports with weather data: {len(airports_with_data)}")
-        logger.info(f"Airports missing weather data ({len(missing_data)}): {sorted(list(missing_data))}")
-        if extra_data:
-            logger.info(f"Extra weather data not in config ({len(extra_data)}): {sorted(list(extra_data))}")
-            
-        # Show sample of airports that do have data
-        if airports_with_data:
-            sample_airports = list(airports_with_data)[:10]
-            logger.info(f"Sample airports with data: {sample_airports}")
+        log_coverage('MOS - ', station_states, airports)
+
+
 
     #Setup timed loop for updating FAA Weather that will run based on the value of 'update_interval' which is a user setting
-    timeout_start = time.time() #Start the timer. When timer hits user-defined value, go back to outer loop to update FAA Weather.
+    #wxsched.py lines the update up with when our airports publish their METARs, waiting at most a minute past 'update_interval'
+    refresh_time = wxsched.next_refresh(update_interval, metar=(metar_taf_mos == 1)) #When timer hits this time, go back to outer loop to update FAA Weather.
+    led_states = wxstate.led_table(airports, station_states) #Weather for each LED, so the display loop doesn't look anything up
+    if states_for is not None: #Nothing is published for the switch position until its weather is swapped in
+        wx_table.publish(airports, led_states, metar_taf_mos, hour_to_display)
     loopcount=0
-    while time.time() < timeout_start + (update_interval * 60): #take 'update_interval' which is in minutes and turn into seconds
+    while time.time() < refresh_time:
         loopcount = loopcount + 1
 
+        #Swap in the weather from the background thread once it's ready. This happens between display cycles so every LED
+        #changes together. METARs that arrive once the switch is on a TAF, or the other way round, aren't shown.
+        with wx_lock:
+            wx_ready, wx_next = wx_next, None
+        if wx_ready is not None:
+            wx_mode, wx_key, wx_states = wx_ready
+            if wx_mode == 0:
+                taf_timeline = wx_states #Kept for the next time the switch is on a TAF, even if it isn't now
+            if wx_mode == 1 and wx_mode == metar_taf_mos and wx_states is None: #Same METARs as on display, nothing to repaint
+                last_product_key = wx_key
+            elif wx_mode == metar_taf_mos:
+                if wx_mode == 0: #TAF's for every hour, show the one the rotary switch is set to
+                    station_states = taf_timeline.states(hour_to_display)
+                else:
+                    station_states = wx_states
+                states_for = states_key(metar_taf_mos, hour_to_display)
+                led_states = wxstate.led_table(airports, station_states)
+                wx_table.publish(airports, led_states, metar_taf_mos, hour_to_display)
+                last_product_key = wx_key if wx_mode == 1 else None #Remember what was decoded to compare at the next update
+                wx_shown = True
+                logger.info('New Weather Swapped In For Display')
+                if turnoffrefresh == 0:
+                    turnoff(strip) #turn off led before repainting them. If Rainbow stays on, it has hung up before this.
+
+        #The rotary switch moved while the weather for its last position was being updated. Update for the new position
+        #as soon as that's done, rather than showing no weather until the next refresh.
+        if metar_taf_mos in (0, 1) and states_for is None and wx_thread_mode != metar_taf_mos:
+            if start_update(metar_taf_mos, airports):
+                logger.info('Weather Update Started For The New Switch Position')
+
         # Check time and reboot machine if time equals time_reboot and if use_reboot along with autorun are both set to 1
         if use_reboot == 1 and autorun == 1:
             now = datetime.now()
@@ -1570,13 +1246,13 @@ while (outerloop):
             print(" " + str(cycle_num), end = '')
             sys.stdout.flush()
 
-            i = 0 #Inner Loop. Increments through each LED in the strip setting the appropriate color to each individual LED.
-            for airportcode in airports:
+            #Inner Loop. Increments through each LED in the strip setting the appropriate color to each individual LED.
+            for i, airportcode in enumerate(airports):
 
-                flightcategory = stationiddict.get(airportcode,"NONE") #Pull the next flight category from dictionary.
-                airportwinds = windsdict.get(airportcode,0) #Pull the winds from the dictionary.
-                airportwx_long = wxstringdict.get(airportcode,"NONE") #Pull the weather reported for the airport from dictionary.
-                airportwx = airportwx_long.split(" ",1)[0] #Grab only the first parameter of the weather reported.
+                state = led_states[i] #Weather for this LED, see wxstate.py
+                flightcategory = state.category
+                airportwinds = state.wind
+                airportwx = state.wx #Bit for the most significant weather reported, see wxstate.py
 
                 #debug print out
                 if metar_taf_mos == 0:
@@ -1589,10 +1265,10 @@ while (outerloop):
                     logger.debug("Heat Map + ")
 
 
-                logger.debug((airportcode + " " + flightcategory + " " + str(airportwinds) + " " + airportwx + " " + str(cycle_num) + " ")) #debug
+                logger.debug((airportcode + " " + flightcategory.name + " " + str(airportwinds) + " " + state.weather + " " + str(cycle_num) + " ")) #debug
                 
                 # Additional debug for airports with no data
-                if flightcategory == "NONE" and airportcode not in ["NULL", "LGND"]:
+                if flightcategory == wxstate.Category.NONE and airportcode not in ["NULL", "LGND"]:
                     logger.info(f"Airport {airportcode} has no flight category data - LED will show nowx color")
 
                 #Check to see if airport code is a NULL and set to black.
@@ -1682,69 +1358,60 @@ while (outerloop):
 
                 #Start of weather display code for each airport in the "airports" file
                 #Check flight category and set the appropriate color to display
-                if  flightcategory != "NONE":
-                    if flightcategory == "VFR":     #Visual Flight Rules
-                        color = color_vfr
-                    elif flightcategory == "MVFR":  #Marginal Visual Flight Rules
-                        color = color_mvfr
-                    elif flightcategory == "IFR":   #Instrument Flight Rules
-                        color = color_ifr
-                    elif flightcategory == "LIFR":  #Low Instrument Flight Rules
-                        color = color_lifr
-                    else:
-                        color = color_nowx
+                if  flightcategory != wxstate.Category.NONE:
+                    color = category_colors[flightcategory] #VFR, MVFR, IFR or LIFR
 
-                elif flightcategory == "NONE" and airportcode != "LGND" and airportcode != "NULL": #3.01 bug fix by adding "LGND" test
+                elif airportcode != "LGND" and airportcode != "NULL": #3.01 bug fix by adding "LGND" test
                     color = color_nowx          #No Weather reported.
 
                 #Check winds and set the 2nd half of cycles to black to create blink effect
                 if hiwindblink: #bypass if "hiwindblink" is set to 0
         #          if(airportwinds != ''):
               #      print(airportcode, 'airportwinds',type(airportwinds),":".join("{:02x}".format(ord(c)) for c in airportwinds), 'max_wind_speed', max_wind_speed,'cycle_num',cycle_num)
-                    if (int(airportwinds) >= max_wind_speed and (cycle_num == 3 or cycle_num == 4 or cycle_num == 5)):
+                    if (airportwinds >= max_wind_speed and (cycle_num == 3 or cycle_num == 4 or cycle_num == 5)):
                         color = color_black
                         print(("HIGH WINDS-> " + airportcode + " Winds = " + str(airportwinds) + " ")) #debug
                         logger.info(("HIGH WINDS-> " + airportcode + " Winds = " + str(airportwinds) + " ")) #debug
 
                 #Check the wxstring from FAA for reported weather and create color changes in LED for weather effect.
-                if airportwx != "NONE":
+                if airportwx:
                     if  lghtnflash:
-                        if (airportwx in wx_lghtn_ck and (cycle_num == 2 or cycle_num == 4)): #Check for Thunderstorms
+                        if (airportwx & wxstate.LGHTN and (cycle_num == 2 or cycle_num == 4)): #Check for Thunderstorms
                             color = color_lghtn
 
                     if snowshow:
-                        if (airportwx in wx_snow_ck and (cycle_num == 3 or cycle_num == 5)): #Check for Snow
+                        if (airportwx & wxstate.SNOW and (cycle_num == 3 or cycle_num == 5)): #Check for Snow
                             color = color_snow1
 
-                        if (airportwx in wx_snow_ck and cycle_num == 4):
+                        if (airportwx & wxstate.SNOW and cycle_num == 4):
                             color = color_snow2
 
                     if rainshow:
-                        if (airportwx in wx_rain_ck and (cycle_num == 3 or cycle_num == 4)): #Check for Rain
+                        if (airportwx & wxstate.RAIN and (cycle_num == 3 or cycle_num == 4)): #Check for Rain
                             color = color_rain1
 
-                        if (airportwx in wx_rain_ck and cycle_num == 5):
+                        if (airportwx & wxstate.RAIN and cycle_num == 5):
                             color = color_rain2
 
                     if frrainshow:
-                        if (airportwx in wx_frrain_ck and (cycle_num == 3 or cycle_num == 5)): #Check for Freezing Rain
+                        if (airportwx & wxstate.FRRAIN and (cycle_num == 3 or cycle_num == 5)): #Check for Freezing Rain
                             color = color_frrain1
 
-                        if (airportwx in wx_frrain_ck and cycle_num == 4):
+                        if (airportwx & wxstate.FRRAIN and cycle_num == 4):
                             color = color_frrain2
 
                     if dustsandashshow:
-                        if (airportwx in wx_dustsandash_ck and (cycle_num == 3 or cycle_num == 5)): #Check for Dust, Sand or Ash
+                        if (airportwx & wxstate.DUSTSANDASH and (cycle_num == 3 or cycle_num == 5)): #Check for Dust, Sand or Ash
                             color = color_dustsandash1
 
-                        if (airportwx in wx_dustsandash_ck and cycle_num == 4):
+                        if (airportwx & wxstate.DUSTSANDASH and cycle_num == 4):
                             color = color_dustsandash2
 
                     if fogshow:
-                        if (airportwx in wx_fog_ck and (cycle_num == 3 or cycle_num == 5)): #Check for Fog
+                        if (airportwx & wxstate.FOG and (cycle_num == 3 or cycle_num == 5)): #Check for Fog
                             color = color_fog1
 
-                        if (airportwx in wx_fog_ck and cycle_num == 4):
+                        if (airportwx & wxstate.FOG and cycle_num == 4):
                             color = color_fog2
 
                 #If homeport is set to 1 then turn on the appropriate LED using a specific color, This will toggle
@@ -1770,7 +1437,6 @@ while (outerloop):
                     xcolor = Color(norm_color[0], norm_color[1], norm_color[2])
 
                 strip.setPixelColor(i, xcolor) #set color to display on a specific LED for the current cycle_num cycle.
-                i = i + 1 #set next LED pin in strip
 
             print("/LED.",end='')
             sys.stdout.flush()
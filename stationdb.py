@@ -0,0 +1,121 @@
+#stationdb.py - by Mark Harris. Local database of airport information used by webapp.py and wipes-v4.py
+#    Site name, state, country and lat/lon of an airport almost never change, so rather than asking the FAA for them
+#    every time webapp.py starts, they're kept in stations.json in the weather cache directory set in admin.py.
+#    Reading the database never touches the network. Airports that are missing or older than 'station_ttl'
+#    are requested from the FAA in a background thread and added for next time.
+#
+#    Can also be run from the command line to fill the database, i.e. 'sudo python3 /NeoSectional/stationdb.py'
+
+#Import needed libraries
+import time
+import os
+import json
+import fcntl
+import threading
+from logzero import logger
+import wxfetch                                  #Shared FAA weather fetcher
+
+#Misc settings
+station_ttl = 30 * 24 * 60 * 60                 #Seconds before an airport's information is requested again. 30 days
+internet_tries = 10                             #Number of times to try to access the internet before giving up until next time
+refreshing = threading.Lock()                   #Only one background refresh at a time
+
+#Path to the database file. Built when needed since scripts can change wxfetch.cache_dir.
+def db_path():
+    return os.path.join(wxfetch.cache_dir, 'stations.json')
+
+#Read the whole database. Each airport has 'site', 'state', 'country', 'lat', 'lon' and 'fetched'.
+#Airports the FAA didn't know about are stored with 'missing' so they aren't asked for again until they expire.
+def read_db():
+    try:
+        with open(db_path()) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+#Return the information on hand for the airports given, as a dict by airport id. No network calls.
+def lookup(airports):
+    db = read_db()
+    stations = {}
+    for stationId in wxfetch.station_list(airports):
+        station = db.get(stationId)
+        if station is not None and not station.get('missing'):
+            stations[stationId] = station
+    return stations
+
+#Airports that aren't in the database yet, or whose information has expired.
+def stale_stations(airports):
+    db = read_db()
+    now = time.time()
+    return [stationId for stationId in wxfetch.station_list(airports)
+            if stationId not in db or now - db[stationId].get('fetched', 0) > station_ttl]
+
+#Ask the FAA for the airports given and add them to the database. Returns the number of airports added.
+#Uses the same lock and circuit breaker as wxfetch.get_product(), so only one script asks the FAA at a time, nothing is
+#asked while the breaker is open and failures here count towards opening it for the weather too.
+def refresh(airports, tries=internet_tries):
+    stations = stale_stations(airports)
+    if not stations:
+        return 0
+    if wxfetch.breaker_open():
+        logger.info('FAA Circuit Breaker Open - Airport Information Not Refreshed')
+        return 0
+
+    os.makedirs(wxfetch.cache_dir, exist_ok=True)
+    with open(wxfetch.cache_paths('stationinfo', stations)[2], 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)        #Wait here if another script is already asking for them
+        stations = stale_stations(airports)     #Check again, the other script may have just added them
+        if not stations or wxfetch.breaker_open():
+            return 0
+
+        logger.info('Requesting Airport Information For ' + str(len(stations)) + ' Airports')
+        product = wxfetch.fetch('stationinfo', stations, tries)
+        if product is None:
+            wxfetch.breaker_failure()
+            logger.warning('Airport Information Not Available From FAA')
+            return 0
+        wxfetch.breaker_success()
+
+        now = time.time()
+        found = {}
+        for apinfo in product.records:
+            stationId = apinfo.get('station_id')
+            found[stationId] = {'site': apinfo.get('site') or '', 'state': apinfo.get('state') or '',
+                                'country': apinfo.get('country') or '', 'lat': apinfo.get('latitude') or '0',
+                                'lon': apinfo.get('longitude') or '0', 'fetched': now}
+
+        def merge(db):
+            for stationId in stations:
+                db[stationId] = found.get(stationId, {'missing': True, 'fetched': now})
+        wxfetch.update_json('stations.json', merge)
+    logger.info('Airport Information Updated For ' + str(len(found)) + ' Airports')
+    return len(found)
+
+#Refresh the airports given in a background thread so the caller doesn't wait on the FAA.
+#'done' is called once the new information is in the database.
+def refresh_in_background(airports, done=None):
+    if not stale_stations(airports) or not refreshing.acquire(blocking=False):
+        return None
+
+    def run():
+        try:
+            added = refresh(airports)
+        except Exception as e:
+            logger.warning('Airport Information Refresh Failed')
+            logger.warning(e)
+            added = 0
+        finally:
+            refreshing.release()
+        if added and done is not None:
+            done()
+
+    thread = threading.Thread(target=run, name='stationdb', daemon=True)
+    thread.start()
+    return thread
+
+
+#Fill the database for the current airports file.
+if __name__ == '__main__':
+    airports = wxfetch.read_airports()
+    refresh(airports)
+    print(str(len(lookup(airports))) + ' airports in ' + db_path())
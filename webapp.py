@@ -22,6 +22,8 @@
 #     Fixed bug where get_led_map_info() would not get lat/Lon from XML file.
 #     Thank you Daniel from pilotmap.co for the change the routine that handles maps with more than 300 airports.
 #     Added counter to quit the script if FAA data (internet) is not available. Will try 10 times before quitting.
+#     FAA data is now retrieved through wxfetch.py which shares it with metar-v4.py and metar-display-v4.py
+#     Airport information is kept on disk by stationdb.py so startup and the LED map don't wait on the FAA.
 
 # print test #force bug to cause webapp.py to error out
 
@@ -32,8 +34,6 @@ from werkzeug.utils import secure_filename
 #    if URLError: <urlopen error [SSL: CERTIFICATE_VERIFY_FAILED] try;
 #    $ sudo update-ca-certificates --fresh
 #    $ export SSL_CERT_DIR=/etc/ssl/certs
-import urllib.request, urllib.error, urllib.parse
-import xml.etree.ElementTree as ET
 from datetime import datetime
 import time
 import os
@@ -59,9 +59,11 @@ from logzero import logger
 import config
 import admin
 import scan_network
+import wxfetch                  # Shared FAA weather fetcher, so all scripts use the same data
+import stationdb                # Airport information kept on disk, i.e. city, state and lat/lon
+import wxtable                  # The weather metar-v4.py is showing on the LED's, already decoded
 
 ###################
-from itertools import islice # Thanks Daniel 
 ###################
 
 # Setup rotating logfile with 3 rotations, each with a maximum filesize of 1MB:
@@ -98,11 +100,6 @@ min_lat = ''
 max_lon = ''
 min_lon = ''
 
-################
-# misc variables
-################
-max_api_airports = 300          # The max amount of airports from api with one request - Thanks Daniel pilotmap.co
-
 # Settings for web based file updating
 src = '/NeoSectional'                           # Main directory, /NeoSectional
 dest = '../previousversion'                     # Directory to store currently run version of software
@@ -114,17 +111,11 @@ update_available = 0                            # 0 = No update available, 1 = Y
 update_vers = "4.000"                           # initiate variable
 
 # Used to capture staton information for airport id decode for tooltip display in web pages.
+# Station info is kept on disk by stationdb.py, which requests missing airports from the FAA in the background.
 apinfo_dict = {}
-#orig_apurl = "https://aviationweather-cprk.ncep.noaa.gov/adds/dataserver_current/httpparam?dataSource=stations&requestType=retrieve&format=xml&stationString="
-orig_apurl = "https://aviationweather.gov/api/data/stationinfo?format=xml&ids="
-logger.debug(orig_apurl)
 
 #Used to display weather and airport locations on a map
 led_map_dict = {}
-#led_map_url = "https://aviationweather-cprk.ncep.noaa.gov/adds/dataserver_current/httpparam?dataSource=metars&requestType=retrieve&format=json&hoursBeforeNow=2.5&mostRecentForEachStation=constraint&stationString="
-#led_map_url = "https://aviationweather-cprk.ncep.noaa.gov/adds/dataserver_current/httpparam?dataSource=metars&requestType=retrieve&format=xml&hoursBeforeNow=2.5&mostRecentForEachStation=constraint&stationString="
-led_map_url = "https://aviationweather.gov/api/data/metar?format=xml&hours=2.5&ids="
-logger.debug(led_map_url)
 
 # LED strip configuration:
 LED_COUNT      = 500            # Max Number of LED pixels.
@@ -150,6 +141,7 @@ logger.debug(timestr)
 delay_time = 5                  # Delay in seconds between checking for internet availablility.
 num = 0                         # initialize num for airports editor
 ipadd = ''
+wx_table_reader = wxtable.TableReader() # Weather metar-v4.py publishes, mapped once and read for /wxtable
 
 # Initiate flash session
 app = Flask(__name__)
@@ -579,6 +571,25 @@ def yindex():
     logger.info("Opening yeild to display system info in separate window")
     return Response(inner(), mimetype='text/html')  # text/html is required for most browsers to show this info.
 
+# Route to send the weather shown on the LED's as JSON, one entry per LED pin, read from what metar-v4.py publishes.
+# Add ?since=<generation> to get an empty response until the weather changes from that generation.
+@app.route('/wxtable', methods=["GET"])
+def wx_table():
+    table = wx_table_reader.read()
+    if table is None:
+        return Response(json.dumps({'generation': None}), mimetype='application/json')
+    if request.args.get('since') == str(table.generation):
+        return Response(json.dumps({'generation': table.generation}), mimetype='application/json')
+
+    rows = []
+    for wx in table.rows:
+        item = wx._asdict()
+        item['category'] = wx.category.name
+        rows.append(item)
+    wxdata = {'generation': table.generation, 'mode': table.mode, 'hour_offset': table.hour_offset,
+              'published': table.published, 'rows': rows}
+    return Response(json.dumps(wxdata), mimetype='application/json')
+
 # Route to create QR Code to display next to map so user can use an app to control the map
 @app.route('/qrcode', methods=["GET", "POST"])
 def qrcode():
@@ -1576,7 +1587,6 @@ def writehmdata(hmdata,heatmap_file):
 def get_led_map_info():
     logger.debug('In get_led_map_info Routine')
 
-    global led_map_url
     global led_map_dict
     global lat_list
     global lon_list
@@ -1586,70 +1596,32 @@ def get_led_map_info():
     global min_lon
 
     readairports(airports_file)  # Read airports file.
-    airports_count = len(airports)
-    lmu_tmp = led_map_url
-    
-    print ("Number of airports in the list: ", airports_count)
-    
-    tmp_ap = airports_count
-    tmp_start = 0
-    tmp_end = max_api_airports
+    print ("Number of airports in the list: ", len(airports))
 
-    while (tmp_ap >= 0):
-    
-        print ("tmp_start: ", tmp_start) # debug
-        print ("tmp_ap: ", tmp_ap) # debug
-        print ("tmp_end: ", tmp_end) # debug        
-        print(airports[tmp_start]) # debug
-                
-        for airportcode in islice(airports, tmp_start, tmp_end):
-            lmu_tmp = lmu_tmp + airportcode + ","
-        lmu_tmp = lmu_tmp[:-1]
-        lmu_tmp = lmu_tmp.rstrip(',')
-        logger.debug(lmu_tmp) # debug url if neccessary
-
-
-        while True:  # check internet availability and retry if necessary. If house power outage, map may boot quicker than router.
-            try:
-                content = urllib.request.urlopen(lmu_tmp).read()
-                logger.info('Internet Available')
-                logger.info(lmu_tmp)
-                break
-            except:
-                logger.warning('xxxxxxxxxxxFAA Data Not Available')
-                logger.warning(lmu_tmp)
-                time.sleep(delay_time)
-                content = ''
-                pass
-
-        if content  == b'':  # if FAA data not available bypass getting apinfo
-            return
-
-        root = ET.fromstring(content)  # Process XML data returned from FAA
-
-        for led_map_info in root.iter('METAR'):
-            stationId = led_map_info.find('station_id').text
-
-            try:
-                lat = led_map_info.find('latitude').text
-                lon = led_map_info.find('longitude').text
-            except:
-                lat = '0'
-                lon = '0'
-
-            lat_list.append(lat)
-            lon_list.append(lon)
-
-            if led_map_info.find('flight_category') is None:
-                fl_cat = 'Not Reported'
-            else:
-                fl_cat = led_map_info.find('flight_category').text
-            led_map_dict[stationId] = [lat,lon,fl_cat]
-        
-        tmp_ap = tmp_ap - max_api_airports
-        tmp_start = tmp_start + max_api_airports + 1
-        tmp_end = tmp_end + max_api_airports
-        lmu_tmp = led_map_url
+    # Locations come from stationdb.py and flight categories from the METARs metar-v4.py last retrieved through
+    # wxfetch.py, so the web map matches the LED's. Neither makes a network call.
+    stations = stationdb.lookup(airports)
+    fl_cats = {}
+    product = wxfetch.read_cache('metar', wxfetch.station_list(airports))
+    if product is not None:
+        for metar in product.records:
+            stationId = metar['station_id']
+            if stationId not in fl_cats and 'flight_category' in metar:
+                fl_cats[stationId] = metar['flight_category']
+
+    for stationId, station in stations.items():
+        lat = station['lat']
+        lon = station['lon']
+
+        lat_list.append(lat)
+        lon_list.append(lon)
+
+        fl_cat = fl_cats.get(stationId, 'Not Reported')
+        led_map_dict[stationId] = [lat,lon,fl_cat]
+
+    if not stations:  # Nothing in the database yet, center on the US until it's filled in
+        lat_list.extend(['24.5', '49.4'])
+        lon_list.extend(['-124.8', '-66.9'])
 
     max_lat = max(lat_list)
     min_lat = min(lat_list)
@@ -1660,81 +1632,20 @@ def get_led_map_info():
 def get_apinfo():
     logger.debug('In Get_Apinfo Routine')
 
-    global orig_apurl
     global apinfo_dict
-    
 
-    #print (max_api_airports)
-    airports_count = len(airports)
-    
-    print ("Number of airports in the list: ", airports_count)
-    apurl = orig_apurl  # Assign base FAA url to temp variable
-    tmp_ap = airports_count
-    tmp_start = 0
-    tmp_end = max_api_airports
-    
-    while (tmp_ap >= 0):
-        print ("tmp_start: ", tmp_start)
-        print ("tmp_ap: ", tmp_ap)
-        print ("tmp_end: ", tmp_end)
-        
-        for airportcode in islice(airports, tmp_start, tmp_end):
-            apurl = apurl + airportcode + ","
-        apurl = apurl.rstrip(',') # strip trailing comma. API changed and won't accept a trailing comma 9-2025
-        #apurl = apurl[:-1]
-#        print ("URL string: ", apurl)
-        internet_tries = 10 # number of times to try to access the internet before quitting the script.
-        internet_test = True
-
-        while internet_test:  # check internet availability and retry if necessary. If house power outage, map may boot quicker than router.
-            try:
-#                s.connect(("8.8.8.8", 80))
-                content = urllib.request.urlopen(apurl).read()
-                logger.info('Internet Available')
-                logger.info(apurl)
-                break
-            except:
-                logger.warning("\033[1;32;40m>>>>>>>> FAA Data Not Available <<<<<<<< - Attempts Left: " + str(internet_tries) + "\033[0;0m\n")
-                logger.warning(apurl)
-                time.sleep(delay_time)
-                content = ''
-                internet_tries -= 1
-                if internet_tries <= 0:
-                    internet_test = False
-                    print("\n\033[1;32;40mNo Internet - Type 'ctrl-c' then 'sudo raspi-config' to setup WiFi\033[0;0m\n")
-                    sys.exit()
-                    break
-                pass
-
-        if content == '':  # if FAA data not available bypass getting apinfo
-            return
-            
-        root = ET.fromstring(content)  # Process XML data returned from FAA
- 
-        for apinfo in root.iter('Station'):
-            stationId = apinfo.find('station_id').text
-
-            if stationId[0] != 'K':
-                site = apinfo.find('site').text
-                country = apinfo.find('country').text
-                apinfo_dict[stationId] = [site,country]
-
-            else:
-                site = apinfo.find('site').text
-                state = apinfo.find('state').text
-                apinfo_dict[stationId] = [site,state]
-    
-        tmp_ap = tmp_ap - max_api_airports
-        tmp_start = tmp_start + max_api_airports + 1
-        tmp_end = tmp_end + max_api_airports
-        apurl = orig_apurl
-        
-    #print (content)
-    content2 = content.decode()
-    file = open("temp123.xml", "w")
-    file.write(content2)
-    file.close()
-    
+    print ("Number of airports in the list: ", len(airports))
+
+    # Station info comes from stationdb.py, which keeps it on disk. No network calls here, airports that are
+    # missing or out of date are requested in the background and this routine runs again once they're in.
+    for stationId, station in stationdb.lookup(airports).items():
+        if stationId[0] != 'K':
+            apinfo_dict[stationId] = [station['site'],station['country']]
+        else:
+            apinfo_dict[stationId] = [station['site'],station['state']]
+
+    stationdb.refresh_in_background(airports, done=get_apinfo)
+
 # rgb and hex routines
 def rgb2hex(rgb):
     logger.debug(rgb)
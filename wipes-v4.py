@@ -20,10 +20,9 @@
 #    Fixed dimming feature when a wipe is executed
 #    Fixed bug whereby lat/lon was miscalculated for certain wipes.
 #    Thank you Daniel from pilotmap.co for the change the routine that handles maps with more than 300 airports.
+#    Lat/Lons now come from stationdb.py, the airport information kept on disk, rather than the METARs
 
 #Import needed libraries
-import urllib.request, urllib.error, urllib.parse
-import xml.etree.ElementTree as ET
 import time
 from rpi_ws281x import *                        #works with python 3.7. sudo pip3 install rpi_ws281x
 import math
@@ -33,6 +32,7 @@ import logzero                                  #had to manually install logzero
 from logzero import logger
 import config
 import admin
+import stationdb                                #Airport information kept on disk, i.e. lat/lon
 
 # Setup rotating logfile with 3 rotations, each with a maximum filesize of 1MB:
 version = admin.version                         #Software version
@@ -666,101 +666,27 @@ if __name__ == '__main__':
         airports = f.readlines()
     airports = [x.strip() for x in airports]
 
-    # Define URL to get weather METARS. This will pull only the latest METAR from the last 2.5 hours. If no METAR reported withing the last 2.5 hours, Airport LED will be white.
-    # first 'url' is commented out but can be used as a backup to the new FAA API if an issue 
-    # url = "https://aviationweather-cprk.ncep.noaa.gov/adds/dataserver_current/httpparam?dataSource=metars&requestType=retrieve&format=xml&mostRecentForEachStation=constraint&hoursBeforeNow="+str(metar_age)+"&stationString="
-    # NEW FAA API URL
-    url = "https://aviationweather.gov/api/data/metar?format=xml&hours=" +str(metar_age)+ "&ids="
-#    logger.debug(url)
-
-    #Build URL to submit to FAA with the proper airports from the airports file and populate the pindict dictionary
-    # Thank you Daniel from pilotmap.co for the change to this routine that handles maps with more than 300 airports.
+    #Build the pindict dictionary with the proper airports from the airports file.
     i = 0
     nullpins = []
 
-    contentStart = ['<response xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" version="1.2" xsi:noNamespaceSchemaLocation="http://aviationweather-cprk.ncep.noaa.gov/static/adds/schema/metar1_2.xsd">']
-    # content variable no longer needed - parsing XML directly
-    chunk = 0;
-    stationList = ''
     for airportcode in airports:
       if airportcode == "NULL" or airportcode == "LGND":
          continue
       pindict[airportcode] = str(i)           #build a dictionary of the LED pins for each airport used
       i += 1
-      stationList += airportcode + ','
-      chunk += 1
-      if(chunk >= 300):
-         stationList = stationList[:-1] #strip trailing comma from string
-
-         while True: #check internet availability and retry if necessary. If house power outage, map may boot quicker than router.
-           result = ''
-           try:
-              result = urllib.request.urlopen(url + stationList).read()
-              # Parse the complete XML response directly - no line manipulation needed
-              root = ET.fromstring(result.decode('UTF-8'))
-              logger.info('Internet Available')
-              break
-           except Exception as e:
-              print(str(e))
-              logger.warning('FAA Data is Not Available')
-              logger.warning(url + stationList)
-              logger.warning(result)
-              time.sleep(delay_time)
-              pass
-
-         stationList = ''
-         chunk = 0
-
-
-    stationList = stationList[:-1] #strip trailing comma from string
-
-    url = url + stationList
-    logger.debug(url) #debug
-
-    while True: #check internet availability and retry if necessary. If house power outage, map may boot quicker than router.
-        try:
-            result = urllib.request.urlopen(url).read()
-            logger.info('Internet Available')
-            logger.info(url)
-            # Parse the complete XML response directly - no line manipulation needed
-            root = ET.fromstring(result.decode('UTF-8'))
-            break
-        except:
-            logger.warning('FAA Data is Not Available')
-            logger.warning(url)
-            time.sleep(delay_time)
-            pass
- 
-    # XML parsing handled in try blocks above
-
-    #grab the airport category, wind speed and various weather from the results given from FAA.
-    for metar in root.findall('.//METAR'):
-        stationId = metar.find('station_id').text
-
-        #grab latitude of airport
-        if metar.find('latitude') is None: #if weather string is blank, then bypass
-#            lat = '0'
-            pass
-        else:
-            lat = metar.find('latitude').text
-
-        #grab longitude of airport
-        if metar.find('longitude') is None:     #if weather string is blank, then bypass
-#            lon = '0'
-            pass
-        else:
-            lon = metar.find('longitude').text
-
-        if stationId in latdict:
-            print ("Duplicate, only saved the first weather")
-        else:
-            latdict[stationId] = lat            #build latitude dictionary
-
-        if stationId in londict:
-            print ("Duplicate, only saved the first weather")
-        else:
-            londict[stationId] = lon            #build longitude dictionary
 
+    #grab the lat/lon of each airport from stationdb.py, which keeps them on disk. Not every METAR format has them.
+    #Airports it doesn't have yet are requested from the FAA in the background and skipped until they're in.
+    stationdb.refresh_in_background(airports)
+    for stationId, station in stationdb.lookup(airports).items():
+        lat = station.get('lat')
+        lon = station.get('lon')
+        if not lat or not lon or stationId not in pindict: #can't place it on the map, then bypass
+            continue
+
+        latdict[stationId] = lat                #build latitude dictionary
+        londict[stationId] = lon                #build longitude dictionary
         apinfodict[stationId]=[pindict[stationId],lat,lon] #Build Dictionary with structure:{airport id[pin num,lat,lon]}
 
     logger.debug(apinfodict)
@@ -782,6 +708,13 @@ if __name__ == '__main__':
         ap_id.append(airportcode)
     logger.debug(ap_id)
 
+    #No airport could be placed yet, so skip the wipes that need to know where they are.
+    if not latlist:
+        logger.info('No Airport Locations Yet, Skipping Wipes That Use Them')
+        num_checker = num_square = num_radar = num_circle = num_updn = 0
+        latlist.append(0.0)
+        lonlist.append(0.0)
+
     #set the maximum and minimum Lat/Lons to constrain area.
     maxlat = max(latlist)                       #Upper bounds of box
     minlat = min(latlist)                       #Lower bounds of box
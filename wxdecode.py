@@ -0,0 +1,621 @@
+#wxdecode.py - by Mark Harris. Turns the FAA's METAR and TAF data into flat records used by metar-v4.py and metar-display-v4.py
+#    Each METAR or TAF element is walked once, child by child, into a dict keyed by the XML tag names, i.e.
+#    record['wind_speed_kt']. The decoders then read the dict rather than calling find() on the XML for every field,
+#    which searched the element again each time, several times over for 'flight_category'. The records don't depend
+#    on the XML, so weather from other sources can be decoded the same way.
+#    Also holds the flight category rules used when the FAA doesn't report one, so both scripts decode the same way.
+#    The rules are one table, category_limits, and with numpy classify() applies it to every airport's ceiling and
+#    visibility at once. Small maps, and Pi's without numpy, use the if/elif chains in category(), which are quicker there.
+#    FAA responses are parsed a piece at a time as they download, see RecordStream, so the whole tree is never built.
+#    The API can also send JSON or CSV, see JsonStream and CsvStream. They give the same records, named as in the XML.
+#    Sources with only the METAR text, i.e. the API's format=raw, are decoded by raw_metars(), see RawStream.
+#    Between refreshes most airports haven't issued a new METAR, so IncrementalDecoder only decodes the ones that have.
+#    taf_forecasts() works out the forecast in force at any number of times from one pass over a TAF.
+#
+#    'python3 benchmark.py decode' times this against the old find() decode on 1,000 airports.
+#    'python3 benchmark.py parse' times the streaming parse and its peak memory against building the whole tree.
+#    'python3 benchmark.py formats' finds which of XML, JSON and CSV is quickest to download and parse on this Pi.
+#    'python3 benchmark.py raw' times decoding the METAR text against parsing the XML.
+#    'python3 benchmark.py classify' times classify() against the old if/elif chains on 100, 1,000 and 10,000 airports.
+
+#Import needed libraries
+import bisect
+import csv
+import json
+import re
+import time
+import xml.etree.ElementTree as ET
+from logzero import logger
+try:
+    from lxml import etree as lxml_etree        #Faster, and skips the elements we don't want in C. sudo pip3 install lxml
+except ImportError:
+    lxml_etree = None
+try:
+    import numpy                                #Classifies every airport's flight category at once. sudo pip3 install numpy
+except ImportError:
+    numpy = None
+
+#Flight category set by the lowest ceiling. Layers that count as a ceiling.
+ceiling_covers = ("OVC","BKN","OVX")
+
+#Walk an element once into a flat record. Text of each child by tag name, plus
+#'sky_condition' - list of (sky_cover, cloud_base_ft_agl) in the order given, lowest layer first
+#'forecast' - list of records, one per TAF forecast period
+#Fields that weren't sent are simply missing, so record.get('wx_string') is None just as find() was.
+def flatten(element):
+    sky = []
+    record = {'sky_condition': sky}
+    for child in element:
+        tag = child.tag
+        if tag == 'sky_condition':
+            sky.append((child.get('sky_cover'), child.get('cloud_base_ft_agl')))
+        elif tag == 'forecast':
+            record.setdefault('forecast', []).append(flatten(child))
+        else:
+            record[tag] = child.text
+    return record
+
+#Parse an FAA response a piece at a time, as it downloads, rather than building the whole tree once it's all arrived.
+#Each 'tag' element is flattened into a record as soon as its end tag is read, then removed from the tree, so only
+#one airport's elements are held at any time. Uses lxml when it's installed, otherwise ElementTree.
+#'stations' keeps only those airports, in that order, along with each one's XML in 'pieces'. Used for the bulk cache
+#file that holds every station in the country, see wxfetch.filter_bulk().
+class RecordStream:
+    extension = '.xml'                          #Cached products in this format are saved with this file extension
+
+    def __init__(self, tag, stations=None):
+        self.tag = tag
+        self.wanted = None if stations is None else {station: index for index, station in enumerate(stations)}
+        self.records = []
+        self.pieces = []
+        self.parent = None                      #Element holding the airports, so ElementTree can let them go
+        if lxml_etree is not None:
+            self.parser = lxml_etree.XMLPullParser(events=('end',), tag=tag)
+        else:
+            self.parser = ET.XMLPullParser(events=('start', 'end'))
+
+    def feed(self, data):
+        self.parser.feed(data)
+        self.read_events()
+
+    #Finish parsing. Airports kept from 'stations' are put back in the same order as the airports file.
+    def close(self):
+        self.parser.close()
+        self.read_events()
+        if self.wanted is not None:
+            order = sorted(range(len(self.records)), key=lambda n: self.wanted[self.records[n]['station_id']])
+            self.records = [self.records[n] for n in order]
+            self.pieces = [self.pieces[n] for n in order]
+        return self
+
+    def read_events(self):
+        for event, element in self.parser.read_events():
+            if event == 'start':
+                if self.parent is None and element.tag == 'data':
+                    self.parent = element
+                continue
+            if element.tag != self.tag:
+                continue
+
+            record = flatten(element)
+            if self.wanted is None:
+                self.records.append(record)
+            elif record.get('station_id') in self.wanted:
+                self.records.append(record)
+                self.pieces.append(ET.tostring(element) if lxml_etree is None else lxml_etree.tostring(element))
+
+            if lxml_etree is not None:          #Done with it, let it go
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif self.parent is not None:
+                self.parent.remove(element)
+            else:
+                element.clear()
+
+    #Join the responses for several chunks of airports into one, keeping the XML as it was sent.
+    @staticmethod
+    def join(contents, count):
+        return (b'<response><data num_results="' + str(count).encode() + b'">' +
+                b''.join(data_body(content) for content in contents) + b'</data></response>')
+
+#Everything between <data> and </data> in an FAA XML response, or nothing if no airports were returned.
+data_open = re.compile(rb'<data[\s>/]')         #Not <data_source>
+
+def data_body(content):
+    match = data_open.search(content)
+    if match is None:
+        return b''
+    start = content.find(b'>', match.start()) + 1
+    end = content.rfind(b'</data>')
+    if content[start - 2:start] == b'/>' or end < start:
+        return b''
+    return content[start:end]
+
+
+#Names the JSON and CSV responses use, by the XML name the records use instead. JSON and CSV values are made into
+#text like the XML's, and times into the XML's '2020-03-24T18:53:00Z' form, so the records don't show where they came from.
+#Cloud layers are 'clouds' in the JSON, with 'cover' and 'base', and TAF forecast periods are 'fcsts'.
+api_names = {
+    'METAR': {'icaoId': 'station_id', 'rawOb': 'raw_text', 'obsTime': 'observation_time', 'lat': 'latitude',
+              'lon': 'longitude', 'temp': 'temp_c', 'dewp': 'dewpoint_c', 'wdir': 'wind_dir_degrees',
+              'wspd': 'wind_speed_kt', 'wgst': 'wind_gust_kt', 'visib': 'visibility_statute_mi', 'wxString': 'wx_string',
+              'vertVis': 'vert_vis_ft', 'metarType': 'metar_type', 'elev': 'elevation_m', 'fltCat': 'flight_category'},
+    'TAF': {'icaoId': 'station_id', 'rawTAF': 'raw_text', 'issueTime': 'issue_time', 'bulletinTime': 'bulletin_time',
+            'validTimeFrom': 'valid_time_from', 'validTimeTo': 'valid_time_to', 'lat': 'latitude', 'lon': 'longitude',
+            'elev': 'elevation_m'},
+    'forecast': {'timeFrom': 'fcst_time_from', 'timeTo': 'fcst_time_to', 'timeBec': 'time_becoming',
+                 'fcstChange': 'change_indicator', 'probability': 'probability', 'wdir': 'wind_dir_degrees',
+                 'wspd': 'wind_speed_kt', 'wgst': 'wind_gust_kt', 'visib': 'visibility_statute_mi',
+                 'vertVis': 'vert_vis_ft', 'wxString': 'wx_string'},
+    'Station': {'icaoId': 'station_id', 'site': 'site', 'state': 'state', 'country': 'country', 'lat': 'latitude',
+                'lon': 'longitude', 'elev': 'elevation_m'},
+    }
+time_names = ('observation_time', 'issue_time', 'bulletin_time', 'valid_time_from', 'valid_time_to', 'fcst_time_from',
+              'fcst_time_to', 'time_becoming')
+
+#A JSON or CSV value as XML text. Times come as seconds since 1970 or as '2020-03-24 18:53:00' style text.
+def api_text(name, value):
+    if name in time_names:
+        if isinstance(value, (int, float)) or value.isdigit():
+            return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(int(value)))
+        return value[:10] + 'T' + value[11:19] + 'Z'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+#Record for one airport, or one TAF forecast period, from the JSON API.
+def json_record(item, tag):
+    names = api_names[tag]
+    record = {'sky_condition': [(layer.get('cover'), None if layer.get('base') is None else str(layer['base']))
+                                for layer in item.get('clouds') or []]}
+    for key, value in item.items():
+        name = names.get(key)
+        if name is not None and value is not None and value != '':
+            record[name] = api_text(name, value)
+    if item.get('fcsts'):
+        record['forecast'] = [json_record(forecast, 'forecast') for forecast in item['fcsts']]
+    return record
+
+#JSON response parser. The standard json module can't parse a piece at a time, so the response is kept as it arrives
+#and parsed all at once when it's complete. That's done in C, so it's still quick.
+class JsonStream:
+    extension = '-data.json'
+
+    def __init__(self, tag, stations=None):
+        self.tag = tag
+        self.blocks = []
+        self.records = []
+
+    def feed(self, data):
+        self.blocks.append(data)
+
+    def close(self):
+        data = json.loads(b''.join(self.blocks) or b'[]')
+        self.blocks = []
+        self.records = [json_record(item, self.tag) for item in data]
+        return self
+
+    #Join the JSON arrays for several chunks of airports into one array.
+    @staticmethod
+    def join(contents, count):
+        items = [content.strip()[1:-1].strip() for content in contents]
+        return b'[' + b','.join(item for item in items if item) + b']'
+
+#CSV response parser. Both the API's own column names and the XML names, used by the FAA's cache files, are understood.
+#Any lines before the column names are skipped. Cloud layers are repeated 'sky_cover' and 'cloud_base_ft_agl' columns.
+class CsvStream:
+    extension = '.csv'
+    sky_columns = {'sky_cover': 0, 'cover': 0, 'cloud_base_ft_agl': 1, 'base': 1}
+
+    def __init__(self, tag, stations=None):
+        self.tag = tag
+        self.blocks = []
+        self.records = []
+
+    def feed(self, data):
+        self.blocks.append(data)
+
+    def close(self):
+        lines = csv_lines(b''.join(self.blocks))
+        self.blocks = []
+        if not lines:
+            return self
+        names = api_names[self.tag]
+        columns = []
+        for row in csv.reader(lines):
+            if 'station_id' in row or 'icaoId' in row: #Column names, at the start or where a joined chunk's differ
+                columns = [names.get(column, column) for column in row]
+                continue
+            sky = []
+            record = {'sky_condition': sky}
+            for column, value in zip(columns, row):
+                part = self.sky_columns.get(column)
+                if part == 0:                   #Each cover starts a layer, its cloud base follows
+                    if value:
+                        sky.append((value, None))
+                elif part == 1:
+                    if value and sky and sky[-1][1] is None:
+                        sky[-1] = (sky[-1][0], value)
+                elif value != '':
+                    record[column] = api_text(column, value)
+            if 'station_id' in record:
+                self.records.append(record)
+        return self
+
+    #Join the CSV for several chunks of airports. A chunk's column names are only kept if they differ from the last
+    #ones, as they can when none of its airports report a column, i.e. wind_gust_kt.
+    @staticmethod
+    def join(contents, count):
+        joined = []
+        header = None
+        for content in contents:
+            lines = csv_lines(content)
+            if lines and lines[0] == header:
+                lines = lines[1:]
+            elif lines:
+                header = lines[0]
+            joined.extend(lines)
+        return '\n'.join(joined).encode() + b'\n'
+
+#Lines of a CSV response from the column names on.
+def csv_lines(content):
+    lines = content.decode('utf-8', 'replace').splitlines()
+    for n, line in enumerate(lines):
+        if re.match(r'(.*,)?(station_id|icaoId)(,|$)', line):
+            return lines[n:]
+    return []
+
+
+#Raw METAR text, i.e. 'KFLG 241853Z 22012G20KT 1 1/2SM -RA BR BKN008 OVC015 12/08 A2992 RMK AO2', as the API sends
+#for format=raw. Only the current weather is read: the station and time, then the groups up to any remarks or trend.
+raw_header = re.compile(r'(?:(?:METAR|SPECI)\s+)?(?P<station>[A-Z0-9]{3,6})\s+(?P<time>\d{6})Z\b')
+raw_end = re.compile(r'\s(?:RMK|TEMPO|BECMG|NOSIG)(?:\s|$)')
+raw_phenomena = r'(?:DZ|RA|SN|SG|IC|PL|GR|GS|UP|BR|FG|FU|VA|DU|SA|HZ|PY|PO|SQ|FC|SS|DS)'
+raw_groups = re.compile(r'''
+    (?P<cloud>(?P<cover>FEW|SCT|BKN|OVC)(?P<base>\d{3})(?:CB|TCU)?)|
+    (?P<wind>(?P<wdir>\d{3}|VRB)(?P<wspd>\d{2,3})(?:G(?P<wgst>\d{2,3}))?(?P<wunit>KT|MPS))|
+    (?P<vis>(?P<vplus>P)?M?(?:(?P<vwhole>\d{1,2})\s)?(?:(?P<vnum>\d)/(?P<vden>\d{1,2})|(?P<vmiles>\d{1,3}))SM)|
+    (?P<clear>SKC|CLR|NSC|NCD)|
+    (?P<wx>[-+]?(?:VC)?(?:(?:MI|PR|BC|DR|BL|SH|TS|FZ)%s*|%s+))|
+    (?P<vv>VV(?P<vvbase>\d{3}))|
+    (?P<metres>\d{4})(?:NDV)?|
+    (?P<cavok>CAVOK)''' % (raw_phenomena, raw_phenomena), re.X)
+metres_per_mile = 1609.344
+mps_to_kt = 1.94384
+
+#Observation time of a raw METAR from its 'DDHHMM', which only gives the day of the month. Taken as the latest such
+#day up to 'today', the (year, month, day) now.
+def raw_time(stamp, today):
+    year, month, day = today
+    if int(stamp[:2]) > day:                    #Sent late last month
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return '%04d-%02d-%s:%s:00Z' % (year, month, stamp[:2] + 'T' + stamp[2:4], stamp[4:])
+
+#What one group of a raw METAR says, as (fields, sky layer, weather code): 'fields' are (name, text) pairs for the
+#record, the others None if it doesn't give one. The same groups, i.e. '10SM' or 'BKN030', turn up in most METARs, so
+#each is matched against raw_groups only the first time and kept in raw_tokens after that.
+raw_tokens = {}
+raw_tokens_max = 20000                          #Started again if it ever holds this many different groups
+nothing = ((), None, None)                      #A group that isn't used, i.e. 'AUTO' or the temperature
+
+def raw_token(token):
+    group = raw_groups.fullmatch(token)
+    kind = None if group is None else group.lastgroup
+    if kind is None:
+        decoded = nothing
+    elif kind == 'wind':
+        scale = mps_to_kt if group.group('wunit') == 'MPS' else 1
+        wdir = group.group('wdir')
+        fields = [('wind_dir_degrees', wdir if wdir == 'VRB' else str(int(wdir))),
+                  ('wind_speed_kt', str(round(int(group.group('wspd')) * scale)))]
+        if group.group('wgst'):
+            fields.append(('wind_gust_kt', str(round(int(group.group('wgst')) * scale))))
+        decoded = (tuple(fields), None, None)
+    elif kind == 'vis':
+        if group.group('vmiles'):
+            miles = int(group.group('vmiles'))
+        else:
+            miles = int(group.group('vwhole') or 0) + int(group.group('vnum')) / int(group.group('vden'))
+        plus = group.group('vplus') or miles >= 10
+        decoded = ((('visibility_statute_mi', '%g' % miles + ('+' if plus else '')),), None, None)
+    elif kind == 'metres':
+        decoded = ((('visibility_statute_mi', '%g' % round(int(group.group('metres')) / metres_per_mile, 2)),), None, None)
+    elif kind == 'cavok':
+        decoded = ((('visibility_statute_mi', '%g' % round(9999 / metres_per_mile, 2)),), ('CAVOK', None), None)
+    elif kind == 'cloud':
+        decoded = ((), (group.group('cover'), str(int(group.group('base')) * 100)), None)
+    elif kind == 'vv':
+        decoded = ((('vert_vis_ft', str(int(group.group('vvbase')) * 100)),), ('OVX', None), None)
+    elif kind == 'clear':
+        decoded = ((), (token, None), None)
+    else:
+        decoded = ((), None, token)
+    if len(raw_tokens) >= raw_tokens_max:
+        raw_tokens.clear()
+    raw_tokens[token] = decoded
+    return decoded
+
+#Record for one raw METAR, named as in the XML, or None if it isn't one. Numbers are given as the XML's text.
+#'today' is the (year, month, day) now, for the observation time.
+def raw_metar(raw_text, today):
+    header = raw_header.match(raw_text)
+    if header is None:
+        return None
+    sky = []
+    record = {'sky_condition': sky, 'raw_text': raw_text, 'station_id': header.group('station'),
+              'observation_time': raw_time(header.group('time'), today)}
+    end = raw_end.search(raw_text, header.end())
+    wx = []
+    whole = None                                #Whole miles, i.e. the '1' of '1 1/2SM', waiting for the fraction
+    for token in raw_text[header.end():None if end is None else end.start()].split():
+        if whole is not None:
+            token, whole = whole + ' ' + token, None
+        elif len(token) <= 2 and token.isdigit():
+            whole = token
+            continue
+        fields, layer, code = raw_tokens.get(token) or raw_token(token)
+        if fields:
+            record.update(fields)
+        if layer is not None:
+            sky.append(layer)
+        if code is not None:
+            wx.append(code)
+    if wx:
+        record['wx_string'] = ' '.join(wx)
+    return record
+
+#Records for a batch of raw METARs, one per line, in the order given. Each gets a flight_category, worked out for
+#the whole batch at once by classify(), unless it reports neither sky nor visibility. 'now' is for the dates.
+def raw_metars(lines, now=None):
+    today = time.gmtime(time.time() if now is None else now)[:3]
+    records = [record for record in (raw_metar(line.strip(), today) for line in lines) if record is not None]
+    reported = [record for record in records if record['sky_condition'] or 'visibility_statute_mi' in record]
+    limits = [record_limits(record) for record in reported]
+    for record, flightcategory in zip(reported, classify([ceiling for ceiling, visibility in limits],
+                                                         [visibility for ceiling, visibility in limits])):
+        record['flight_category'] = flightcategory
+    return records
+
+#Raw METAR response parser, one METAR a line. Kept as it arrives and decoded all at once when it's complete.
+#METARs only, a raw TAF runs over several lines.
+class RawStream:
+    extension = '.txt'
+
+    def __init__(self, tag, stations=None):
+        self.tag = tag
+        self.blocks = []
+        self.records = []
+
+    def feed(self, data):
+        self.blocks.append(data)
+
+    def close(self):
+        self.records = raw_metars(b''.join(self.blocks).decode('utf-8', 'replace').splitlines())
+        self.blocks = []
+        return self
+
+    #Join the METARs for several chunks of airports.
+    @staticmethod
+    def join(contents, count):
+        return b''.join(content.strip() + b'\n' for content in contents if content.strip())
+
+#Parsers by the format name used in the API's 'format=' and admin.py's wx_format.
+formats = {'xml': RecordStream, 'json': JsonStream, 'csv': CsvStream, 'raw': RawStream}
+
+#Records for every 'tag' element in an FAA response or cached product, in the order sent.
+def parse_records(content, tag, fmt='xml'):
+    stream = formats[fmt](tag)
+    for start in range(0, len(content), 64 * 1024): #A piece at a time, so the events never hold the whole tree
+        stream.feed(content[start:start + 64 * 1024])
+    return stream.close().records
+
+#Decodes each station's report only when it's new. 'decode' turns a record into whatever the script keeps for the
+#station. A report is known by its 'time_name', i.e. observation_time, and its raw_text, so a station that hasn't issued
+#a new report since the last decode_all() gets back what it decoded to last time, without decoding it again.
+#After each decode_all(), 'changed' holds the stations decoded afresh, new ones included, and 'removed' those with no
+#report any more, so later steps can update just those stations too.
+class IncrementalDecoder:
+    def __init__(self, decode, time_name='observation_time'):
+        self.decode = decode
+        self.time_name = time_name
+        self.known = {}                         #(time, raw_text) and what it decoded to, by station
+        self.changed = set()
+        self.removed = set()
+
+    #What the first report for each station decodes to, by station, in the order of 'records'. Later reports for the
+    #same station are skipped, like the scripts always have, and passed to 'duplicate' if given.
+    def decode_all(self, records, duplicate=None):
+        known = {}
+        decoded = {}
+        changed = set()
+        for record in records:
+            stationId = record['station_id']
+            if stationId in decoded:
+                if duplicate is not None:
+                    duplicate(stationId)
+                continue
+            fingerprint = (record.get(self.time_name), record.get('raw_text'))
+            previous = self.known.get(stationId)
+            if previous is not None and previous[0] == fingerprint:
+                value = previous[1]
+            else:
+                value = self.decode(record)
+                changed.add(stationId)
+            known[stationId] = (fingerprint, value)
+            decoded[stationId] = value
+        self.removed = set(self.known) - set(known)
+        self.changed = changed
+        self.known = known
+        return decoded
+
+#Fields a TAF BECMG, TEMPO or PROB group can change. Anything the group doesn't give stays as it was.
+#Its sky_condition, with the vert_vis_ft that goes with it, replaces the clouds if it gives any.
+change_fields = ('wind_dir_degrees', 'wind_speed_kt', 'wind_gust_kt', 'visibility_statute_mi', 'wx_string')
+
+#The forecast in force for a TAF at each time in 'times', i.e. '2020-03-24T18:00:00Z', as a record like a single
+#forecast period, or None where the TAF doesn't cover that time. The first period and each FM group give the whole
+#forecast, so weather they don't mention has ended. A BECMG group changes what it gives from when it starts until the
+#next FM, and TEMPO and PROB groups change what they give while they last. Each time finds its FM group by bisecting
+#the start times. Times with the same groups in force get the same record.
+def taf_forecasts(taf, times):
+    bases, changes = [], []
+    for forecast in taf.get('forecast', []):
+        if forecast.get('change_indicator', 'FM') == 'FM':
+            bases.append(forecast)
+        else:
+            changes.append(forecast)
+    starts = [base['fcst_time_from'] for base in bases]
+
+    merged = {}
+    forecasts = []
+    for zulu in times:
+        n = bisect.bisect_right(starts, zulu) - 1
+        if n < 0 or zulu > bases[n]['fcst_time_to']:
+            forecasts.append(None)
+            continue
+        applied = tuple(i for i, change in enumerate(changes)
+                        if starts[n] <= change['fcst_time_from'] <= zulu and
+                        (change['change_indicator'] == 'BECMG' or zulu <= change['fcst_time_to']))
+        if (n, applied) not in merged:
+            forecast = bases[n]
+            if applied:
+                forecast = dict(forecast)
+                for i in applied:
+                    change = changes[i]
+                    forecast.update((name, change[name]) for name in change_fields if name in change)
+                    if change['sky_condition']:
+                        forecast['sky_condition'] = change['sky_condition']
+                        forecast['vert_vis_ft'] = change.get('vert_vis_ft')
+            merged[(n, applied)] = forecast
+        forecasts.append(merged[(n, applied)])
+    return forecasts
+
+#Flight category rules, worst first, from the FAA's table at the top of metar-v4.py. A ceiling in feet AGL or a
+#visibility in statute miles below the limit, or at or below it where 'inclusive', sets that category. Anything better
+#than every row is VFR. Each row's limits are below the next row's. Change them here and every decoder follows.
+category_limits = (
+    #category  ceiling  visibility  inclusive
+    ("LIFR",   500,     1.0,        False),
+    ("IFR",    1000,    3.0,        False),
+    ("MVFR",   3000,    5.0,        True),
+    )
+category_names = ("VFR",) + tuple(row[0] for row in reversed(category_limits)) #By the number of rows a station is below
+numpy_names = None if numpy is None else numpy.array(category_names, dtype=object) #classify() picks from these
+not_reported = float('nan')                     #Ceiling or visibility that wasn't reported. Never below a limit
+numpy_min = 200                                 #Fewest airports classify() hands to numpy. Below this category() is quicker
+
+#MOS ceiling (CIG) and visibility (VIS) codes, as wxmos.py reads them, as the lowest height in feet, or distance in
+#miles, each stands for. Codes not listed, i.e. None for missing, don't set a category.
+#See https://www.weather.gov/mdl/mos_gfsmos_mavcard
+mos_ceilings = {1: 0, 2: 200, 3: 500, 4: 1000, 5: 2000, 6: 3100, 7: 6600, 8: 12100}
+mos_visibilities = {1: 0.0, 2: 0.5, 3: 1.0, 4: 2.0, 5: 3.0, 6: 6.0, 7: 6.5}
+
+#Flight category for one ceiling and visibility, either of which may be not_reported. The worse of the two is used.
+#The limits in category_limits written out as if/elif chains, like the scripts had. Looping over the table was slower.
+def category(ceiling, visibility):
+    if ceiling < 500 or visibility < 1.0:
+        return "LIFR"
+    elif ceiling < 1000 or visibility < 3.0:
+        return "IFR"
+    elif ceiling <= 3000 or visibility <= 5.0:
+        return "MVFR"
+    return "VFR"
+
+#Flight category of every station in one pass. 'ceilings' and 'visibilities' are columns, lists or numpy arrays with
+#one number per station, not_reported where there isn't one. Returns a list of categories in the same order.
+#With numpy and at least 'numpy_min' stations each column is compared against the table a row at a time, otherwise
+#category() is used for each station.
+def classify(ceilings, visibilities):
+    if numpy is None or len(ceilings) < numpy_min:
+        return [category(ceiling, visibility) for ceiling, visibility in zip(ceilings, visibilities)]
+
+    worst = numpy.zeros(len(ceilings), dtype=numpy.int8) #Rows of category_limits each station is below
+    with numpy.errstate(invalid='ignore'):                #NaN compares as not below, as wanted
+        for column, limit in ((ceilings, 1), (visibilities, 2)):
+            column = numpy.asarray(column, dtype=float)
+            below = numpy.zeros(len(column), dtype=numpy.int8)
+            for row in category_limits:
+                below += column <= row[limit] if row[3] else column < row[limit]
+            numpy.maximum(worst, below, out=worst)
+    return numpy_names[worst].tolist()
+
+#Flight category by airport for a dict of (ceiling, visibility) by airport, in one pass. See classify().
+def classify_stations(limits):
+    stationIds = list(limits)
+    return dict(zip(stationIds, classify([limits[stationId][0] for stationId in stationIds],
+                                         [limits[stationId][1] for stationId in stationIds])))
+
+#Visibility in statute miles from FAA text, i.e. '10+', or not_reported.
+def miles(visibility_statute_mi):
+    if visibility_statute_mi is None:
+        return not_reported
+    return float(visibility_statute_mi.strip('+'))
+
+#Ceiling and visibility for a MOS forecast from its CLD, CIG and VIS codes. Only an OV or BK layer is a ceiling.
+def mos_limits(cld, cig, vis):
+    ceiling = mos_ceilings.get(cig, not_reported) if cld in ("OV","BK") else not_reported
+    return ceiling, mos_visibilities.get(vis, not_reported)
+
+#Lowest OVC, BKN or OVX layer of a record as (sky_cover, cloud base), or the last layer if none are a ceiling.
+#A layer without a cloud base, i.e. OVX, uses the vertical visibility.
+def lowest_ceiling(record):
+    sky_cvr, cld_base_ft_agl = "SKC", None      #Initialize to Sky Clear
+    for sky_cvr, cld_base_ft_agl in record['sky_condition']:
+        if sky_cvr in ceiling_covers:
+            if cld_base_ft_agl is None:
+                cld_base_ft_agl = record.get('vert_vis_ft')
+            break
+    return sky_cvr, cld_base_ft_agl
+
+#Flight category of a METAR record. The FAA's own category if it reported one, otherwise worked out from the
+#sky condition and visibility. Routine contributed to project by Nick Cirincione. Thank you for your contribution.
+def metar_category(record):
+    flightcategory = record.get('flight_category')
+    if flightcategory is not None and flightcategory != 'NONE': #FAA is reporting it through their API
+        return flightcategory
+
+    stationId = record.get('station_id')
+    flightcategory = "VFR"
+    logger.info(stationId + " Not Reporting Flight Category through the API.")
+
+    #First check to see if the FAA provided the forecast field, if not use the METAR's own sky_condition.
+    forecast = record.get('forecast')
+    if forecast is None:
+        logger.info('FAA xml data is NOT providing the forecast field for this airport')
+        sky = record
+        visibility = None                       #Only the forecast field's visibility is used, as it always has been
+    else:
+        logger.info('FAA xml data IS providing the forecast field for this airport')
+        sky = {'sky_condition': [layer for period in forecast for layer in period['sky_condition']],
+               'vert_vis_ft': forecast[0].get('vert_vis_ft')}
+        visibility = forecast[0].get('visibility_statute_mi')
+
+    sky_cvr, cld_base_ft_agl = lowest_ceiling(sky)
+    logger.debug('Sky Cover = ' + sky_cvr)
+    ceiling = not_reported
+    if sky_cvr in ceiling_covers and cld_base_ft_agl is not None:
+        logger.debug('Cloud Base = ' + cld_base_ft_agl)
+        ceiling = int(cld_base_ft_agl)
+
+    flightcategory = category(ceiling, miles(visibility))
+    logger.debug(stationId + " flight category is Decode script-determined as " + flightcategory)
+    return flightcategory
+
+#Ceiling in feet AGL and visibility in miles of a METAR or one TAF forecast period, from its lowest OVC, BKN or OVX
+#layer. Either is not_reported if there isn't one.
+def record_limits(record):
+    sky_cvr, cld_base_ft_agl = lowest_ceiling(record)
+    ceiling = not_reported
+    if sky_cvr in ceiling_covers and cld_base_ft_agl is not None:
+        ceiling = int(cld_base_ft_agl)
+    return ceiling, miles(record.get('visibility_statute_mi'))
+
+#Flight category of one TAF forecast period, from its lowest ceiling and visibility. Routine inspired by Nick Cirincione.
+def forecast_category(forecast):
+    return category(*record_limits(forecast))
+
+#Flight category of each of a list of TAF forecast periods, in one pass. See classify().
+def forecast_categories(forecasts):
+    limits = [record_limits(forecast) for forecast in forecasts]
+    return classify([ceiling for ceiling, visibility in limits], [visibility for ceiling, visibility in limits])
@@ -0,0 +1,635 @@
+#wxfetch.py - by Mark Harris. Shared FAA weather fetcher used by metar-v4.py, metar-display-v4.py, wipes-v4.py and webapp.py
+#    Each product (METAR, TAF and stationinfo) is pulled from aviationweather.gov once per interval and stored in the
+#    cache directory set in admin.py. Every script asks this module for a product rather than calling the API itself,
+#    so the LED's, OLED's and web pages all show the same data while the API only gets hit once per refresh.
+#    A lock file makes sure only one script downloads a product at a time. The others wait, then read the cache.
+#
+#    Can also be run from the command line to pre-load the cache, i.e. 'sudo python3 /NeoSectional/wxfetch.py'
+
+#Import needed libraries
+import requests                                 #Keep-alive connection pool and gzip. sudo pip3 install requests
+import xml.etree.ElementTree as ET
+import time
+import os
+import sys
+import json
+import fcntl
+import hashlib
+import random
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from logzero import logger
+import config                                   #Config.py holds user settings used by the various scripts
+import admin
+import wxdecode                                 #Parses the FAA responses into flat records as they download
+
+#Misc settings
+cache_dir = admin.wx_cache_dir                  #Directory that holds the downloaded products shared between scripts
+airports_file = '/NeoSectional/airports'        #Default list of airports to fetch
+metar_age = config.metar_age                    #Metar Age in HOURS. Same setting used by metar-v4.py
+update_interval = config.update_interval        #Number of MINUTES between FAA updates
+timeout = 30                                    #Seconds to wait on the FAA before giving up on a request - Eric B
+endpoints = admin.wx_endpoints                  #Weather servers, primary first. The product paths below are added to these
+hedge_delay = admin.wx_hedge_delay              #Seconds to wait on a server before also asking the next one. 0 = never
+backoff_base = 5                                #Seconds to wait before the first retry. Doubles on each retry, with random jitter
+backoff_max = 300                               #Longest wait in seconds between retries
+stale_tries = 3                                 #Tries before giving up and showing the last good data, marked stale
+breaker_threshold = 3                           #Failed downloads in a row before the circuit breaker stops calling the FAA
+breaker_cooldown = 300                          #Seconds the circuit breaker stays open. Doubles each time it re-opens
+breaker_cooldown_max = 3600                     #Longest time in seconds the circuit breaker stays open
+chunk_size = 50                                 #Number of airports to request from the API at one time, to start with. See chunk_sizes()
+chunk_size_min = 10                             #Smallest and largest number of airports the chunk size can adjust to
+chunk_size_max = 400
+chunk_slow = 10                                 #Seconds. A chunk slower than this makes the chunks smaller next time
+url_max = 4000                                  #Longest URL sent to the FAA, so a chunk of airports is never rejected as too long
+fetch_workers = admin.wx_fetch_workers          #Number of chunks to request from the API at the same time. 1 = one after another
+chunk_tries = 3                                 #Number of tries each chunk gets in parallel before it's retried on its own
+bulk_airports = admin.wx_bulk_airports          #Use the FAA's bulk cache file when there are at least this many airports. 0 = never
+response_format = admin.wx_format               #'xml', 'json', 'csv', 'raw' or 'auto' for the fastest found by benchmark.py, see product_format()
+partial_formats = ('raw',)                      #Formats missing fields the scripts read, i.e. the airport's location. Never picked by 'auto'
+
+#Products available from the FAA API. 'url' is added to each server in 'endpoints' and gets the comma separated list
+#of airports added to the end, with {format} replaced by the response format. 'tag' is the XML element holding one
+#airport's data and 'max_age' is how many seconds a cached copy is good for. 'formats' are the response formats the
+#API has for the product, see wxdecode.py. 'bulk_url' is the FAA's gzip'd cache file holding every station's current
+#data, used for big maps. See fetch_bulk().
+products = {
+    'metar': {'url': "/api/data/metar?format={format}&hours=" + str(metar_age) + "&ids=",
+              'tag': 'METAR',
+              'formats': ('xml', 'json', 'csv', 'raw'), #'raw' is the METAR text, decoded by wxdecode.raw_metars()
+              'bulk_url': "/data/cache/metars.cache.xml.gz",
+              'max_age': max(60, update_interval * 60 - 60)},
+    'taf': {'url': "/api/data/taf?format={format}&hours=" + str(metar_age) + "&ids=",
+            'tag': 'TAF',
+            'formats': ('xml', 'json'),         #TAF forecast periods don't fit in CSV rows
+            'bulk_url': "/data/cache/tafs.cache.xml.gz",
+            'max_age': max(60, update_interval * 60 - 60)},
+    'stationinfo': {'url': "/api/data/stationinfo?format={format}&ids=",
+                    'tag': 'Station',
+                    'formats': ('xml', 'json', 'csv'),
+                    'max_age': 24 * 60 * 60},
+    }
+
+
+#One HTTP session is shared by every request this script makes, so the TCP and TLS connection to the FAA is kept alive
+#and reused between chunks and refreshes rather than opened fresh each time. The FAA sends gzip'd XML when asked,
+#which requests decompresses for us. The connection pool is sized so each fetch worker keeps its own connection to
+#every server. A hedged request that loses keeps running in the background while its worker moves on, see hedged_get(),
+#so with hedging one server can have a request from every worker for every server in flight at once.
+pool_size = max(1, fetch_workers) * len(endpoints)
+session = requests.Session()
+session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive',
+                        'User-Agent': 'LiveSectional/' + admin.version})
+session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=max(4, len(endpoints)), pool_maxsize=pool_size))
+session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=max(4, len(endpoints)), pool_maxsize=pool_size))
+
+
+#Weather product as handed to the scripts. 'content' is the consolidated response of all the chunks retrieved,
+#in the response format 'fmt'.
+#'hash' is taken from the raw FAA responses and 'changed' is False if the FAA sent exactly what was already cached,
+#so a script can compare hashes and skip decoding the same weather again.
+#'records' are the airports as flat records, see wxdecode.py. A fresh download is parsed into records while it
+#arrives, so scripts that decode the records never build the XML tree at all.
+class Product:
+    def __init__(self, name, content, fetched, stations, hash='', changed=True, records=None, fmt='xml'):
+        self.name = name
+        self.content = content                  #XML bytes, <response><data num_results=""> with one element per airport, or JSON/CSV
+        self.format = fmt                       #'xml', 'json', 'csv' or 'raw'
+        self.fetched = fetched                  #time.time() the FAA data was retrieved
+        self.stations = stations                #list of airports requested
+        self.hash = hash                        #md5 of the md5 of each raw FAA response
+        self.changed = changed                  #False if the FAA data was the same as the previous download
+        self.stale = False                      #True if the FAA couldn't be reached and this is the last good data
+        self._root = None
+        self._records = records
+
+    @property
+    def root(self):                             #Parse XML only when a script asks for it. XML products only
+        if self._root is None:
+            self._root = ET.fromstring(self.content)
+        return self._root
+
+    @property
+    def records(self):                          #Streamed from the XML the first time a script asks, if not already parsed
+        if self._records is None:
+            self._records = wxdecode.parse_records(self.content, products[self.name]['tag'], self.format)
+        return self._records
+
+    @property
+    def age(self):
+        return time.time() - self.fetched
+
+    def __len__(self):
+        return len(self.records)
+
+
+#Read airports file and return the list of airports, including NULL and LGND entries so pin numbers line up.
+def read_airports(filename=airports_file):
+    with open(filename) as f:
+        airports = f.readlines()
+    return [x.strip() for x in airports]
+
+#Strip out NULL, LGND and duplicate entries so each airport is only requested once.
+def station_list(airports):
+    stations = []
+    for airportcode in airports:
+        if airportcode in ("NULL", "LGND", "") or airportcode in stations:
+            continue
+        stations.append(airportcode)
+    return stations
+
+#Build the cache file names for a product. The airport list is part of the name so two different lists never share data.
+#The product itself is saved with the extension of its response format.
+def cache_paths(name, stations, fmt='xml'):
+    key = hashlib.md5(','.join(sorted(stations)).encode()).hexdigest()[:10]
+    base = os.path.join(cache_dir, name + '-' + key)
+    return base + wxdecode.formats[fmt].extension, base + '.json', base + '.lock'
+
+#Response format to ask the FAA for. 'auto' uses the format benchmark.py found fastest on this Pi, kept in formats.json
+#in the cache directory, unless it's one of 'partial_formats'. Formats the API doesn't have for a product fall back to XML.
+def product_format(name):
+    fmt = response_format
+    if fmt == 'auto':
+        try:
+            with open(os.path.join(cache_dir, 'formats.json')) as f:
+                fmt = json.load(f).get(name, 'xml')
+        except (IOError, ValueError):
+            fmt = 'xml'
+        if fmt in partial_formats:
+            fmt = 'xml'
+    return fmt if fmt in products[name]['formats'] else 'xml'
+
+def product_url(name, fmt):
+    return products[name]['url'].replace('{format}', fmt)
+
+#Hit/miss counters for conditional requests. 'not_modified'/'modified' count chunks the FAA answered with or without
+#a 304 Not Modified. 'unchanged'/'changed' count whole products whose content hash matched the previous download.
+#'hedged' counts requests that were also sent to a backup server and 'backup_won' how often the backup answered first.
+#Counters are kept in stats.json in the cache directory so they add up across all the scripts.
+stats = {'not_modified': 0, 'modified': 0, 'unchanged': 0, 'changed': 0, 'hedged': 0, 'backup_won': 0}
+
+#Read, change and write back a json file in the cache directory while holding a lock on it. Used for the files
+#that are shared between the scripts. 'update' gets the current contents as a dict and changes it in place.
+def update_json(filename, update):
+    path = os.path.join(cache_dir, filename)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                contents = json.load(f)
+            except ValueError:
+                contents = {}
+            update(contents)
+            f.seek(0)
+            f.truncate()
+            json.dump(contents, f)
+            return contents
+    except IOError as error:
+        logger.warning('Could not update ' + path)
+        logger.warning(error)
+        return {}
+
+def count_stats(**counts):
+    def add(totals):
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+
+    for key, value in counts.items():
+        stats[key] += value
+    update_json('stats.json', add)
+    logger.info('Conditional fetch stats: ' + str(stats))
+
+#Return the totals of the hit/miss counters from all the scripts.
+def read_stats():
+    try:
+        with open(os.path.join(cache_dir, 'stats.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return dict(stats)
+
+#Circuit breaker shared by all the scripts. After 'breaker_threshold' failed downloads in a row the FAA isn't called
+#again until the breaker's cooldown has passed, and the scripts keep showing the last good data instead. The cooldown
+#doubles each time the breaker re-opens and has random jitter, so a room full of maps rebooting after a power blip
+#don't all hit the FAA at the same moment.
+def breaker_open():
+    try:
+        with open(os.path.join(cache_dir, 'breaker.json')) as f:
+            breaker = json.load(f)
+    except (IOError, ValueError):
+        return False
+    return breaker.get('open_until', 0) > time.time()
+
+def breaker_failure():
+    def fail(breaker):
+        breaker['failures'] = breaker.get('failures', 0) + 1
+        if breaker['failures'] >= breaker_threshold:
+            cooldown = min(breaker_cooldown_max, breaker.get('cooldown', breaker_cooldown / 2) * 2)
+            breaker['cooldown'] = cooldown
+            breaker['open_until'] = time.time() + random.uniform(cooldown / 2, cooldown)
+            logger.warning('FAA Circuit Breaker Open For ' + str(int(breaker['open_until'] - time.time())) + ' Seconds')
+    update_json('breaker.json', fail)
+
+def breaker_success():
+    def reset(breaker):
+        if breaker.get('failures', 0):
+            logger.info('FAA Circuit Breaker Closed')
+        breaker.clear()
+    update_json('breaker.json', reset)
+
+#Seconds to wait before retry number 'attempt'. Exponential backoff with full jitter.
+def backoff_delay(attempt):
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+#Each chunk's ETag and Last-Modified are saved along with the response, so the next request can ask the FAA
+#to only send the data if it has changed. If the FAA doesn't send these headers nothing is saved.
+def chunk_paths(url):
+    base = os.path.join(cache_dir, 'chunks', hashlib.md5(url.encode()).hexdigest())
+    return base + '.xml', base + '.json'
+
+def read_chunk(url):
+    xml_path, meta_path = chunk_paths(url)
+    try:
+        with open(meta_path) as f:
+            validators = json.load(f)
+        with open(xml_path, 'rb') as f:
+            return f.read(), validators
+    except (IOError, ValueError):
+        return None, {}
+
+def write_chunk(url, content, validators):
+    xml_path, meta_path = chunk_paths(url)
+    os.makedirs(os.path.dirname(xml_path), exist_ok=True)
+    for path, data in ((xml_path, content), (meta_path, json.dumps(validators).encode())):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+#Return the cached product if there is one, otherwise None.
+def read_cache(name, stations):
+    xml_path, meta_path, lock_path = cache_paths(name, stations)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        fmt = meta.get('format', 'xml')
+        with open(cache_paths(name, stations, fmt)[0], 'rb') as f:
+            content = f.read()
+    except (IOError, ValueError, KeyError):
+        return None
+    return Product(name, content, meta['fetched'], meta['stations'], meta.get('hash', ''), fmt=fmt)
+
+#Write the product to the cache. Files are written to a temp file first and renamed so readers never see half a file.
+def write_cache(product):
+    xml_path, meta_path, lock_path = cache_paths(product.name, product.stations, product.format)
+    for path, data in ((xml_path, product.content),
+                       (meta_path, json.dumps({'fetched': product.fetched, 'stations': product.stations,
+                                               'hash': product.hash, 'format': product.format}).encode())):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+#Hedged request. Ask the first server in 'endpoints' and if it hasn't answered within 'hedge_delay' seconds, or fails,
+#ask the next one too and use whichever answers first. A slow server then costs a few seconds rather than the whole
+#timeout. Whatever is still running is left to finish in the background and its response is thrown away.
+def hedged_get(path, headers, stream=False):
+    if len(endpoints) == 1 or hedge_delay <= 0:
+        return session.get(endpoints[0] + path, timeout=timeout, headers=headers, stream=stream)
+
+    pool = ThreadPoolExecutor(max_workers=len(endpoints))
+    requested = {}
+    error = None
+    try:
+        def ask(endpoint):
+            future = pool.submit(session.get, endpoint + path, timeout=timeout, headers=headers, stream=stream)
+            requested[future] = endpoint
+            return future
+
+        pending = {ask(endpoints[0])}
+        backups = iter(endpoints[1:])
+        while pending:
+            done, pending = wait(pending, timeout=hedge_delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                    response.raise_for_status()
+                except Exception as e:
+                    error = e
+                    logger.warning(requested[future] + ' Failed - ' + str(e))
+                    continue
+                if requested[future] != endpoints[0]:
+                    logger.info('Backup Weather Server Answered First - ' + requested[future])
+                    count_stats(backup_won=1)
+                for loser in pending:           #Don't hold a connection open for a response nobody wants
+                    loser.add_done_callback(lambda f: f.exception() is None and f.result().close())
+                return response
+
+            backup = next(backups, None)        #Still waiting, or a server failed. Bring in the next one
+            if backup is not None:
+                logger.info('Weather Server Slow, Also Asking ' + backup)
+                count_stats(hedged=1)
+                pending.add(ask(backup))
+        raise error
+    finally:
+        pool.shutdown(wait=False)
+
+#Request one chunk of airports from the FAA. Retry if necessary, if house power outage, map may boot quicker than router.
+#tries=None will retry forever like the scripts always have. Returns None if the FAA could not be reached.
+#Sends If-None-Match/If-Modified-Since when the FAA gave us an ETag or Last-Modified last time.
+#'read' can be given to stream the response rather than load it all at once, it gets the response and returns the bytes
+#to keep. 'key' is what the response is saved under if it isn't the url, see fetch_bulk().
+def fetch_chunk(url, tries=None, read=None, key=None):
+    key = key or url
+    cached, validators = read_chunk(key)
+    headers = {}
+    if cached is not None:
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    attempt = 0
+    while True:
+        try:
+            response = hedged_get(url, headers, stream=read is not None) # Added timeout feature - Eric B
+            if response.status_code == 304:
+                logger.info('Internet Available - FAA Data Not Modified')
+                count_stats(not_modified=1)
+                return cached
+
+            response.raise_for_status()
+            logger.info('Internet Available')
+            logger.debug(url)
+            logger.debug('Received ' + response.headers.get('Content-Length', '?') + ' bytes, ' +
+                         response.headers.get('Content-Encoding', 'uncompressed'))
+            content = response.content if read is None else read(response)
+            count_stats(modified=1)
+
+            validators = {}
+            if 'ETag' in response.headers:
+                validators['etag'] = response.headers['ETag']
+            if 'Last-Modified' in response.headers:
+                validators['last_modified'] = response.headers['Last-Modified']
+            if validators:
+                write_chunk(key, content, validators)
+            return content
+        except Exception as e:
+            logger.warning('FAA Data is Not Available')
+            logger.warning(url)
+            logger.warning(str(e))
+            if tries is not None:
+                tries -= 1
+                if tries <= 0:
+                    return None
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+#Request one chunk, parsing it into records while it downloads so the parse overlaps the download rather than
+#starting once it's all arrived. Returns (content, records, hash), or None if the FAA could not be reached. 'hash' is
+#the md5 of the content, taken as it streams in, so fetch() can tell whether anything changed. A chunk the FAA says is
+#Not Modified is parsed from the copy saved last time. A response cut short fails to parse and is retried.
+#'fmt' is the response format. 'stations' and 'key' are for the bulk cache file, see fetch_bulk().
+def fetch_parsed(url, tag, tries=None, stations=None, key=None, fmt='xml'):
+    parsed = []
+
+    def read(response):
+        stream = wxdecode.formats[fmt](tag, stations)
+        if stations is not None:
+            content = filter_bulk(response, stream)
+            digest = hashlib.md5(content)       #Only our own airports count
+        else:
+            digest = hashlib.md5()
+            content = stream_chunk(response, stream, digest)
+        parsed.append((content, stream.records, digest.hexdigest()))
+        return content
+
+    content = fetch_chunk(url, tries, read, key)
+    if content is None:
+        return None
+    if parsed and parsed[-1][0] is content:
+        return parsed[-1]
+    return content, wxdecode.parse_records(content, tag, fmt), hashlib.md5(content).hexdigest()
+
+#Read a response a block at a time, feeding each block to the parser and to 'digest' as it arrives.
+def stream_chunk(response, stream, digest):
+    blocks = []
+    for block in response.iter_content(64 * 1024): #Any gzip Content-Encoding is undone by requests
+        blocks.append(block)
+        digest.update(block)
+        stream.feed(block)
+    stream.close()
+    response.close()
+    return b''.join(blocks)
+
+#Request one chunk and time it. Used by the thread pool so the time saved by fetching in parallel can be logged.
+def timed_chunk(url, tag, tries, fmt):
+    start = time.time()
+    result = fetch_parsed(url, tag, tries, fmt=fmt)
+    return result, time.time() - start
+
+#Stream the FAA's bulk cache file and keep only the airports 'stream' was given. The file has every station in the
+#country, so rather than loading it all, it's decompressed and parsed a piece at a time and each station's element is
+#thrown away as soon as it's been checked. Memory use stays at about the size of our own airports, even on a Pi Zero.
+def filter_bulk(response, stream):
+    unzip = None
+    for block in response.iter_content(64 * 1024): #Any Content-Encoding is undone here, the file itself is still gzip'd
+        if unzip is None:                       #Check for the gzip magic number. Some servers already decompressed it for us
+            unzip = zlib.decompressobj(16 + zlib.MAX_WBITS) if block[:2] == b'\x1f\x8b' else False
+        while block:                            #Decompress a piece at a time, a small block can hold a lot of XML
+            if unzip:
+                data, block = unzip.decompress(block, 64 * 1024), unzip.unconsumed_tail
+            else:
+                data, block = block, b''
+            stream.feed(data)
+    stream.close()
+    response.close()
+    return (b'<response><data num_results="' + str(len(stream.pieces)).encode() + b'">' +
+            b''.join(stream.pieces) + b'</data></response>')
+
+#Download a product using the bulk cache file. Returned in a list to match the chunks from the per airport requests.
+#The filtered result is saved under a key made from the airport list, so a 304 Not Modified hands back our own airports.
+def fetch_bulk(name, stations, tries=None):
+    url = products[name]['bulk_url']
+    tag = products[name]['tag']
+    key = url + '#' + os.path.basename(cache_paths(name, stations)[0])
+    logger.info('API Bulk URL: ' + url)
+    start = time.time()
+    result = fetch_parsed(url, tag, tries, stations, key)
+    logger.info(f'Bulk file took {time.time() - start:.2f}s')
+    return None if result is None else [result]
+
+#Use the bulk cache file if the product has one and there are enough airports to make it worthwhile.
+def use_bulk(name, stations):
+    return bulk_airports > 0 and len(stations) >= bulk_airports and 'bulk_url' in products[name]
+
+#The number of airports per chunk adjusts itself. Each time every chunk comes back quickly the size grows by half,
+#and if a chunk fails or is slow it's cut in half, between 'chunk_size_min' and 'chunk_size_max'. The size that works
+#is remembered in chunks.json in the cache directory, so big maps settle on as few requests as the FAA will take.
+#A total failure is an outage rather than a size problem, so the size is left alone and the circuit breaker handles it.
+def chunk_sizes():
+    try:
+        with open(os.path.join(cache_dir, 'chunks.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def learn_chunk_size(name, size, full, failed, total, slowest):
+    def adjust(sizes):
+        new_size = size
+        if (failed and failed < total) or slowest > chunk_slow:
+            new_size = max(chunk_size_min, size // 2)
+        elif not failed and full:               #Only grow if the chunks were actually filled
+            new_size = min(chunk_size_max, size + size // 2)
+        if new_size != size:
+            logger.info(f'{name.upper()} chunk size changed from {size} to {new_size} airports')
+        sizes[name] = new_size
+    update_json('chunks.json', adjust)
+
+#Split the airports into chunks of up to 'size' airports, keeping each URL under 'url_max' characters.
+def split_stations(url, stations, size):
+    chunks = []
+    chunk = []
+    length = len(url)
+    for station in stations:
+        if chunk and (len(chunk) >= size or length + len(station) + 1 > url_max):
+            chunks.append(chunk)
+            chunk = []
+            length = len(url)
+        chunk.append(station)
+        length += len(station) + 1
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+#Download a product from the FAA in chunks and return (raw response, records, hash) for each, in the same order as the
+#airports. Chunks are requested in parallel, 'fetch_workers' at a time, each with 'chunk_tries' tries. Any chunk that
+#still fails is retried on its own using 'tries', so a slow or failed chunk doesn't hold up the rest.
+# Thank you Daniel from pilotmap.co for the original chunking routine that handles maps with more than 300 airports.
+def fetch_chunks(name, stations, tries=None, fmt='xml'):
+    url = product_url(name, fmt)
+    tag = products[name]['tag']
+    size = chunk_sizes().get(name, chunk_size)
+    station_chunks = split_stations(url, stations, size)
+    chunk_urls = [url + ','.join(chunk) for chunk in station_chunks]
+    wall_start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, fetch_workers)) as pool:
+        for chunk_url in chunk_urls:
+            logger.info('API URL Chunk: ' + chunk_url)
+        pool_tries = chunk_tries if tries is None else min(tries, chunk_tries)
+        results = list(pool.map(timed_chunk, chunk_urls, [tag] * len(chunk_urls), [pool_tries] * len(chunk_urls),
+                                [fmt] * len(chunk_urls)))
+    wall_time = time.time() - wall_start
+    chunk_time = sum(seconds for result, seconds in results)
+
+    logger.info(f'{len(chunk_urls)} chunks took {wall_time:.2f}s, {max(0, chunk_time - wall_time):.2f}s saved by fetching in parallel')
+    if results:
+        learn_chunk_size(name, size, max(len(chunk) for chunk in station_chunks) >= size,
+                         sum(1 for result, seconds in results if result is None), len(results),
+                         max(seconds for result, seconds in results))
+
+    chunks = []
+    for chunk_url, (result, seconds) in zip(chunk_urls, results):
+        if result is None:
+            if tries is not None and tries <= pool_tries:
+                return None
+            logger.warning('Chunk failed after ' + str(pool_tries) + ' tries, retrying on its own')
+            result = fetch_parsed(chunk_url, tag, None if tries is None else tries - pool_tries, fmt=fmt)
+            if result is None:
+                return None
+        chunks.append(result)
+    return chunks
+
+#Download a product from the FAA and consolidate all the chunks into one response. Big maps get the product from
+#the bulk cache file instead, if it's turned on in admin.py. The bulk file is always XML.
+#The chunks were parsed into records as they downloaded, so the responses are joined together as they were sent
+#rather than parsed and rebuilt. Each chunk was hashed as it streamed in too. If the hashes match 'previous', the
+#records are thrown away and the previous content is reused, so the scripts don't decode the same weather again.
+def fetch(name, stations, tries=None, previous=None):
+    tag = products[name]['tag']
+    if use_bulk(name, stations):
+        fmt = 'xml'
+        chunks = fetch_bulk(name, stations, tries)
+    else:
+        fmt = product_format(name)
+        chunks = fetch_chunks(name, stations, tries, fmt)
+    if chunks is None:
+        return None
+
+    digest = hashlib.md5()
+    for content, records, chunk_hash in chunks:
+        digest.update(chunk_hash.encode())
+    digest = digest.hexdigest()
+
+    if previous is not None and previous.hash == digest:
+        logger.info(name.upper() + ' Data Unchanged Since Last Download')
+        count_stats(unchanged=1)
+        return Product(name, previous.content, time.time(), stations, digest, changed=False, fmt=previous.format)
+
+    all_records = []
+    for content, records, chunk_hash in chunks: #Merge chunks in the same order as the airports file
+        all_records.extend(records)
+        logger.info(f'Chunk processed: {len(records)} {tag}s found')
+    count_stats(changed=1)
+
+    content = wxdecode.formats[fmt].join([content for content, records, chunk_hash in chunks], len(all_records))
+    logger.info(f'Total {tag}s collected from all chunks: {len(all_records)}')
+    return Product(name, content, time.time(), stations, digest, records=all_records, fmt=fmt)
+
+#Main routine used by the scripts. Returns the product for the airports given, either from the cache if another script
+#has retrieved it within 'max_age' seconds, or from the FAA. Only one script downloads at a time, the others wait on the lock.
+#If the FAA can't be reached and there is older data in the cache, that data is returned marked stale rather than
+#retrying forever, so the map keeps showing weather. With nothing in the cache it retries like it always has.
+def get_product(name, airports, max_age=None, tries=None):
+    stations = station_list(airports)
+    if max_age is None:
+        max_age = products[name]['max_age']
+
+    product = read_cache(name, stations)
+    if product is not None and product.age < max_age:
+        logger.info(name.upper() + ' Data Loaded From Cache, ' + str(int(product.age)) + ' Seconds Old')
+        return product
+
+    if product is not None and breaker_open():
+        return serve_stale(product)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    xml_path, meta_path, lock_path = cache_paths(name, stations)
+    with open(lock_path, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)        #Wait here if another script is already downloading this product
+
+        product = read_cache(name, stations)    #Check again, the other script may have just finished
+        if product is not None and product.age < max_age:
+            logger.info(name.upper() + ' Data Loaded From Cache, ' + str(int(product.age)) + ' Seconds Old')
+            return product
+
+        if product is not None:                 #There's older data to fall back on, so don't retry forever
+            tries = stale_tries if tries is None else min(tries, stale_tries)
+
+        new_product = fetch(name, stations, tries, previous=product)
+        if new_product is None:
+            breaker_failure()
+            if product is not None:
+                return serve_stale(product)
+            return None
+
+        breaker_success()
+        write_cache(new_product)
+        return new_product
+
+#Hand back the last good data when the FAA isn't available.
+def serve_stale(product):
+    product.stale = True
+    logger.warning('FAA Data is Not Available - Using ' + product.name.upper() + ' Data From ' +
+                   time.strftime('%H:%M', time.localtime(product.fetched)) + ', ' + str(int(product.age / 60)) + ' Minutes Old')
+    return product
+
+
+#Pre-load the cache with every product for the current airports file.
+if __name__ == '__main__':
+    airports = read_airports()
+    for name in products:
+        product = get_product(name, airports)
+        print(name + ' - ' + str(len(product)) + ' airports')
+    print('Conditional fetch stats - ' + str(read_stats()))
@@ -0,0 +1,271 @@
+#wxmos.py - by Mark Harris. Reads the GFS MOS bulletin, GFSMAV, for metar-v4.py and metar-display-v4.py
+#    The bulletin is a fixed column format, see https://www.weather.gov/mdl/mos_gfsmos_mavcard. Each airport has a
+#    header line, then one line per element, i.e. ' WSP  04 04 02 08', with the element's name in the first 5
+#    characters and then a 3 character column for each forecast hour, numbers on the right. A blank column means the
+#    element isn't forecast for that hour, i.e. P06 is every 6 hours, and a 3 digit value such as 100 fills its column.
+#    Each value is read from its own column, so blank columns and runs like '100100' need no special handling, and
+#    comes back typed: numbers as int's, codes such as CLD 'OV' as strings and T06/T12 as (thunderstorm, severe)
+#    percents. Anything not forecast is None.
+#    The file is mapped into memory and indexed by where each airport starts, once each time it changes, so only the
+#    airports on the map are read, however many the bulletin has.
+#    What was read for the map is saved in the weather cache too, by airport list, with the bulletin's md5. The scripts
+#    restart each time a setting is saved, and the bulletin only changes 4 times a day, so after a restart the MOS
+#    comes back from that file rather than from the bulletin.
+
+#Import needed libraries
+import hashlib
+import json
+import mmap
+import os
+import struct
+from logzero import logger
+import admin
+
+#Misc settings
+first_column = 5                                #Where the values start on each line
+column_width = 3
+text_elements = (b'CLD', b'TYP', b'OBV')        #Codes, kept as strings. All other elements are numbers
+pair_elements = (b'T06', b'T12')                #Thunderstorm/severe percents, i.e. ' 26/ 4', ending in their hour's column
+blank = b'   '
+layouts = {}                                    #struct.Struct for the columns of a line with so many forecast hours
+header_text = b' GFS MOS GUIDANCE'              #On the first line of each airport's MOS, after its id
+bulletins = {}                                  #Bulletin by path, see open_bulletin()
+cache_dir = admin.wx_cache_dir                  #Where the decoded MOS is saved, with the downloaded weather
+decoded = {}                                    #(bulletin, MosReports) by cache file, see read_cached()
+
+#One airport's MOS. 'hours' are the forecast hours, i.e. [12, 15, 18, ...], and 'elements' each element's values
+#for those hours, by name, i.e. elements['WSP'][0] is the wind speed at the first hour. 'date' and 'time' are when
+#it was issued, i.e. '9/06/2025' and '0600 UTC'.
+class MosReport:
+    __slots__ = ('station', 'date', 'time', 'hours', 'elements')
+
+    def __init__(self, station, date, time):
+        self.station = station
+        self.date = date
+        self.time = time
+        self.hours = []
+        self.elements = {}
+
+    #Index of the forecast covering 'hour' of the day, 0-23, from the first 24 hours of the bulletin, or None.
+    def period(self, hour):
+        for n, hr in enumerate(self.hours[:8]):
+            if hr <= hour < hr + 3:
+                return n
+        return None
+
+    #Value of 'element' at the 'n'th forecast hour, or None if it isn't forecast.
+    def value(self, element, n):
+        values = self.elements.get(element)
+        if values is None or n is None or n >= len(values):
+            return None
+        return values[n]
+
+    #Value of a 6 or 12 hour element, i.e. P06, for the period the 'n'th forecast hour is in. Each is in the column of
+    #the hour its period ends, so it's the first one after hour 'n'. None if there isn't one.
+    def window(self, element, n):
+        values = self.elements.get(element)
+        if values is None or n is None:
+            return None
+        for value in values[n + 1:]:
+            if value is not None:
+                return value
+        return None
+
+#Each column of a line with 'count' forecast hours, i.e. [b' 12', b'   ', ...]. The line is padded if it's short.
+def columns(line, count):
+    layout = layouts.get(count)
+    if layout is None:
+        layout = layouts[count] = struct.Struct((str(column_width) + 's') * count)
+    if len(line) < first_column + layout.size:
+        line = line.ljust(first_column + layout.size)
+    return layout.unpack_from(line, first_column)
+
+#Values from one line for 'count' forecast hours. When the line has a value in every column, splitting it on spaces
+#gives the same values and is quicker. It can't give 'count' values any other way, as a column holds one value at most.
+def numbers(line, count):
+    values = line[first_column:].split()
+    if len(values) == count:
+        return [int(value) for value in values]
+    return [None if value == blank else int(value) for value in columns(line, count)]
+
+def codes(line, count):
+    values = line[first_column:].split()
+    if len(values) == count:
+        return [value.decode('ascii') for value in values]
+    return [None if value == blank else value.strip().decode('ascii') for value in columns(line, count)]
+
+def pairs(line, count):
+    values = [None] * count
+    c = line.find(b'/', first_column)
+    while c != -1:
+        n = (c - first_column) // column_width
+        if n < count:
+            values[n] = (int(line[c - column_width:c]), int(line[c + 1:c + column_width]))
+        c = line.find(b'/', c + 1)
+    return values
+
+#One airport's MOS from its lines of the bulletin, header first. Stops at the blank line after it.
+def parse_report(block):
+    lines = block.split(b'\n')
+    fields = lines[0].split()
+    report = MosReport(fields[0].decode('ascii'), fields[-3].decode('ascii'), (fields[-2] + b' ' + fields[-1]).decode('ascii'))
+    for line in lines[1:]:
+        if not line.strip():                    #Blank line after the airport
+            break
+        element = line[1:4]
+        if element == b'HR ':
+            report.hours = [int(hour) for hour in line[first_column:].split()]
+        elif element == b'DT ':
+            continue
+        elif element in text_elements:
+            report.elements[element.decode('ascii')] = codes(line, len(report.hours))
+        elif element in pair_elements:
+            report.elements[element.decode('ascii')] = pairs(line, len(report.hours))
+        else:
+            report.elements[element.decode('ascii').strip()] = numbers(line, len(report.hours))
+    return report
+
+#A bulletin and where each airport's MOS is in it, so only the airports asked for are read. 'data' is the bulletin's
+#bytes or, from open_bulletin(), the file mapped into memory so the rest of it is never read from the SD card.
+#'index' is (start, end) in 'data' by airport id. An airport listed twice keeps its first MOS.
+class Bulletin:
+    def __init__(self, data, key=None):
+        self.data = data
+        self.key = key                          #Which file it was, see open_bulletin()
+        self.index = {}
+        starts = []
+        at = data.find(header_text)
+        while at != -1:
+            line_start = data.rfind(b'\n', 0, at) + 1
+            starts.append((line_start, data[line_start:at].split()[0].decode('ascii')))
+            at = data.find(header_text, at + len(header_text))
+        for (start, station), (end, _) in zip(starts, starts[1:] + [(len(data), None)]):
+            self.index.setdefault(station, (start, end))
+
+    def report(self, station):
+        start, end = self.index[station]
+        return parse_report(self.data[start:end])
+
+    #MosReports by airport id for the airports in 'stations' that are in the bulletin, or all of them.
+    def reports(self, stations=None):
+        reports = {}
+        for station in self.index if stations is None else stations:
+            if station in self.index and station not in reports:
+                reports[station] = self.report(station)
+        return reports
+
+#The airports in the bulletin 'data', the bytes of GFSMAV, as MosReports by airport id. Only the airports in
+#'stations' are read if it's given.
+def parse(data, stations=None):
+    return Bulletin(data).reports(stations)
+
+#The bulletin at 'path', mapped into memory and indexed the first time, then kept until the file changes. The
+#getmos scripts move each new bulletin into place, so the mapped file is never changed underneath it.
+#Raises IOError if it can't be read.
+def open_bulletin(path):
+    stat = os.stat(path)
+    key = (stat.st_ino, stat.st_mtime, stat.st_size)
+    bulletin = bulletins.get(path)
+    if bulletin is None or bulletin.key != key:
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+        bulletin = bulletins[path] = Bulletin(data, key)
+        logger.info('Indexed ' + str(len(bulletin.index)) + ' airports in ' + path)
+    return bulletin
+
+#The MOS for 'stations' from the bulletin at 'path'. Raises IOError if it can't be read.
+def read_file(path, stations=None):
+    return open_bulletin(path).reports(stations)
+
+#The first airport's header line in the bulletin at 'path', i.e. ' PHBK   GFS MOS GUIDANCE    9/06/2025  0600 UTC',
+#or None if there isn't one. Nothing past it is read. Raises IOError if it can't be read.
+def first_header(path):
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            at = data.find(header_text)
+            if at == -1:
+                return None
+            end = data.find(b'\n', at)
+            return data[data.rfind(b'\n', 0, at) + 1:len(data) if end == -1 else end].rstrip().decode('ascii')
+
+#File the MOS for the airports in 'stations' is saved in. The airport list is part of the name so two different
+#lists never share one, like wxfetch.cache_paths().
+def cache_path(stations):
+    key = hashlib.md5(','.join(stations).encode()).hexdigest()[:10]
+    return os.path.join(cache_dir, 'mos-' + key + '.json')
+
+#md5 of the bulletin at 'path'.
+def file_hash(path):
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return hashlib.md5().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return hashlib.md5(data).hexdigest()
+
+#A MosReport as lists and strings for json, and back again. json has no tuples, so T06 and T12 come back as lists
+#and are turned back into tuples.
+def saved_report(report):
+    return [report.date, report.time, report.hours, report.elements]
+
+def loaded_report(station, saved):
+    date, time, hours, elements = saved
+    report = MosReport(station, date, time)
+    report.hours = hours
+    for element, values in elements.items():
+        if element.encode('ascii') in pair_elements:
+            values = [None if value is None else tuple(value) for value in values]
+        report.elements[element] = values
+    return report
+
+def load_cache(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+#Save to a temp file and rename it, so a script restarting at the same time never reads half of it.
+def save_cache(filename, saved):
+    temp_path = filename + '.' + str(os.getpid())
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(temp_path, 'w') as f:
+            json.dump(saved, f, separators=(',', ':'))
+        os.replace(temp_path, filename)
+    except (IOError, OSError) as error:
+        logger.warning('Could not save the MOS to ' + filename)
+        logger.warning(error)
+
+#The MOS for 'stations' from the bulletin at 'path', like read_file(), but kept in memory and saved in the cache
+#directory until the bulletin changes. The saved file is used as is if the bulletin is the same file it was read from,
+#and after checking its md5 if the bulletin was written again. Only a new bulletin is read. Raises IOError if it
+#can't be read.
+def read_cached(path, stations):
+    stat = os.stat(path)
+    bulletin = [path, stat.st_ino, stat.st_mtime, stat.st_size]
+    stations = sorted(set(stations))
+    filename = cache_path(stations)
+    if filename in decoded and decoded[filename][0] == bulletin:
+        return decoded[filename][1]
+
+    saved = load_cache(filename)
+    if saved is not None and saved.get('stations') != stations:
+        saved = None
+    if saved is not None and saved.get('bulletin') != bulletin:
+        if saved.get('hash') == file_hash(path):
+            saved['bulletin'] = bulletin        #Same MOS downloaded again
+            save_cache(filename, saved)
+        else:
+            saved = None
+
+    if saved is not None:
+        reports = {station: loaded_report(station, report) for station, report in saved['reports'].items()}
+        logger.info('Loaded the MOS of ' + str(len(reports)) + ' airports from ' + filename)
+    else:
+        reports = read_file(path, stations)
+        save_cache(filename, {'bulletin': bulletin, 'hash': file_hash(path), 'stations': stations,
+                              'reports': {station: saved_report(report) for station, report in reports.items()}})
+    decoded[filename] = (bulletin, reports)
+    return reports
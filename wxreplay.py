@@ -0,0 +1,258 @@
+#wxreplay.py - by Mark Harris. Record the FAA's weather data and replay it from a local stand-in server.
+#    Used to benchmark and test the scripts without the live FAA API. Record once while online, then serve the
+#    recording and point the scripts at it by setting wx_endpoints in admin.py, i.e. wx_endpoints=['http://localhost:8080']
+#    The server can add latency and errors, and can add synthetic airports to see how a very large map performs.
+#
+#    sudo python3 /NeoSectional/wxreplay.py record                   - Record METAR, TAF, stationinfo and GFSMAV
+#    sudo python3 /NeoSectional/wxreplay.py serve --latency 2 --errors 0.1 --stations 5000
+#    sudo python3 /NeoSectional/wxreplay.py airports --stations 5000 > /NeoSectional/airports-test
+#                                                                    - Airports file using the recorded and synthetic airports
+#    The recorded GFSMAV is served at /source/mdl/MOS/GFSMAV.t00z (t06z, t12z, t18z) like weather.gov.
+#    Products are recorded as XML and served as XML, JSON, CSV or raw METAR text, whichever 'format=' asks for.
+
+#Import needed libraries
+import argparse
+import calendar
+import copy
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from logzero import logger
+import wxfetch                                  #Shared FAA weather fetcher, used to make the recording
+import wxdecode                                 #Names the JSON and CSV responses use
+
+#Misc settings
+replay_dir = '/NeoSectional/wxreplay'           #Where the recording is kept
+mos_url = 'https://www.weather.gov/source/mdl/MOS/GFSMAV.t00z' #Same file the getmos scripts download
+synthetic_prefix = 'Q'                          #Synthetic airport id's are this plus 3 letters/numbers, i.e. Q0A7
+
+#Products served, with the file each is recorded in. Bulk files are the gzip'd cache files from the FAA.
+recorded = {name: name + '.xml' for name in wxfetch.products}
+bulk_files = {product['bulk_url']: name for name, product in wxfetch.products.items() if 'bulk_url' in product}
+content_types = {'xml': 'text/xml', 'json': 'application/json', 'csv': 'text/csv', 'raw': 'text/plain'}
+
+
+#Record the current FAA data for every airport in the airports file. Goes straight to the first server in
+#wx_endpoints, bypassing the weather cache, so the recording is always fresh.
+def record(directory, airports_file):
+    os.makedirs(directory, exist_ok=True)
+    wxfetch.response_format = 'xml'             #Recorded as XML whatever admin.py asks for, it's served in any format
+    stations = wxfetch.station_list(wxfetch.read_airports(airports_file))
+
+    for name, filename in recorded.items():
+        product = wxfetch.fetch(name, stations, tries=3)
+        if product is None:
+            logger.error('Could not record ' + name.upper())
+            continue
+        write_file(os.path.join(directory, filename), product.content)
+        print('Recorded ' + str(len(product)) + ' ' + name.upper())
+
+    response = wxfetch.session.get(mos_url, timeout=wxfetch.timeout)
+    if response.ok:
+        write_file(os.path.join(directory, 'GFSMAV'), response.content)
+        print('Recorded GFSMAV, ' + str(len(response.content)) + ' bytes')
+    else:
+        logger.error('Could not record GFSMAV - ' + str(response.status_code))
+
+def write_file(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+#Synthetic airport id number 'n'.
+def synthetic_id(n):
+    digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return synthetic_prefix + digits[n // 1296 % 36] + digits[n // 36 % 36] + digits[n % 36]
+
+#The recording loaded into memory. For each product, the elements by airport id, in the order they were recorded.
+#'stations' adds synthetic airports, copied from the recorded ones, until there are that many airports in all.
+class Recording:
+    def __init__(self, directory, stations=0):
+        self.elements = {}
+        self.station_ids = []
+        for name, filename in recorded.items():
+            self.elements[name] = {}
+            path = os.path.join(directory, filename)
+            if not os.path.exists(path):
+                logger.warning('Nothing recorded for ' + name.upper())
+                continue
+            for element in ET.parse(path).getroot().iter(wxfetch.products[name]['tag']):
+                stationId = element.findtext('station_id')
+                self.elements[name].setdefault(stationId, []).append(element)
+                if stationId not in self.station_ids:
+                    self.station_ids.append(stationId)
+
+        real_ids = list(self.station_ids)
+        for n in range(max(0, stations - len(real_ids))):
+            stationId = synthetic_id(n)
+            self.station_ids.append(stationId)
+            original = real_ids[n % len(real_ids)]
+            for name, by_station in self.elements.items():
+                if original in by_station:
+                    by_station[stationId] = [self.rename(element, original, stationId) for element in by_station[original]]
+
+        try:
+            with open(os.path.join(directory, 'GFSMAV'), 'rb') as f:
+                self.gfsmav = f.read()
+        except IOError:
+            self.gfsmav = None
+
+        self.bulk = {}                          #Built the first time each bulk file is asked for
+
+    #Copy of a recorded element with the airport id changed.
+    @staticmethod
+    def rename(element, original, stationId):
+        element = copy.deepcopy(element)
+        element.find('station_id').text = stationId
+        raw_text = element.find('raw_text')
+        if raw_text is not None and raw_text.text:
+            raw_text.text = raw_text.text.replace(original, stationId, 1)
+        return element
+
+    #Response for the airports asked for, in the same form the FAA API sends, as 'xml', 'json', 'csv' or 'raw'.
+    def response(self, name, stationIds, fmt='xml'):
+        elements = [element for stationId in stationIds for element in self.elements[name].get(stationId, [])]
+        tag = wxfetch.products[name]['tag']
+        if fmt == 'json':
+            return json.dumps([api_item(wxdecode.flatten(element), tag) for element in elements]).encode()
+        if fmt == 'csv':
+            return csv_response([wxdecode.flatten(element) for element in elements])
+        if fmt == 'raw':
+            return b''.join((element.findtext('raw_text') or '').encode() + b'\n' for element in elements)
+
+        root = ET.Element('response')
+        data = ET.SubElement(root, 'data', num_results=str(len(elements)))
+        data.extend(elements)
+        return ET.tostring(root, encoding='UTF-8')
+
+    def bulk_file(self, name):
+        if name not in self.bulk:
+            self.bulk[name] = gzip.compress(self.response(name, self.station_ids))
+        return self.bulk[name]
+
+
+#A record as the JSON API sends it, with the API's names, numbers as numbers and times as seconds since 1970.
+def api_item(record, tag):
+    item = {}
+    for api_name, name in wxdecode.api_names[tag].items():
+        if name in record:
+            item[api_name] = json_value(name, record[name])
+    if record['sky_condition']:
+        item['clouds'] = [{'cover': cover, 'base': None if base is None else int(base)} for cover, base in record['sky_condition']]
+    if 'forecast' in record:
+        item['fcsts'] = [api_item(forecast, 'forecast') for forecast in record['forecast']]
+    return item
+
+def json_value(name, text):
+    if name in wxdecode.time_names:
+        return calendar.timegm(time.strptime(text, '%Y-%m-%dT%H:%M:%SZ'))
+    for number in (int, float):
+        try:
+            return number(text)
+        except (TypeError, ValueError):
+            pass
+    return text
+
+#Records as CSV like the FAA's cache files, with the XML names and 4 sky_cover/cloud_base_ft_agl column pairs.
+def csv_response(records):
+    columns = []
+    for record in records:
+        columns.extend(name for name in record if name not in columns and name not in ('sky_condition', 'forecast'))
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(columns + ['sky_cover', 'cloud_base_ft_agl'] * 4)
+    for record in records:
+        layers = (record['sky_condition'] + [('', '')] * 4)[:4]
+        writer.writerow([record.get(name, '') for name in columns] + [value or '' for layer in layers for value in layer])
+    return out.getvalue().encode()
+
+
+#Stand-in for the FAA API. Settings are class attributes set by serve().
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'               #Keep-alive like the FAA
+    recording = None
+    latency = 0.0
+    jitter = 0.0
+    errors = 0.0
+
+    def do_GET(self):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.errors:
+            return self.send_body(503, b'Service Unavailable', 'text/plain')
+
+        url = urlparse(self.path)
+        if url.path in bulk_files:
+            return self.send_body(200, self.recording.bulk_file(bulk_files[url.path]), 'application/x-gzip')
+        if url.path.startswith('/source/mdl/MOS/GFSMAV') and self.recording.gfsmav is not None:
+            return self.send_body(200, self.recording.gfsmav, 'text/plain')
+        for name, product in wxfetch.products.items():
+            if url.path == urlparse(product['url']).path:
+                query = parse_qs(url.query)
+                stationIds = [stationId for stationId in query.get('ids', [''])[0].split(',') if stationId]
+                fmt = query.get('format', ['xml'])[0]
+                if fmt not in content_types:
+                    return self.send_body(400, b'Unknown format', 'text/plain')
+                return self.send_body(200, self.recording.response(name, stationIds, fmt), content_types[fmt])
+        return self.send_body(404, b'Not Found', 'text/plain')
+
+    #Send a response with an ETag, answering 304 Not Modified if the client already has it, and gzip it if asked.
+    def send_body(self, status, body, content_type):
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if status == 200:
+            self.send_header('ETag', etag)
+        if content_type in content_types.values() and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('wxreplay ' + (format % args))
+
+def serve(directory, port, latency, jitter, errors, stations):
+    ReplayHandler.recording = Recording(directory, stations)
+    ReplayHandler.latency = latency
+    ReplayHandler.jitter = jitter
+    ReplayHandler.errors = errors
+    server = ThreadingHTTPServer(('', port), ReplayHandler)
+    print('Replaying ' + str(len(ReplayHandler.recording.station_ids)) + ' airports from ' + directory +
+          ' on port ' + str(port) + ". Set wx_endpoints=['http://localhost:" + str(port) + "'] in admin.py")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record and replay FAA weather data')
+    parser.add_argument('mode', choices=['record', 'serve', 'airports'])
+    parser.add_argument('--dir', default=replay_dir, help='recording directory')
+    parser.add_argument('--airports', default=wxfetch.airports_file, help='airports file to record')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random +/- seconds added to the latency')
+    parser.add_argument('--errors', type=float, default=0.0, help='fraction of requests answered with a 503')
+    parser.add_argument('--stations', type=int, default=0, help='add synthetic airports up to this many')
+    args = parser.parse_args()
+
+    if args.mode == 'record':
+        record(args.dir, args.airports)
+    elif args.mode == 'serve':
+        serve(args.dir, args.port, args.latency, args.jitter, args.errors, args.stations)
+    else:
+        sys.stdout.write('\n'.join(Recording(args.dir, args.stations).station_ids) + '\n')
@@ -0,0 +1,124 @@
+#wxsched.py - by Mark Harris. Works out when metar-v4.py should next refresh the FAA weather.
+#    Most airports publish their METAR within a few minutes of each other once an hour, the hourly "burst".
+#    Refreshing every 'update_interval' minutes from whenever the script started can just miss it and show data
+#    that's nearly an interval old. This learns the minute of the hour our airports report, from 'observation_time',
+#    and shifts the refresh times so one of them lands shortly after the burst. Refreshes stay 'update_interval'
+#    apart, so the FAA isn't asked any more often than before.
+#    Until enough has been learned, or for TAFs and MOS, the refresh is simply 'update_interval' minutes from now.
+
+#Import needed libraries
+import time
+import os
+import json
+import random
+from logzero import logger
+import admin
+import wxfetch                                  #Shared FAA weather fetcher. The schedule is kept in its cache directory
+
+#Misc settings
+use_schedule = admin.wx_schedule                #1 = refresh after the hourly METAR burst, 0 = every update_interval minutes
+publish_delay = 3 * 60                          #Seconds between a METAR's observation time and the FAA having it
+jitter_max = 90                                 #Each map waits a random 0 to this many more seconds, so they don't all refresh together
+decay = 0.8                                     #Weight kept from earlier observations each time new METARs are learned
+min_samples = 20                                #Observations needed before the schedule is used
+burst_share = 0.10                              #Minutes of the hour with at least this share of the observations are part of a burst
+min_wait = 60                                   #Never schedule a refresh sooner than this many seconds from now
+
+#Read the schedule. 'minutes' is the weighted count of observations in each minute of the hour, 'hash' the last METAR
+#data learned from and 'jitter' this map's own random delay, chosen once.
+def read_schedule():
+    try:
+        with open(os.path.join(wxfetch.cache_dir, 'schedule.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+#Add the observation times of a METAR product to the schedule. Each airport's latest METAR counts once.
+def learn(product):
+    if product is None or product.name != 'metar' or product.stale:
+        return
+
+    counts = [0] * 60
+    seen = set()
+    for metar in product.records:
+        stationId = metar.get('station_id')
+        obs_time = metar.get('observation_time') #i.e. 2020-03-24T18:53:00Z
+        if stationId in seen or not obs_time or len(obs_time) < 16:
+            continue
+        seen.add(stationId)
+        counts[int(obs_time[14:16]) % 60] += 1
+
+    def add(schedule):
+        if schedule.get('hash') == product.hash: #Already learned from this data
+            return
+        minutes = schedule.get('minutes', [0] * 60)
+        schedule['minutes'] = [round(old * decay + new, 3) for old, new in zip(minutes, counts)]
+        schedule['hash'] = product.hash
+        schedule.setdefault('jitter', random.uniform(0, jitter_max))
+    wxfetch.update_json('schedule.json', add)
+
+#Seconds after the top of the hour to refresh, just after the biggest burst, or None if not enough has been learned.
+#Adjacent busy minutes are one burst, and a burst can wrap past the top of the hour, i.e. :58 to :02.
+def burst_offset(schedule):
+    minutes = schedule.get('minutes')
+    if not minutes or sum(minutes) < min_samples:
+        return None
+
+    busy = [count >= burst_share * sum(minutes) for count in minutes]
+    if not any(busy) or all(busy):              #No burst to line up with
+        return None
+
+    best_size, best_end = 0, None
+    start = busy.index(False)                   #Begin on a quiet minute so no burst is split in two
+    size = 0
+    for step in range(1, 61):
+        minute = (start + step) % 60
+        if busy[minute]:
+            size += minutes[minute]
+            if size > best_size:
+                best_size, best_end = size, minute
+        else:
+            size = 0
+    return (best_end + 1) * 60 + publish_delay + schedule.get('jitter', 0)
+
+#Time, as time.time(), of the next refresh for a map updating every 'update_interval' minutes.
+def next_refresh(update_interval, metar=True, now=None):
+    now = time.time() if now is None else now
+    interval = update_interval * 60
+    offset = burst_offset(read_schedule()) if use_schedule and metar else None
+    if offset is None:
+        return now + interval
+
+    hour_start = now - now % 3600
+    burst = hour_start + offset % 3600          #Next time just after the burst
+    while burst <= now + min_wait:
+        burst += 3600
+    refresh = burst - int((burst - now - min_wait) // interval) * interval #Step back in whole intervals toward now
+    logger.info('Next FAA Refresh at ' + time.strftime('%H:%M:%S', time.localtime(refresh)) +
+                ', METAR Burst Expected Before ' + time.strftime('%H:%M:%S', time.localtime(burst)))
+    return refresh
+
+#Oldest cached METARs, in seconds, worth showing. Data from before the latest burst is requested again even if
+#another script got it within the update interval, so the refresh after a burst always gets the new METARs.
+#None if there's no schedule, so the usual cache age is used.
+def max_age(metar=True, now=None):
+    now = time.time() if now is None else now
+    offset = burst_offset(read_schedule()) if use_schedule and metar else None
+    if offset is None:
+        return None
+
+    last_burst = now - now % 3600 + offset % 3600
+    if last_burst > now:
+        last_burst -= 3600
+    return min(wxfetch.products['metar']['max_age'], now - last_burst)
+
+
+#Show what has been learned so far.
+if __name__ == '__main__':
+    schedule = read_schedule()
+    offset = burst_offset(schedule)
+    print('Observations by minute: ' + str(schedule.get('minutes')))
+    if offset is None:
+        print('Not enough learned yet, refreshing every update_interval minutes')
+    else:
+        print('Refreshing ' + str(int(offset // 60)) + ' minutes ' + str(int(offset % 60)) + ' seconds after the hour')
@@ -0,0 +1,123 @@
+#wxstate.py - by Mark Harris. Compact weather state for each airport on the map, used by metar-v4.py
+#    The decoded weather used to be kept as strings in three dictionaries, flight category, winds and weather, looked up
+#    by airport for every LED in each of the six display cycles, with the weather string split up each time.
+#    Each airport is now one small StationState holding numbers, worked out once when the weather is decoded, and the
+#    states are lined up by LED pin once per refresh so the display loop only has to index a list.
+#    Every code in the weather string counts, not just the first, and the one to show is picked when it's decoded.
+#    TAF's are decoded once into a Timeline of states for each hour ahead, so any TAF hour is a lookup.
+
+#Import needed libraries
+import calendar
+import enum
+import time
+
+#Misc settings
+taf_hours = 31                                  #Hours in a TAF Timeline, now through +30 hours, the longest a TAF runs
+
+#Flight categories. The names match the FAA's, so Category['IFR'] is the category for 'IFR'.
+class Category(enum.IntEnum):
+    NONE = 0                                    #No weather reported
+    VFR = 1
+    MVFR = 2
+    IFR = 3
+    LIFR = 4
+
+#Bits for the weather the display loop shows.
+LGHTN = 1                                       #Thunderstorms and lightning
+SNOW = 2
+RAIN = 4
+FRRAIN = 8                                      #Freezing rain
+DUSTSANDASH = 16                                #Dust, sand or ash
+FOG = 32
+
+#The display loop shows one weather effect for an airport. When more than one is reported, the first of these is
+#shown, i.e. thunderstorms over the rain with them, and the rain in '-RA BR' over the mist (BR).
+wx_priority = (LGHTN, FRRAIN, SNOW, RAIN, DUSTSANDASH, FOG)
+
+#Lookup from a reported weather code, i.e. '-RA', to its bits. 'checks' pairs each bit with the codes that set it,
+#i.e. ((RAIN, wx_rain_ck), (FOG, wx_fog_ck)). Built once from the lists in metar-v4.py.
+def wx_lookup(checks):
+    codes = {}
+    for bit, wx_codes in checks:
+        for code in wx_codes:
+            codes[code] = codes.get(code, 0) | bit
+    return codes
+
+#Bits for every code in a weather string, i.e. '-RA BR' is RAIN | FOG. Codes that aren't in 'wx_codes' add nothing.
+def wx_bits(wxstring, wx_codes):
+    bits = 0
+    for code in wxstring.split():
+        bits |= wx_codes.get(code, 0)
+    return bits
+
+#The one bit of 'bits' to show, see wx_priority, or 0 for none.
+def shown_bit(bits):
+    for bit in wx_priority:
+        if bits & bit:
+            return bit
+    return 0
+
+#Whole number from FAA text, i.e. a wind speed. Blank, 'VRB' or anything else that isn't a number is 0.
+def to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+#Seconds since 1970 from an FAA time, i.e. '2020-03-24T18:53:00Z'. 0 if it's blank or not a time.
+def to_epoch(zulu):
+    try:
+        return calendar.timegm(time.strptime(zulu, '%Y-%m-%dT%H:%M:%SZ'))
+    except (TypeError, ValueError):
+        return 0
+
+#Weather for one airport. Its whole weather string is looked up once, when it's decoded: 'phenomena' has the bits for
+#every code reported, see wx_lookup(), and 'wx' the one of them shown, so the display loop only tests a bit.
+#'weather' is the first weather code reported, i.e. '-RA', or 'NONE', for the logs, and 'wxstring' all of them.
+#'wind_dir' is 0 for calm or variable winds, and 'obs_time' is when a METAR was observed, see to_epoch(), or 0.
+class StationState:
+    __slots__ = ('category', 'wind', 'gust', 'wx', 'phenomena', 'weather', 'wxstring', 'wind_dir', 'obs_time')
+
+    def __init__(self, flightcategory, wind, gust, wxstring, wx_codes, wind_dir=0, obs_time=0):
+        self.category = Category.__members__.get(flightcategory, Category.NONE)
+        self.wind = to_int(wind)
+        self.gust = to_int(gust)
+        self.wind_dir = to_int(wind_dir)
+        if not 0 <= self.wind_dir <= 360:       #MOS sends 990 when it has no direction
+            self.wind_dir = 0
+        self.obs_time = obs_time
+        wxstring = wxstring or "NONE"
+        self.wxstring = wxstring
+        self.weather = wxstring.split(" ", 1)[0]
+        self.phenomena = wx_bits(wxstring, wx_codes)
+        self.wx = shown_bit(self.phenomena)
+
+no_weather = StationState("NONE", 0, 0, "NONE", {}) #Shared by every LED without weather
+
+#The state for each LED pin, in the same order as the airports file. 'states' are by airport id.
+def led_table(airports, states):
+    return [states.get(airportcode, no_weather) for airportcode in airports]
+
+#TAF weather for every hour from 'start', a time.time(), through 'hours' - 1 hours later. 'by_station' holds a list
+#of StationStates for each airport, one per hour, filled in by metar-v4.py. Built once per TAF update, so turning the
+#rotary switch to another hour only picks a different state for each airport rather than decoding the TAF's again.
+class Timeline:
+    __slots__ = ('start', 'hours', 'by_station')
+
+    def __init__(self, hours=taf_hours, start=None):
+        self.start = time.time() if start is None else start
+        self.hours = hours
+        self.by_station = {}
+
+    #Each hour as the TAF's write times, i.e. '2020-03-24T18:21:54Z'.
+    def zulu_times(self):
+        return [time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.start + hour * 3600)) for hour in range(self.hours)]
+
+    #Weather by airport 'hour_offset' hours from now. Hours since the timeline was built are added on, so it keeps
+    #showing the right hour until the next update. Airports the TAF doesn't reach that far show no weather.
+    def states(self, hour_offset, now=None):
+        now = time.time() if now is None else now
+        hour = hour_offset + max(0, int((now - self.start) // 3600))
+        if not 0 <= hour < self.hours:
+            return {}
+        return {stationId: hours[hour] for stationId, hours in self.by_station.items()}
@@ -0,0 +1,164 @@
+#wxtable.py - by Mark Harris. Decoded weather shared between the scripts through a memory mapped file.
+#    metar-v4.py and metar-display-v4.py used to fetch and decode the weather separately, so after an update the
+#    OLED's could show different weather than the LED's for a few minutes. metar-v4.py now publishes what it decoded
+#    here, one fixed size row per LED pin, and metar-display-v4.py and webapp.py read the rows straight from the file.
+#    The file sits in /dev/shm, which is memory, so nothing is written to the SD card.
+#
+#    The header holds a generation number. metar-v4.py makes it odd before changing any rows and even again once
+#    they're all written, so a reader that sees the same even number before and after reading has a whole update,
+#    and one that sees a different number than last time knows the weather changed without looking at the rows.
+#    When the number of LED pins changes, a new file is written and renamed over the old one.
+
+#Import needed libraries
+import collections
+import mmap
+import os
+import struct
+import time
+from logzero import logger
+import wxstate                                  #Categories and weather bits the rows hold
+
+#Misc settings
+table_dir = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp' #Memory backed where there is one
+table_file = os.path.join(table_dir, 'livesectional-wx') #File the table is kept in
+read_tries = 50                                 #Reads that caught metar-v4.py part way through an update before giving up
+read_wait = 0.002                               #Seconds between those reads
+
+#Layout. Little endian with no padding, so it's the same from any script or language.
+#Header: magic, layout version, generation, rows, mode (0 = TAF, 1 = METAR, 2 = MOS, 3 = Heat Map), hour offset
+#for TAF's and MOS, and when it was published as a time.time().
+magic = b'LSWX'
+version = 2
+header = struct.Struct('<4sHIIBbd')
+#Row for each LED pin: airport id, 1 if it has weather, wxstate.Category, shown weather bit, bits for all weather, wind
+#direction (0 for calm or variable), wind speed, gust, observation time as seconds since 1970 (0 for forecasts) and the
+#weather string. The weather string is cut at 'weather_size' characters, room for the 3 weather groups a METAR or TAF
+#can have and a vicinity group, i.e. '+TSRAGR FZFG BLSN VCSH', with plenty to spare.
+weather_size = 48
+row = struct.Struct('<8sBBBBHHHI' + str(weather_size) + 's')
+generation_at = 6                               #Offset of the generation in the header
+
+#A row read back out of the table. 'category' is a wxstate.Category.
+Row = collections.namedtuple('Row', 'station reported category wx phenomena wind_dir wind gust obs_time weather')
+
+#A whole table read at one generation. 'rows' are by LED pin.
+Table = collections.namedtuple('Table', 'generation mode hour_offset published rows')
+
+
+#Publish the weather shown on the LED's. 'airports' are by LED pin and 'states' are the wxstate.StationState for
+#each, i.e. from wxstate.led_table(). 'mode' and 'hour_offset' are metar-v4.py's metar_taf_mos and hour_to_display.
+class TableWriter:
+    def __init__(self, path=table_file):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.rows = -1
+
+    def publish(self, airports, states, mode, hour_offset):
+        try:
+            if len(airports) != self.rows:
+                self.create(len(airports))
+            generation = struct.unpack_from('<I', self.map, generation_at)[0] | 1
+            struct.pack_into('<I', self.map, generation_at, generation) #Odd, readers wait until it's even again
+            offset = header.size
+            for airportcode, state in zip(airports, states):
+                row.pack_into(self.map, offset, airportcode.encode('ascii', 'replace')[:8],
+                              state is not wxstate.no_weather, state.category, state.wx, state.phenomena,
+                              state.wind_dir, state.wind, state.gust, state.obs_time,
+                              state.wxstring.encode('ascii', 'replace')[:weather_size])
+                offset += row.size
+            header.pack_into(self.map, 0, magic, version, (generation + 1) & 0xFFFFFFFF, self.rows, mode,
+                             hour_offset, time.time())
+        except (IOError, OSError, struct.error) as error:
+            logger.warning('Could not publish the weather table - ' + str(error))
+            self.close()
+
+    #New file sized for 'rows' LED pins, renamed over the old one so readers never see it part written. It starts at
+    #generation 1, i.e. being written, so it isn't read until the first publish() is done with it.
+    def create(self, rows):
+        self.close()
+        temp_path = self.path + '.' + str(os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(header.pack(magic, version, 1, rows, 0, 0, 0.0) + bytes(row.size * rows))
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.rows = rows
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+        self.file = None
+        self.map = None
+        self.rows = -1
+
+
+#Read the table metar-v4.py publishes. The file is mapped once and only mapped again when metar-v4.py replaces it.
+class TableReader:
+    def __init__(self, path=table_file):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.inode = None
+
+    #Map the file if it's new, returns False if there isn't one.
+    def open(self):
+        try:
+            inode = os.stat(self.path).st_ino
+            if inode != self.inode:
+                self.close()
+                self.file = open(self.path, 'rb')
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.inode = inode
+        except (IOError, OSError, ValueError):
+            self.close()
+            return False
+        if self.map[:4] != magic or struct.unpack_from('<H', self.map, 4)[0] != version:
+            self.close()
+            return False
+        return True
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+        self.file = None
+        self.map = None
+        self.inode = None
+
+    #Current generation, or None if nothing has been published. Cheap enough to check every display cycle.
+    def generation(self):
+        if not self.open():
+            return None
+        return struct.unpack_from('<I', self.map, generation_at)[0]
+
+    #The whole table, or None if nothing has been published or metar-v4.py kept updating it for all of read_tries.
+    def read(self):
+        for _ in range(read_tries):
+            if not self.open():
+                return None
+            _, _, generation, rows, mode, hour_offset, published = header.unpack_from(self.map, 0)
+            if not generation & 1 and header.size + rows * row.size <= len(self.map):
+                table = Table(generation, mode, hour_offset, published,
+                              [self.row_at(header.size + n * row.size) for n in range(rows)])
+                if struct.unpack_from('<I', self.map, generation_at)[0] == generation:
+                    return table
+            time.sleep(read_wait)
+        logger.warning('Weather table kept changing while it was read')
+        return None
+
+    def row_at(self, offset):
+        station, reported, category, wx, phenomena, wind_dir, wind, gust, obs_time, weather = row.unpack_from(self.map, offset)
+        return Row(station.rstrip(b'\0').decode('ascii'), bool(reported), wxstate.Category(category), wx, phenomena,
+                   wind_dir, wind, gust, obs_time, weather.rstrip(b'\0').decode('ascii'))
+
+    #The table if it was published within 'max_age' seconds and shows 'mode' and 'hour_offset', otherwise None.
+    #The hour offset only matters for TAF's and MOS.
+    def current(self, mode, hour_offset, max_age):
+        table = self.read()
+        if table is None or table.mode != mode or time.time() - table.published > max_age:
+            return None
+        if mode in (0, 2) and table.hour_offset != hour_offset:
+            return None
+        return table